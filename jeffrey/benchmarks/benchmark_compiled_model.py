@@ -0,0 +1,125 @@
+import argparse
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+
+from jeffrey.models.adapters import MLPWithPooling
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.heads import SigmoidHead
+from jeffrey.models.models import BinaryTextClassificationModel
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation
+from jeffrey.utils.torch_utils import compile_model_forward, warm_up_compiled_model
+
+
+def create_model(
+    pretrained_model_name_or_path: str,
+    max_sequence_len: int,
+    static_sequence_lengths: Optional[list[int]],
+) -> BinaryTextClassificationModel:
+    transformation = HuggingFaceTokenizationTransformation(
+        pretrained_model_name_or_path, max_sequence_len, static_sequence_lengths=static_sequence_lengths
+    )
+    backbone = HuggingFaceBackbone(pretrained_model_name_or_path, transformation, pretrained=True)
+    hidden_size = backbone.backbone.config.hidden_size
+    adapter = MLPWithPooling([hidden_size], output_attribute_to_use="pooler_output")
+    return BinaryTextClassificationModel(backbone, SigmoidHead(hidden_size, 1), adapter)
+
+
+def create_batches(
+    transformation: HuggingFaceTokenizationTransformation,
+    batch_size: int,
+    num_batches: int,
+    seed: int = 1234
+) -> list[list[str]]:
+    '''Texts of random lengths, so that every eager batch has a different sequence length'''
+    rng = np.random.default_rng(seed)
+    vocab = [token for token in transformation.tokenizer.get_vocab() if token.isalpha()]
+    return [
+        [" ".join(rng.choice(vocab, size=rng.integers(3, transformation.max_sequence_len))) for _ in range(batch_size)]
+        for _ in range(num_batches)
+    ]
+
+
+def measure_steps_per_second(
+    model: BinaryTextClassificationModel,
+    batches: list[list[str]],
+    device: torch.device,
+    training: bool
+) -> float:
+    transformation = model.get_transformation()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    encoded_batches = [transformation(texts).to(device) for texts in batches]
+    labels = torch.ones((len(batches[0]), 1), device=device)
+
+    model.train(training)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for encodings in encoded_batches:
+        if training:
+            loss = torch.nn.functional.binary_cross_entropy(model(encodings), labels)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+        else:
+            with torch.no_grad():
+                model(encodings)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return len(encoded_batches) / (time.perf_counter() - start)
+
+
+def benchmark(
+    pretrained_model_name_or_path: str,
+    max_sequence_len: int,
+    static_sequence_lengths: list[int],
+    batch_size: int,
+    num_batches: int,
+    compile_mode: Optional[str],
+) -> None:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    eager_model = create_model(pretrained_model_name_or_path, max_sequence_len, None).to(device)
+    compiled_model = create_model(pretrained_model_name_or_path, max_sequence_len, static_sequence_lengths).to(device)
+    compiled_transformation = compiled_model.get_transformation()
+    assert isinstance(compiled_transformation, HuggingFaceTokenizationTransformation)
+
+    start = time.perf_counter()
+    compile_model_forward(compiled_model, mode=compile_mode)
+    for training in [True, False]:
+        warm_up_compiled_model(compiled_model, compiled_transformation, [batch_size], device, training=training)
+    warmup_time = time.perf_counter() - start
+
+    batches = create_batches(compiled_transformation, batch_size, num_batches)
+    print(f"device={device}, batch_size={batch_size}, batches={num_batches}, static lengths={compiled_transformation.static_sequence_lengths}")
+    print(f"compilation + warmup: {warmup_time:.1f}s")
+    for training in [True, False]:
+        eager_steps_per_second = measure_steps_per_second(eager_model, batches, device, training)
+        compiled_steps_per_second = measure_steps_per_second(compiled_model, batches, device, training)
+        mode = "training " if training else "inference"
+        print(
+            f"{mode}: eager {eager_steps_per_second:.2f} steps/s, compiled {compiled_steps_per_second:.2f} steps/s "
+            f"({compiled_steps_per_second / eager_steps_per_second:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eager (dynamic padding) vs. compiled (static length buckets) model steps per second")
+    parser.add_argument("--pretrained-model-name-or-path", type=str, default="prajjwal1/bert-tiny")
+    parser.add_argument("--max-sequence-len", type=int, default=128)
+    parser.add_argument("--static-sequence-lengths", type=int, nargs="+", default=[32, 64, 96])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--num-batches", type=int, default=50)
+    parser.add_argument("--compile-mode", type=str, default=None)
+    args = parser.parse_args()
+
+    benchmark(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        max_sequence_len=args.max_sequence_len,
+        static_sequence_lengths=args.static_sequence_lengths,
+        batch_size=args.batch_size,
+        num_batches=args.num_batches,
+        compile_mode=args.compile_mode,
+    )
@@ -0,0 +1,79 @@
+import argparse
+import os
+import tempfile
+
+from torch.utils.data import DataLoader, Dataset
+
+from jeffrey.benchmarks.benchmark_text_classification_dataset import create_synthetic_split
+from jeffrey.data_modules.dataset import MemoryMappedTextClassificationDataset, TextClassificationDataset
+from jeffrey.data_modules.text_store import get_text_store
+
+
+def read_memory_usage(pid: int) -> dict[str, int]:
+    '''Pss, Private_Clean and Private_Dirty of a process, in kB (Linux only)'''
+    memory_usage = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            key, *values = line.split()
+            if key.rstrip(":") in ["Rss", "Pss", "Private_Clean", "Private_Dirty"]:
+                memory_usage[key.rstrip(":")] = int(values[0])
+    return memory_usage
+
+
+def measure_workers(dataset: Dataset, batch_size: int, num_workers: int) -> dict[str, int]:
+    '''
+    Go through one shuffled epoch and sum the memory of all workers right before the end.
+    Private_Dirty is what copy-on-write costs: pages of the parent that a worker ended up duplicating.
+    '''
+    data_loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        collate_fn=lambda batch: len(batch),
+        multiprocessing_context="fork",
+    )
+    iterator = iter(data_loader)
+    num_batches = len(data_loader)
+    for _ in range(num_batches - 2 * num_workers):
+        next(iterator)
+
+    total: dict[str, int] = {}
+    for worker in iterator._workers:  # type: ignore
+        for key, value in read_memory_usage(worker.pid).items():
+            total[key] = total.get(key, 0) + value
+
+    for _ in iterator:
+        pass
+    return total
+
+
+def benchmark(num_rows: int, batch_size: int, num_workers: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        df_path = os.path.join(temp_dir, "train.parquet")
+        create_synthetic_split(df_path, num_rows)
+
+        datasets = {
+            "pandas": TextClassificationDataset(df_path, "cleaned_text", "label"),
+            "memory_mapped": MemoryMappedTextClassificationDataset(
+                get_text_store(df_path, "cleaned_text", "label", os.path.join(temp_dir, "text_store"))
+            ),
+        }
+
+        print(f"rows={num_rows}, batch_size={batch_size}, workers={num_workers} (kB summed over workers)")
+        for name, dataset in datasets.items():
+            usage = measure_workers(dataset, batch_size, num_workers)
+            print(
+                f"{name:<14} Rss {usage['Rss']:>9}  Pss {usage['Pss']:>9}  "
+                f"Private_Dirty {usage['Private_Dirty']:>9}  Private_Clean {usage['Private_Clean']:>9}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy-on-write memory of DataLoader workers: pandas vs. memory-mapped")
+    parser.add_argument("--num-rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--num-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    benchmark(num_rows=args.num_rows, batch_size=args.batch_size, num_workers=args.num_workers)
@@ -0,0 +1,75 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from torch.utils.data import Dataset, default_collate
+
+from jeffrey.data_modules.dataset import ColumnarTextClassificationDataset, TextClassificationDataset
+
+
+def create_synthetic_split(path: str, num_rows: int, seed: int = 1234) -> None:
+    rng = np.random.default_rng(seed)
+    words = np.array(["you", "are", "so", "dumb", "nice", "game", "lol", "stop", "it", "please", "idiot", "friend"])
+    lengths = rng.integers(3, 40, size=num_rows)
+    texts = [" ".join(rng.choice(words, size=length)) for length in lengths]
+    pd.DataFrame(
+        {
+            "text": texts,
+            "cleaned_text": texts,
+            "label": rng.integers(0, 2, size=num_rows),
+            "source": rng.choice(["twitter", "youtube", "kaggle"], size=num_rows),
+        }
+    ).to_parquet(path)
+
+
+def fetch_per_row(dataset: Dataset, indices: list[int]) -> None:
+    default_collate([dataset[idx] for idx in indices])
+
+
+def fetch_batched(dataset: ColumnarTextClassificationDataset, indices: list[int]) -> None:
+    dataset.__getitems__(indices)
+
+
+def benchmark(num_rows: int, batch_size: int, num_batches: int) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        df_path = os.path.join(temp_dir, "train.parquet")
+        create_synthetic_split(df_path, num_rows)
+
+        rng = np.random.default_rng(0)
+        batches = [rng.integers(0, num_rows, size=batch_size).tolist() for _ in range(num_batches)]
+
+        start = time.perf_counter()
+        pandas_dataset = TextClassificationDataset(df_path, "cleaned_text", "label")
+        pandas_load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        columnar_dataset = ColumnarTextClassificationDataset(df_path, "cleaned_text", "label")
+        columnar_load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for indices in batches:
+            fetch_per_row(pandas_dataset, indices)
+        pandas_fetch_time = (time.perf_counter() - start) / num_batches
+
+        start = time.perf_counter()
+        for indices in batches:
+            fetch_batched(columnar_dataset, indices)
+        columnar_fetch_time = (time.perf_counter() - start) / num_batches
+
+    print(f"rows={num_rows}, batch_size={batch_size}, batches={num_batches}")
+    print(f"pandas   (per-row iloc):   load {pandas_load_time:.3f}s, {pandas_fetch_time * 1e3:.3f} ms/batch")
+    print(f"columnar (__getitems__):   load {columnar_load_time:.3f}s, {columnar_fetch_time * 1e3:.3f} ms/batch")
+    print(f"speedup per batch: {pandas_fetch_time / columnar_fetch_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-row pandas vs. batched columnar dataset fetch benchmark")
+    parser.add_argument("--num-rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--num-batches", type=int, default=50)
+    args = parser.parse_args()
+
+    benchmark(num_rows=args.num_rows, batch_size=args.batch_size, num_batches=args.num_batches)
@@ -0,0 +1,110 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from jeffrey.models.adapters import MLPWithPooling
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.heads import SigmoidHead
+from jeffrey.models.models import BinaryTextClassificationModel
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation
+
+
+def create_model(pretrained_model_name_or_path: str, max_sequence_len: int, unpadded: bool) -> BinaryTextClassificationModel:
+    transformation = HuggingFaceTokenizationTransformation(pretrained_model_name_or_path, max_sequence_len)
+    backbone = HuggingFaceBackbone(pretrained_model_name_or_path, transformation, pretrained=True, unpadded=unpadded)
+    hidden_size = backbone.backbone.config.hidden_size
+    adapter = MLPWithPooling([hidden_size], pooling_method="mean_pooler", output_attribute_to_use="last_hidden_state")
+    return BinaryTextClassificationModel(backbone, SigmoidHead(hidden_size, 1), adapter)
+
+
+def create_batches(
+    transformation: HuggingFaceTokenizationTransformation,
+    batch_size: int,
+    num_batches: int,
+    mean_length: int,
+    seed: int = 1234
+) -> list[list[str]]:
+    '''Texts with exponentially distributed lengths, so that most of a padded batch is padding'''
+    rng = np.random.default_rng(seed)
+    vocab = [token for token in transformation.tokenizer.get_vocab() if token.isalpha()]
+    lengths = np.clip(rng.exponential(mean_length, size=(num_batches, batch_size)).astype(int), 1, transformation.max_sequence_len)
+    return [[" ".join(rng.choice(vocab, size=length)) for length in batch_lengths] for batch_lengths in lengths]
+
+
+def measure_steps_per_second(
+    model: BinaryTextClassificationModel,
+    batches: list[list[str]],
+    device: torch.device,
+    training: bool
+) -> float:
+    transformation = model.get_transformation()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    encoded_batches = [transformation(texts).to(device) for texts in batches]
+    labels = torch.ones((len(batches[0]), 1), device=device)
+
+    model.train(training)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for encodings in encoded_batches:
+        if training:
+            loss = torch.nn.functional.binary_cross_entropy(model(encodings), labels)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+        else:
+            with torch.no_grad():
+                model(encodings)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return len(encoded_batches) / (time.perf_counter() - start)
+
+
+def benchmark(
+    pretrained_model_name_or_path: str,
+    max_sequence_len: int,
+    batch_size: int,
+    num_batches: int,
+    mean_length: int,
+) -> None:
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    padded_model = create_model(pretrained_model_name_or_path, max_sequence_len, unpadded=False).to(device)
+    unpadded_model = create_model(pretrained_model_name_or_path, max_sequence_len, unpadded=True).to(device)
+    unpadded_model.load_state_dict(padded_model.state_dict())
+
+    transformation = padded_model.get_transformation()
+    assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+    batches = create_batches(transformation, batch_size, num_batches, mean_length)
+    encoded_batches = [transformation(texts) for texts in batches]
+    real_tokens = sum(int(encodings["attention_mask"].sum()) for encodings in encoded_batches)
+    padded_tokens = sum(encodings["input_ids"].numel() for encodings in encoded_batches)
+    print(f"device={device}, batch_size={batch_size}, batches={num_batches}, real tokens={real_tokens / padded_tokens:.1%} of padded tokens")
+
+    for training in [True, False]:
+        padded_steps_per_second = measure_steps_per_second(padded_model, batches, device, training)
+        unpadded_steps_per_second = measure_steps_per_second(unpadded_model, batches, device, training)
+        mode = "training " if training else "inference"
+        print(
+            f"{mode}: padded {padded_steps_per_second:.2f} steps/s, unpadded {unpadded_steps_per_second:.2f} steps/s "
+            f"({unpadded_steps_per_second / padded_steps_per_second:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Padded vs. unpadded (real tokens only) backbone forward steps per second")
+    parser.add_argument("--pretrained-model-name-or-path", type=str, default="prajjwal1/bert-tiny")
+    parser.add_argument("--max-sequence-len", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--num-batches", type=int, default=30)
+    parser.add_argument("--mean-length", type=int, default=24)
+    args = parser.parse_args()
+
+    benchmark(
+        pretrained_model_name_or_path=args.pretrained_model_name_or_path,
+        max_sequence_len=args.max_sequence_len,
+        batch_size=args.batch_size,
+        num_batches=args.num_batches,
+        mean_length=args.mean_length,
+    )
@@ -12,12 +12,16 @@ class LightningModuleConfig(LoggerbleParamsMixin):
 
 
 @dataclass
-class TaskConfig(LoggerbleParamsMixin):
+class BaseTaskConfig(LoggerbleParamsMixin):
     _target_: str = MISSING
     task_name: str = MISSING
-    data_module: data_module_schema.DataModuleConfig = MISSING
-    lightning_module: LightningModuleConfig = MISSING
-    trainer: trainer_schemas.TrainerConfig = MISSING
     
     def loggable_params(self) -> list[str]:
-        return ["_target_"]
\ No newline at end of file
+        return ["_target_"]
+
+
+@dataclass
+class TaskConfig(BaseTaskConfig):
+    data_module: data_module_schema.DataModuleConfig = MISSING
+    lightning_module: LightningModuleConfig = MISSING
+    trainer: trainer_schemas.TrainerConfig = MISSING
\ No newline at end of file
@@ -5,6 +5,7 @@
 
 from jeffrey.config_schemas.evaluation import model_selector_schemas
 from jeffrey.config_schemas.infrastructure import infrastructure_schema
+from jeffrey.config_schemas.preprocessing import preprocessing_task_schemas
 from jeffrey.config_schemas.training import training_task_schemas
 from jeffrey.config_schemas import base_schemas
 
@@ -14,7 +15,8 @@ class Config:
     infrastructure: infrastructure_schema.InfrastructureConfig = infrastructure_schema.InfrastructureConfig()
     save_last_checkpoint_every_n_train_steps: int = 50
     seed: int = 1234
-    tasks: Dict[str, base_schemas.TaskConfig] = MISSING
+    registry_max_memory_mb: int = 4096  # built datasets, tokenizers and models shared between tasks, 0 disables
+    tasks: Dict[str, base_schemas.BaseTaskConfig] = MISSING
     model_selector: Optional[model_selector_schemas.ModelSelectorConfig] = None
     registered_model_name: Optional[str] = None
     docker_image: Optional[str] = None
@@ -24,6 +26,7 @@ def register_config() -> None:
     infrastructure_schema.register_config()
     training_task_schemas.register_config()
     model_selector_schemas.register_config()
+    preprocessing_task_schemas.register_config()
     
     cs = ConfigStore.instance()
     cs.store(name="config_schema", node=Config)
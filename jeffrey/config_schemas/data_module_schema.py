@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Optional
 
 from omegaconf import MISSING, SI
 from hydra.core.config_store import ConfigStore
@@ -31,6 +31,26 @@ class TextClassificationDataModuleConfig(DataModuleConfig):
     text_column_name: str = "cleaned_text"
     label_column_name: str = "label"
     transformation: transformations_schemas.TransformationConfig = MISSING
+    dataset_format: str = "pandas"  # pandas, columnar, memory_mapped, streaming
+    use_tokenization_cache: bool = False
+    tokenization_cache_dir: Optional[str] = None  # None: next to each split
+    length_bucketing: bool = False
+    bucket_size_multiplier: int = 50
+    max_tokens_per_batch: Optional[int] = None  # token-budget batches, batch_size then caps samples per batch
+    use_recommended_bucket_boundaries: bool = False  # from the statistics manifest of the train split
+    statistics_dir: Optional[str] = None  # None: next to each split
+    shuffle_buffer_size: int = 10_000  # streaming only
+    packing: bool = False  # several examples per sequence, needs a backbone accepting 3D attention masks
+    compact_batches: bool = False  # int16/int32 ids and lengths in one buffer, expanded on the device by the backbone
+    staging: bool = False  # download gs:// splits once per node, local rank 0 only
+    staging_dir: str = "/tmp/jeffrey-staging"
+    background_staging: bool = False  # start staging while the model is being built
+    text_store_dir: str = "/tmp/jeffrey-text-store"  # memory_mapped only, must be node-local
+    resumable: bool = False  # resume mid-epoch from checkpoints at the exact batch
+    use_embedding_store: bool = False  # frozen backbone, only the adapter and head are trained from stored outputs
+    embedding_store_output: str = "pooler_output"  # pooler_output, last_hidden_state (real tokens only)
+    embedding_store_dir: str = "/tmp/jeffrey-embedding-store"  # must be node-local
+    seed: int = SI("${seed}")
     
 
 @dataclass
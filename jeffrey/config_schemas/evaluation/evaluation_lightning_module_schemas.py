@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 from omegaconf import MISSING
 
@@ -9,9 +10,11 @@
 class EvaluationLightningModuleConfig(LightningModuleConfig):
     _target_: str = MISSING
     _partial_: bool = False
+    compile_model: bool = False  # torch.compile the model, needs transformation.static_sequence_lengths
+    compile_mode: Optional[str] = None
     
     def loggable_params(self) -> list[str]:
-        return ["_target_"]
+        return ["_target_", "compile_model", "compile_mode"]
     
     
 @dataclass
@@ -21,4 +24,5 @@ class PartialEvaluationLightningModuleConfig(EvaluationLightningModuleConfig):
     
 @dataclass
 class BinaryTextEvaluationLightningModuleConfig(PartialEvaluationLightningModuleConfig):
-    _target_: str = "jeffrey.evaluation.lightning_modules.binary_text_evaluation.BinaryTextEvaluationLightningModule"
\ No newline at end of file
+    _target_: str = "jeffrey.evaluation.lightning_modules.binary_text_evaluation.BinaryTextEvaluationLightningModule"
+    exit_thresholds: Optional[list[float]] = None  # Early exit models only, tradeoff thresholds (None: defaults)
\ No newline at end of file
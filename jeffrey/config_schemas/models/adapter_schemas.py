@@ -24,7 +24,7 @@ class MLPWithPoolingConfig(AdapterConfig):
     batch_norms: Optional[List[bool]] = None
     order: str = "LBADN"
     standardize_input: bool = True
-    pooling_method: Optional[str] = None
+    pooling_method: Optional[str] = None  # mean_pooler, max_pooler, cls_pooler, over real tokens only
     output_attribute_to_use: Optional[str] = None
     
     def loggable_params(self) -> List[str]:
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 from omegaconf import MISSING
 from hydra.core.config_store import ConfigStore
 
@@ -23,9 +24,25 @@ class HuggingFaceBackboneConfig(BackboneConfig):
     _target_: str = "jeffrey.models.backbones.HuggingFaceBackbone"
     pretrained_model_name_or_path: str = MISSING
     pretrained: bool = False
+    trim_vocab: bool = False
+    # Set by the training task once the vocab is trimmed, so that exported models are rebuilt trimmed
+    trimmed_vocab_size: Optional[int] = None
+    unpadded: bool = False  # run the real tokens only, BERT models
+    # Set by the pruning task, so that exported pruned models are rebuilt with their layers, heads and FFN widths
+    pruned_num_layers: Optional[int] = None
+    pruned_heads: Optional[list[list[int]]] = None
+    intermediate_sizes: Optional[list[int]] = None
+    # LoRA: train rank lora_rank updates of the attention / FFN projections only (None: full fine-tuning),
+    # merged into the weights when the model is exported
+    lora_rank: Optional[int] = None
+    lora_alpha: float = 16.0
+    lora_dropout: float = 0.0
+    lora_target_modules: Optional[list[str]] = None  # Module name suffixes, None: every attention / FFN projection
     
     def loggable_params(self) -> list[str]:
-        return super().loggable_params() + ["pretrained_model_name_or_path", "pretrained"]
+        return super().loggable_params() + [
+            "pretrained_model_name_or_path", "pretrained", "trim_vocab", "unpadded", "lora_rank", "lora_alpha"
+        ]
     
     
 @dataclass
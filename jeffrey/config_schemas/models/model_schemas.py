@@ -23,6 +23,29 @@ class BinaryTextClassificationModelConfig(ModelConfig):
     adapter: Optional[adapter_schemas.AdapterConfig] = None
     
 
+@dataclass
+class MultiBranchBinaryTextClassificationModelConfig(BinaryTextClassificationModelConfig):
+    _target_: str = "jeffrey.models.models.MultiBranchBinaryTextClassificationModel"
+    branch_heads: list[head_schemas.HeadConfig] = MISSING  # Heads of branches 1..K-1, branch 0 is adapter and head
+    branch_adapters: Optional[list[Optional[adapter_schemas.AdapterConfig]]] = None  # None: no adapters
+    output_branch: Optional[int] = None  # None: mean of every branch, set by the training task when exporting
+    
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["output_branch"]
+    
+    
+@dataclass
+class EarlyExitBinaryTextClassificationModelConfig(BinaryTextClassificationModelConfig):
+    _target_: str = "jeffrey.models.models.EarlyExitBinaryTextClassificationModel"
+    exit_layers: list[int] = MISSING  # Backbone layers (1 is the first one) followed by an exit, below the last layer
+    exit_adapters: list[adapter_schemas.AdapterConfig] = MISSING  # Pooling last_hidden_state, one per exit
+    exit_heads: list[head_schemas.HeadConfig] = MISSING  # One per exit
+    exit_threshold: float = 0.9  # Samples leave at the first exit at least this confident
+    
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["exit_layers", "exit_threshold"]
+    
+
 @dataclass
 class BertTinyBinaryTextClassificationModelConfig(BinaryTextClassificationModelConfig):
     backbone: backbone_schemas.BackboneConfig = backbone_schemas.BertTinyHuggingFaceBackboneConfig()
@@ -41,6 +64,16 @@ def register_config() -> None:
         group="tasks/lightning_module/model",
         node=BinaryTextClassificationModelConfig
     )
+    cs.store(
+        name="multi_branch_binary_text_classification_model_schema",
+        group="tasks/lightning_module/model",
+        node=MultiBranchBinaryTextClassificationModelConfig
+    )
+    cs.store(
+        name="early_exit_binary_text_classification_model_schema",
+        group="tasks/lightning_module/model",
+        node=EarlyExitBinaryTextClassificationModelConfig
+    )
     cs.store(
         name="test_model_schema",
         node=BertTinyBinaryTextClassificationModelConfig
@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+from typing import Optional
+
 from hydra.core.config_store import ConfigStore
 from omegaconf import MISSING
 
@@ -18,9 +20,13 @@ class HuggingFaceTokenizationTransformationConfig(TransformationConfig):
     _target_: str = "jeffrey.models.transformations.HuggingFaceTokenizationTransformation"
     pretrained_tokenizer_name_or_path: str = MISSING
     max_sequence_len: int = MISSING
+    cache_size: int = 0  # LRU of tokenized texts, 0 disables it
+    static_sequence_lengths: Optional[list[int]] = None  # pad batches to these lengths only, for compiled models
     
     def loggable_params(self) -> list[str]:
-        return super().loggable_params() + ["pretrained_tokenizer_name_or_path", "max_sequence_len"]
+        return super().loggable_params() + [
+            "pretrained_tokenizer_name_or_path", "max_sequence_len", "cache_size", "static_sequence_lengths"
+        ]
     
     
 @dataclass
@@ -0,0 +1,101 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from hydra.core.config_store import ConfigStore
+from omegaconf import MISSING, SI
+
+from jeffrey.config_schemas.base_schemas import BaseTaskConfig
+
+
+@dataclass
+class PreprocessingTaskConfig(BaseTaskConfig):
+    pass
+
+
+@dataclass
+class TextPreprocessingTaskConfig(PreprocessingTaskConfig):
+    _target_: str = "jeffrey.preprocessing.tasks.text_preprocessing_task.TextPreprocessingTask"
+    task_name: str = "text_preprocessing_task"
+    raw_df_paths: list[str] = MISSING
+    output_dir: str = MISSING
+    text_column_name: str = "text"
+    cleaned_text_column_name: str = "cleaned_text"
+    label_column_name: str = "label"
+    valid_ratio: float = 0.1
+    test_ratio: float = 0.1
+    rebalance: bool = True
+    chunk_size: int = 100_000  # rows read from the raw files and cleaned at once
+    row_group_size: int = 50_000  # rows per row group of the written splits
+    num_workers: Optional[int] = None  # None: one process per CPU
+    lowercase: bool = True
+    url_replacement: str = " "
+    mention_replacement: str = " "
+    remove_emojis: bool = True
+    seed: int = SI("${seed}")
+
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["raw_df_paths", "output_dir", "rebalance", "row_group_size"]
+
+
+@dataclass
+class TokenizerTrainingTaskConfig(PreprocessingTaskConfig):
+    _target_: str = "jeffrey.preprocessing.tasks.tokenizer_training_task.TokenizerTrainingTask"
+    task_name: str = "tokenizer_training_task"
+    train_df_path: str = "gs://jeffrey-data-versioning/data/processed/rebalanced_splits/train.parquet"
+    output_dir: str = "gs://jeffrey-data-versioning/data/processed/rebalanced_splits/trained_tokenizer"
+    base_tokenizer_name_or_path: str = "bert-base-uncased"
+    vocab_size: int = 30_522
+    text_column_name: str = "cleaned_text"
+    batch_size: int = 10_000  # texts handed to the trainer at once
+
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["train_df_path", "output_dir", "base_tokenizer_name_or_path", "vocab_size"]
+
+
+@dataclass
+class DeduplicationTaskConfig(PreprocessingTaskConfig):
+    _target_: str = "jeffrey.preprocessing.tasks.deduplication_task.DeduplicationTask"
+    task_name: str = "deduplication_task"
+    df_paths: dict[str, str] = field(
+        default_factory=lambda: {
+            "train": "gs://jeffrey-data-versioning/data/processed/rebalanced_splits/train.parquet",
+            "valid": "gs://jeffrey-data-versioning/data/processed/rebalanced_splits/valid.parquet",
+            "test": "gs://jeffrey-data-versioning/data/processed/rebalanced_splits/test.parquet",
+        }
+    )
+    output_dir: str = MISSING
+    text_column_name: str = "cleaned_text"
+    split_priority: list[str] = field(default_factory=lambda: ["test", "valid", "train"])
+    similarity_threshold: float = 0.8  # estimated Jaccard similarity of character shingles
+    max_rows_per_cluster: int = 1  # 1 drops near-duplicates, larger values only down-weight big clusters
+    num_permutations: int = 128
+    num_bands: int = 32  # has to divide num_permutations
+    shingle_size: int = 5
+    chunk_size: int = 10_000  # texts per signature computation job
+    row_group_size: int = 50_000
+    num_workers: Optional[int] = None  # None: one process per CPU
+    seed: int = SI("${seed}")
+
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + [
+            "df_paths", "output_dir", "similarity_threshold", "max_rows_per_cluster", "num_permutations", "num_bands"
+        ]
+
+
+def register_config() -> None:
+    cs = ConfigStore.instance()
+    cs.store(
+        name="text_preprocessing_task_schema",
+        group="tasks",
+        node=TextPreprocessingTaskConfig
+    )
+    cs.store(
+        name="tokenizer_training_task_schema",
+        group="tasks",
+        node=TokenizerTrainingTaskConfig
+    )
+    cs.store(
+        name="deduplication_task_schema",
+        group="tasks",
+        node=DeduplicationTaskConfig
+    )
@@ -20,14 +20,24 @@ class TrainingLightningModuleConfig(LightningModuleConfig, LoggerbleParamsMixin)
     loss: loss_schemas.LossFunctionConfig = MISSING
     optimizer: optimizer_schemas.OptimizerConfig = MISSING
     scheduler: Optional[scheduler_schemas.LightningSchedulerConfig] = None
+    compile_model: bool = False  # torch.compile the model, needs transformation.static_sequence_lengths
+    compile_mode: Optional[str] = None  # torch.compile mode, e.g. "reduce-overhead" or "max-autotune"
     
     def loggable_params(self) -> list[str]:
-        return ["_target_"]
+        return ["_target_", "compile_model", "compile_mode"]
     
 
 @dataclass
 class BinaryTextClassificationTrainingLightningModuleConfig(TrainingLightningModuleConfig):
     _target_: str = "jeffrey.training.lightning_modules.binary_text_classification.BinaryTextClassificationLightningModule"
+    # Early exit models only: weight of the mean exit loss, thresholds of the validation tradeoff (None: defaults)
+    exit_loss_weight: float = 1.0
+    exit_thresholds: Optional[list[float]] = None
+    # Multi-branch models only: export the "best" branch on the validation split, or the averaged "ensemble"
+    export_branch: str = "best"
+    
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["exit_loss_weight", "export_branch"]
     
     
 @dataclass
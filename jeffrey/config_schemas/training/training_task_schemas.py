@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from omegaconf import MISSING, SI
 from hydra.core.config_store import ConfigStore
 
@@ -19,6 +19,31 @@ class TarModelExportingTrainingConfig(TrainingTaskConfig):
     tar_model_export_path: str = MISSING
     
 
+@dataclass
+class PruningLevelConfig:
+    _target_: str = "jeffrey.training.pruning.PruningLevel"
+    # Shares of the original backbone removed at this level
+    layers: float = 0.0
+    heads: float = 0.0
+    ffn_neurons: float = 0.0
+    
+    
+@dataclass
+class PruningTrainingTaskConfig(TarModelExportingTrainingConfig):
+    _target_: str = "jeffrey.training.tasks.pruning_training_task.PruningTrainingTask"
+    tar_model_path: str = MISSING  # Trained model to prune, lightning_module.model has to be its config
+    pruning_levels: list[PruningLevelConfig] = field(default_factory=lambda: [
+        PruningLevelConfig(heads=0.25, ffn_neurons=0.25),
+        PruningLevelConfig(layers=0.25, heads=0.5, ffn_neurons=0.5)
+    ])
+    num_scoring_batches: int = 32  # Validation batches of every rank the importances are summed over
+    num_latency_batches: int = 16
+    fine_tuning_epochs: int = 1  # After every level
+    
+    def loggable_params(self) -> list[str]:
+        return super().loggable_params() + ["tar_model_path", "fine_tuning_epochs"]
+    
+    
 @dataclass
 class CommonTrainingTaskConfig(TrainingTaskConfig):
     _target_: str = "jeffrey.training.tasks.common_training_task.CommonTrainingTask"
@@ -45,6 +70,11 @@ def register_config() -> None:
         group="tasks",
         node=CommonTrainingTaskConfig
     )
+    cs.store(
+        name="pruning_training_task_schema",
+        group="tasks",
+        node=PruningTrainingTaskConfig
+    )
     cs.store(
         name="test_training_task_schema",
         node=DefaultCommonTrainingTaskConfig
@@ -1,18 +1,55 @@
-from typing import Any, Callable, List, Optional, Protocol, Tuple
+from typing import Any, Callable, List, Optional, Protocol, Tuple, Union
 
+import random
+
+import numpy as np
+import torch
+import torch.distributed
 from lightning.pytorch import LightningDataModule
 from torch import Tensor
 from transformers import BatchEncoding
+from transformers.modeling_outputs import BaseModelOutputWithPooling
 from torch.utils.data import (
     BatchSampler, 
     Sampler, 
     DataLoader, 
     Dataset, 
+    IterableDataset,
     default_collate
 )
 
-from jeffrey.data_modules.dataset import TextClassificationDataset
-from jeffrey.models.transformations import HuggingFaceTokenizationTransformation, Transformation
+from jeffrey.data_modules.dataset import (
+    ColumnarTextClassificationDataset,
+    EmbeddingBatch,
+    EmbeddingTextClassificationDataset,
+    MemoryMappedTextClassificationDataset,
+    PreTokenizedBatch,
+    PreTokenizedTextClassificationDataset,
+    StreamingTextClassificationDataset,
+    TextClassificationBatch,
+    TextClassificationDataset,
+    read_parquet_columns
+)
+from jeffrey.data_modules.embedding_store import (
+    LOCAL_EMBEDDING_STORE_DIR,
+    collate_embeddings,
+    get_backbone_weights_hash,
+    get_embedding_store
+)
+from jeffrey.data_modules.samplers import (
+    EpochAwareSequentialSampler, 
+    LengthGroupedBatchSampler, 
+    ShardedBatchSampler,
+    TokenBudgetBatchSampler
+)
+from jeffrey.data_modules.statistics import SplitStatistics, get_split_statistics
+from jeffrey.data_modules.staging import LOCAL_STAGING_DIR, BackgroundStager, stage_file
+from jeffrey.data_modules.text_store import LOCAL_TEXT_STORE_DIR, get_text_store
+from jeffrey.data_modules.tokenization_cache import TOKENIZATION_CHUNK_SIZE, get_tokenized_split, tokenize_in_chunks
+from jeffrey.models.backbones import Backbone
+from jeffrey.models.transformations import CompactEncodings, HuggingFaceTokenizationTransformation, Transformation
+from jeffrey.utils.io_utils import get_remote_fingerprint
+from jeffrey.utils.registry import get_config_hash, get_registry
 
 
 class DataModule(LightningDataModule):
@@ -40,13 +77,27 @@ def __init__(
         self.drop_last = drop_last
         self.persistent_workers = persistent_workers
         
+    def get_batch_sampler(self, dataset: Dataset, is_test: bool) -> Optional[BatchSampler]:
+        return self.batch_sampler
+        
     def initialize_dataloader(self, dataset: Dataset, is_test: bool) -> DataLoader:
+        batch_sampler = self.get_batch_sampler(dataset, is_test)
+        if batch_sampler is not None:
+            # batch_sampler is mutually exclusive with batch_size, shuffle, sampler and drop_last
+            return DataLoader(
+                dataset,
+                batch_sampler=batch_sampler,
+                num_workers=self.num_workers,
+                collate_fn=self.collate_fn,
+                pin_memory=self.pin_memory,
+                persistent_workers=self.persistent_workers
+            )
+        
         return DataLoader(
             dataset,
             batch_size=self.batch_size,
             shuffle=self.shuffle and not is_test,
             sampler=self.sampler,
-            batch_sampler=self.batch_sampler,
             num_workers=self.num_workers,
             collate_fn=self.collate_fn,
             pin_memory=self.pin_memory,
@@ -76,11 +127,52 @@ def __init__(
         num_workers: int = 0,
         pin_memory: bool = False,
         drop_last: bool = False,
-        persistent_workers: bool = False
+        persistent_workers: bool = False,
+        dataset_format: str = "pandas",
+        use_tokenization_cache: bool = False,
+        tokenization_cache_dir: Optional[str] = None,
+        length_bucketing: bool = False,
+        bucket_size_multiplier: int = 50,
+        max_tokens_per_batch: Optional[int] = None,
+        use_recommended_bucket_boundaries: bool = False,
+        statistics_dir: Optional[str] = None,
+        shuffle_buffer_size: int = 10_000,
+        packing: bool = False,
+        compact_batches: bool = False,
+        staging: bool = False,
+        staging_dir: str = LOCAL_STAGING_DIR,
+        background_staging: bool = False,
+        text_store_dir: str = LOCAL_TEXT_STORE_DIR,
+        resumable: bool = False,
+        use_embedding_store: bool = False,
+        embedding_store_output: str = "pooler_output",
+        embedding_store_dir: str = LOCAL_EMBEDDING_STORE_DIR,
+        seed: int = 0
     ) -> None:
+        if packing and compact_batches:
+            raise ValueError("packing and compact_batches are two different batch layouts, set at most one of them")
         
-        def tokenization_collate_fn(batch: List[Tuple[str, int]]) -> tuple[BatchEncoding, Tensor]:
-            texts, labels = default_collate(batch)
+        def tokenization_collate_fn(
+            batch: Union[List[Tuple[str, Tensor]], TextClassificationBatch, PreTokenizedBatch, EmbeddingBatch]
+        ) -> tuple[Union[BatchEncoding, CompactEncodings, BaseModelOutputWithPooling], Tensor]:
+            if isinstance(batch, EmbeddingBatch):
+                return collate_embeddings(batch.embeddings), batch.labels
+            if isinstance(batch, PreTokenizedBatch):
+                if packing:
+                    return transformation.pack(batch.input_ids), batch.labels
+                if compact_batches:
+                    return transformation.compact(batch.input_ids), batch.labels
+                return transformation.pad(batch.input_ids), batch.labels
+            
+            if isinstance(batch, TextClassificationBatch):
+                texts, labels = batch
+            else:
+                texts, labels = default_collate(batch)
+                
+            if packing:
+                return transformation.pack(transformation.encode_cached(texts)), labels
+            if compact_batches:
+                return transformation.compact(transformation.encode_cached(texts)), labels
             encodings = transformation(texts)
             return encodings, labels
         
@@ -102,27 +194,330 @@ def tokenization_collate_fn(batch: List[Tuple[str, int]]) -> tuple[BatchEncoding
         self.test_df_path = test_df_path
         self.text_column_name = text_column_name
         self.label_column_name = label_column_name
+        self.transformation = transformation
+        # Tokenization cache lookups of the workers reach the main process (see log_tokenization_cache_counters)
+        if isinstance(transformation, HuggingFaceTokenizationTransformation):
+            transformation.share_cache_counters(num_workers)
+        self.dataset_format = dataset_format
+        self.use_tokenization_cache = use_tokenization_cache
+        self.tokenization_cache_dir = tokenization_cache_dir
+        self.length_bucketing = length_bucketing
+        self.bucket_size_multiplier = bucket_size_multiplier
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.use_recommended_bucket_boundaries = use_recommended_bucket_boundaries
+        self.statistics_dir = statistics_dir
+        self.split_statistics: dict[str, SplitStatistics] = {}
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.packing = packing
+        self.compact_batches = compact_batches
+        self.staging = staging
+        self.staging_dir = staging_dir
+        self.text_store_dir = text_store_dir
+        self.background_stager: Optional[BackgroundStager] = None
+        if staging and background_staging:
+            self.background_stager = BackgroundStager([train_df_path, valid_df_path, test_df_path], staging_dir)
+        self.seed = seed
+        self.resumable = resumable
+        # Position in the training epoch, saved in checkpoints when resumable
+        self.epoch = 0
+        self.batches_consumed = 0
+        self.resume_epoch: Optional[int] = None
+        self.resume_batch_idx = 0
+        self.token_lengths: dict[Dataset, np.ndarray] = {}
+        self.use_embedding_store = use_embedding_store
+        self.embedding_store_output = embedding_store_output
+        self.embedding_store_dir = embedding_store_dir
+        self.frozen_backbone: Optional[Backbone] = None
+        # Hashed once per setup instead of once per split
+        self.frozen_backbone_hash: Optional[str] = None
         
-    def setup(self, stage: Optional[str]) -> None:
-        print(f"{stage=}")
-        if stage == "fit" or stage is None:
-            self.train_dataset = TextClassificationDataset(
-                self.train_df_path,
+    def set_frozen_backbone(self, backbone: Backbone) -> None:
+        '''Backbone whose outputs the embedding store holds, it must not be trained'''
+        self.frozen_backbone = backbone
+        self.frozen_backbone_hash = None
+        
+    def create_dataset(self, df_path: str, is_test: bool) -> Dataset:
+        if self.use_embedding_store:
+            return self.create_embedding_dataset(df_path)
+        
+        if self.dataset_format == "streaming":
+            if self.use_tokenization_cache or self.length_bucketing or self.max_tokens_per_batch is not None:
+                raise ValueError("Streaming datasets support neither the tokenization cache nor length-based batching")
+            if self.resumable:
+                raise ValueError("Streaming datasets cannot resume mid-epoch")
+            if self.staging:
+                df_path = stage_file(df_path, self.staging_dir)
+            return StreamingTextClassificationDataset(
+                df_path,
                 self.text_column_name,
-                self.label_column_name
+                self.label_column_name,
+                batch_size=self.batch_size,
+                num_workers=self.num_workers,
+                shuffle=self.shuffle and not is_test,
+                shuffle_buffer_size=self.shuffle_buffer_size,
+                seed=self.seed,
+                drop_last=not is_test
             )
-            self.valid_dataset = TextClassificationDataset(
-                self.valid_df_path,
-                self.text_column_name,
-                self.label_column_name
+        
+        # Map-style datasets hold no per-data-module state and are shared with later tasks of the run
+        dataset_key = get_config_hash(
+            {
+                "df_path": df_path,
+                "source": get_remote_fingerprint(df_path),
+                "text_column_name": self.text_column_name,
+                "label_column_name": self.label_column_name,
+                "dataset_format": self.dataset_format,
+                "tokenizer": self.transformation.get_tokenizer_fingerprint() if self.use_tokenization_cache else None,
+                "max_sequence_len": self.transformation.max_sequence_len if self.use_tokenization_cache else None,
+            }
+        )
+        return get_registry().get_or_build(dataset_key, lambda: self.build_dataset(df_path))
+    
+    def create_embedding_dataset(self, df_path: str) -> Dataset:
+        if self.frozen_backbone is None:
+            raise ValueError("The embedding store needs the frozen backbone, see set_frozen_backbone")
+        if self.dataset_format == "streaming" or self.length_bucketing or self.max_tokens_per_batch is not None:
+            raise ValueError("Embedding stores support neither streaming datasets nor length-based batching")
+        if self.packing or self.compact_batches:
+            raise ValueError("Embedding stores replace tokenized batches, packing and compact batches do not apply")
+        
+        if self.staging:
+            df_path = stage_file(df_path, self.staging_dir)
+        if self.frozen_backbone_hash is None:
+            self.frozen_backbone_hash = get_backbone_weights_hash(self.frozen_backbone)
+        embedding_store = get_embedding_store(
+            df_path,
+            self.text_column_name,
+            self.frozen_backbone,
+            output_attribute=self.embedding_store_output,
+            store_root_dir=self.embedding_store_dir,
+            batch_size=self.batch_size,
+            backbone_hash=self.frozen_backbone_hash
+        )
+        return EmbeddingTextClassificationDataset(df_path, self.label_column_name, embedding_store)
+    
+    def build_dataset(self, df_path: str) -> Dataset:
+        # The tokenization cache is keyed by the original path and mirrored to the node by itself
+        if self.staging and not self.use_tokenization_cache:
+            df_path = stage_file(df_path, self.staging_dir)
+            
+        if self.use_tokenization_cache:
+            tokenized_split = get_tokenized_split(
+                df_path, 
+                self.text_column_name, 
+                self.transformation, 
+                cache_root_dir=self.tokenization_cache_dir
             )
+            return PreTokenizedTextClassificationDataset(df_path, self.label_column_name, tokenized_split)
         
-        if stage == "test":
-            self.test_dataset = TextClassificationDataset(
-                self.test_df_path,
-                self.text_column_name,
-                self.label_column_name
+        if self.dataset_format == "pandas":
+            return TextClassificationDataset(df_path, self.text_column_name, self.label_column_name)
+        elif self.dataset_format == "columnar":
+            return ColumnarTextClassificationDataset(df_path, self.text_column_name, self.label_column_name)
+        elif self.dataset_format == "memory_mapped":
+            text_store = get_text_store(df_path, self.text_column_name, self.label_column_name, self.text_store_dir)
+            return MemoryMappedTextClassificationDataset(text_store)
+        raise ValueError(f"Unknown dataset format: {self.dataset_format}")
+        
+    def get_token_lengths(self, dataset: Dataset) -> np.ndarray:
+        if isinstance(dataset, PreTokenizedTextClassificationDataset):
+            return dataset.tokenized_split.lengths
+        
+        assert isinstance(
+            dataset, 
+            (TextClassificationDataset, ColumnarTextClassificationDataset, MemoryMappedTextClassificationDataset)
+        )
+        texts = dataset.get_texts()
+        lengths = [
+            len(input_ids) 
+            for start in range(0, len(texts), TOKENIZATION_CHUNK_SIZE) 
+            for input_ids in self.transformation.encode(texts[start:start + TOKENIZATION_CHUNK_SIZE])
+        ]
+        return np.asarray(lengths, dtype=np.int64)
+    
+    def get_used_token_ids(self, df_path: str) -> np.ndarray:
+        '''Sorted ids of the tokens that occur in a split'''
+        if self.use_tokenization_cache:
+            tokenized_split = get_tokenized_split(
+                df_path, 
+                self.text_column_name, 
+                self.transformation, 
+                cache_root_dir=self.tokenization_cache_dir
+            )
+            return np.unique(tokenized_split.input_ids)
+        
+        if not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+            return self.tokenize_used_token_ids(df_path)
+        
+        # Without the cache only global rank zero reads and tokenizes the split, the other ranks get its ids
+        used_token_ids = [self.tokenize_used_token_ids(df_path) if torch.distributed.get_rank() == 0 else None]
+        torch.distributed.broadcast_object_list(used_token_ids, src=0)
+        assert used_token_ids[0] is not None
+        return used_token_ids[0]
+        
+    def tokenize_used_token_ids(self, df_path: str) -> np.ndarray:
+        texts = read_parquet_columns(df_path, columns=[self.text_column_name]).column(self.text_column_name).to_pylist()
+        input_ids, _ = tokenize_in_chunks(texts, self.transformation)
+        return np.unique(input_ids)
+    
+    def get_split_statistics(self, df_path: str) -> SplitStatistics:
+        if df_path not in self.split_statistics:
+            self.split_statistics[df_path] = get_split_statistics(
+                df_path, 
+                self.text_column_name, 
+                self.label_column_name, 
+                self.transformation, 
+                statistics_dir=self.statistics_dir
             )
+        return self.split_statistics[df_path]
+    
+    def get_train_statistics(self) -> SplitStatistics:
+        return self.get_split_statistics(self.train_df_path)
+        
+    def get_batch_sampler(self, dataset: Dataset, is_test: bool) -> Optional[BatchSampler]:
+        resume_kwargs: dict[str, Any] = {}
+        if self.resumable and not is_test:
+            resume_kwargs = {"resume_epoch": self.resume_epoch, "resume_batch_idx": self.resume_batch_idx}
+            
+        if not self.length_bucketing and self.max_tokens_per_batch is None:
+            if resume_kwargs:
+                # Unlike RandomSampler, ShardedBatchSampler can be fast-forwarded
+                return ShardedBatchSampler(
+                    sampler=EpochAwareSequentialSampler(dataset),
+                    batch_size=self.batch_size,
+                    drop_last=self.drop_last,
+                    shuffle=self.shuffle,
+                    seed=self.seed,
+                    **resume_kwargs
+                )
+            return super().get_batch_sampler(dataset, is_test)
+        
+        if dataset not in self.token_lengths:
+            self.token_lengths[dataset] = self.get_token_lengths(dataset)
+            
+        bucket_boundaries = None
+        if self.use_recommended_bucket_boundaries:
+            bucket_boundaries = self.get_train_statistics().recommended_bucket_boundaries
+            
+        if self.max_tokens_per_batch is not None:
+            # batch_size only caps the number of samples per batch here
+            return TokenBudgetBatchSampler(
+                sampler=EpochAwareSequentialSampler(dataset),
+                batch_size=self.batch_size,
+                drop_last=self.drop_last,
+                lengths=self.token_lengths[dataset],
+                max_tokens=self.max_tokens_per_batch,
+                bucket_size_multiplier=self.bucket_size_multiplier,
+                shuffle=self.shuffle and not is_test,
+                seed=self.seed,
+                bucket_boundaries=bucket_boundaries,
+                **resume_kwargs
+            )
+        
+        return LengthGroupedBatchSampler(
+            sampler=EpochAwareSequentialSampler(dataset),
+            batch_size=self.batch_size,
+            drop_last=self.drop_last,
+            lengths=self.token_lengths[dataset],
+            bucket_size_multiplier=self.bucket_size_multiplier,
+            shuffle=self.shuffle and not is_test,
+            seed=self.seed,
+            bucket_boundaries=bucket_boundaries,
+            **resume_kwargs
+        )
+        
+    def get_batch_sizes(self, dataset: Dataset) -> list[int]:
+        '''
+        Sizes of the batches of a dataset on this rank: batch_size, and the size of the last batch unless it is dropped.
+        Compiled models warm up every one of them, so that no batch recompiles mid-run.
+        '''
+        if self.max_tokens_per_batch is not None:
+            raise ValueError("Batches cut by a token budget have no static batch size")
+        if isinstance(dataset, StreamingTextClassificationDataset):
+            return dataset.get_batch_sizes()
+        if self.drop_last:
+            return [self.batch_size]
+        
+        # Batches of the whole dataset dealt out across ranks, or the rank shares of a DistributedSampler
+        num_samples = len(dataset)  # type: ignore
+        world_size = self.trainer.world_size if self.trainer is not None else 1
+        last_batch_sizes = {num_samples % self.batch_size, -(-num_samples // world_size) % self.batch_size}
+        return [self.batch_size, *sorted(last_batch_size for last_batch_size in last_batch_sizes if last_batch_size > 0)]
+        
+    def on_before_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        if self.trainer is not None and self.trainer.training:
+            if self.trainer.current_epoch != self.epoch:
+                self.epoch = self.trainer.current_epoch
+                self.batches_consumed = 0
+            self.batches_consumed += 1
+        return batch
+    
+    def state_dict(self) -> dict[str, Any]:
+        if not self.resumable:
+            return {}
+        # Every rank draws its own random streams: gather them all, the checkpoint is only written by rank zero
+        rng_state = {
+            "python_rng_state": random.getstate(),
+            "numpy_rng_state": np.random.get_state(),
+            "torch_rng_state": torch.get_rng_state(),
+        }
+        rng_states: list[Any] = [rng_state]
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rng_states = [None] * torch.distributed.get_world_size()
+            torch.distributed.all_gather_object(rng_states, rng_state)
+        return {
+            "epoch": self.epoch,
+            "batches_consumed": self.batches_consumed,
+            "rng_states": rng_states,
+        }
+    
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        '''Called before the dataloaders are created, so the training sampler starts where the checkpoint left off'''
+        if not self.resumable or not state_dict:
+            return
+        self.epoch = self.resume_epoch = state_dict["epoch"]
+        self.batches_consumed = self.resume_batch_idx = state_dict["batches_consumed"]
+        
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        rng_states = state_dict.get("rng_states", [])
+        if len(rng_states) != world_size:
+            # Saved with another number of ranks: distinct, reproducible streams per rank instead
+            random.seed(self.seed + rank)
+            np.random.seed(self.seed + rank)
+            torch.manual_seed(self.seed + rank)
+            return
+        random.setstate(rng_states[rank]["python_rng_state"])
+        np.random.set_state(rng_states[rank]["numpy_rng_state"])
+        torch.set_rng_state(rng_states[rank]["torch_rng_state"])
+        
+    def initialize_dataloader(self, dataset: Dataset, is_test: bool) -> DataLoader:
+        if not isinstance(dataset, IterableDataset):
+            return super().initialize_dataloader(dataset, is_test)
+        
+        # Streaming datasets shard, shuffle and batch by themselves
+        return DataLoader(
+            dataset,
+            batch_size=None,
+            num_workers=self.num_workers,
+            collate_fn=self.collate_fn,
+            pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers
+        )
+        
+    def setup(self, stage: Optional[str]) -> None:
+        print(f"{stage=}")
+        if self.background_stager is not None:
+            self.background_stager.wait()
+        self.frozen_backbone_hash = None
+            
+        if stage == "fit" or stage is None:
+            self.train_dataset = self.create_dataset(self.train_df_path, is_test=False)
+            self.valid_dataset = self.create_dataset(self.valid_df_path, is_test=True)
+        
+        if stage == "test":
+            self.test_dataset = self.create_dataset(self.test_df_path, is_test=True)
             
     def train_dataloader(self) -> DataLoader:
         return self.initialize_dataloader(self.train_dataset, is_test=False)
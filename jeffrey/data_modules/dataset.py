@@ -1,6 +1,37 @@
+import queue
+import threading
+from typing import TYPE_CHECKING, Iterator, NamedTuple, Optional
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
+import torch.distributed
 from torch import Tensor
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from jeffrey.utils.io_utils import GCS_PREFIX, open_file
+
+if TYPE_CHECKING:
+    from jeffrey.data_modules.embedding_store import EmbeddingStore
+    from jeffrey.data_modules.text_store import MemoryMappedTextStore
+    from jeffrey.data_modules.tokenization_cache import TokenizedSplit
+
+
+class TextClassificationBatch(NamedTuple):
+    texts: list[str]
+    labels: Tensor  # (batch_size, 1)
+
+
+class PreTokenizedBatch(NamedTuple):
+    input_ids: list[np.ndarray]
+    labels: Tensor  # (batch_size, 1)
+
+
+class EmbeddingBatch(NamedTuple):
+    embeddings: list[np.ndarray]  # (hidden_size,) pooled or (num_tokens, hidden_size) per-token outputs
+    labels: Tensor  # (batch_size, 1)
 
 
 class TextClassificationDataset(Dataset):
@@ -18,5 +49,322 @@ def __getitem__(self, idx: int) -> tuple[str, Tensor]:
         
         return text, Tensor([label])
     
+    def get_texts(self) -> list[str]:
+        texts: list[str] = self.df[self.text_column_name].tolist()
+        return texts
+    
+    def __len__(self) -> int:
+        return len(self.df)
+
+
+class ColumnarTextClassificationDataset(Dataset):
+    '''
+    Reads only the text and label columns of a split.
+    Texts stay in a single Arrow string array and labels in one contiguous (num_rows, 1) float tensor,
+    so a whole batch is fetched with one `take` and one index instead of a pandas row lookup per sample.
+    '''
+    def __init__(self, df_path: str, text_column_name: str, label_column_name: str) -> None:
+        super().__init__()
+        self.text_column_name = text_column_name
+        self.label_column_name = label_column_name
+
+        table = read_parquet_columns(df_path, columns=[text_column_name, label_column_name])
+        self.texts: pa.Array = table.column(text_column_name).combine_chunks()
+        labels = table.column(label_column_name).to_numpy().astype(np.float32)
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels)).unsqueeze(1)
+
+    def __getitem__(self, idx: int) -> tuple[str, Tensor]:
+        return self.texts[idx].as_py(), self.labels[idx]
+
+    def __getitems__(self, indices: list[int]) -> TextClassificationBatch:
+        texts = self.texts.take(pa.array(indices, type=pa.int64())).to_pylist()
+        labels = self.labels[torch.as_tensor(indices, dtype=torch.long)]
+        return TextClassificationBatch(texts=texts, labels=labels)
+
+    def get_texts(self) -> list[str]:
+        texts: list[str] = self.texts.to_pylist()
+        return texts
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+class PreTokenizedTextClassificationDataset(Dataset):
+    '''Serves unpadded token ids from a TokenizedSplit, so collate only has to pad them'''
+    def __init__(self, df_path: str, label_column_name: str, tokenized_split: "TokenizedSplit") -> None:
+        super().__init__()
+        self.label_column_name = label_column_name
+        self.tokenized_split = tokenized_split
+
+        labels = read_parquet_columns(df_path, columns=[label_column_name]).column(label_column_name).to_numpy()
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels.astype(np.float32))).unsqueeze(1)
+        assert len(self.labels) == len(self.tokenized_split), f"Tokenization cache is out of sync with {df_path}"
+
+    def __getitem__(self, idx: int) -> tuple[np.ndarray, Tensor]:
+        return self.tokenized_split[idx], self.labels[idx]
+
+    def __getitems__(self, indices: list[int]) -> PreTokenizedBatch:
+        input_ids = [self.tokenized_split[idx] for idx in indices]
+        labels = self.labels[torch.as_tensor(indices, dtype=torch.long)]
+        return PreTokenizedBatch(input_ids=input_ids, labels=labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class EmbeddingTextClassificationDataset(Dataset):
+    '''Serves precomputed backbone outputs from an EmbeddingStore, so only the adapter and head are run in training'''
+    def __init__(self, df_path: str, label_column_name: str, embedding_store: "EmbeddingStore") -> None:
+        super().__init__()
+        self.label_column_name = label_column_name
+        self.embedding_store = embedding_store
+
+        labels = read_parquet_columns(df_path, columns=[label_column_name]).column(label_column_name).to_numpy()
+        self.labels = torch.from_numpy(np.ascontiguousarray(labels.astype(np.float32))).unsqueeze(1)
+        assert len(self.labels) == len(self.embedding_store), f"Embedding store is out of sync with {df_path}"
+
+    def __getitem__(self, idx: int) -> tuple[np.ndarray, Tensor]:
+        return self.embedding_store[idx], self.labels[idx]
+
+    def __getitems__(self, indices: list[int]) -> EmbeddingBatch:
+        embeddings = [self.embedding_store[idx] for idx in indices]
+        labels = self.labels[torch.as_tensor(indices, dtype=torch.long)]
+        return EmbeddingBatch(embeddings=embeddings, labels=labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class MemoryMappedTextClassificationDataset(Dataset):
+    '''
+    Serves texts and labels from a MemoryMappedTextStore, so forked DataLoader workers and co-located DDP ranks
+    share one physical copy of the split instead of each copying the pages of a pandas object array.
+    '''
+    def __init__(self, text_store: "MemoryMappedTextStore") -> None:
+        super().__init__()
+        self.text_store = text_store
+
+    def __getitem__(self, idx: int) -> tuple[str, Tensor]:
+        return self.text_store.get_text(idx), torch.tensor([self.text_store.labels[idx]])
+
+    def __getitems__(self, indices: list[int]) -> TextClassificationBatch:
+        texts = [self.text_store.get_text(idx) for idx in indices]
+        labels = torch.from_numpy(self.text_store.labels[np.asarray(indices)]).unsqueeze(1)
+        return TextClassificationBatch(texts=texts, labels=labels)
+
+    def get_texts(self) -> list[str]:
+        return [self.text_store.get_text(idx) for idx in range(len(self))]
+
     def __len__(self) -> int:
-        return len(self.df)
\ No newline at end of file
+        return len(self.text_store)
+
+
+class RowRange(NamedTuple):
+    row_group: int
+    start: int  # First row within the row group
+    stop: int
+
+
+class StreamingTextClassificationDataset(IterableDataset):
+    '''
+    Streams a split row group by row group instead of loading it, so memory stays flat whatever the split size.
+
+    Row groups are shuffled per epoch (seed + epoch), and the rows they hold are cut into contiguous, near equal
+    row ranges, one per DDP rank and DataLoader worker, so that splits with fewer row groups than shards still
+    reach every rank. Rows go through a bounded shuffle buffer and the next row group is read in a background thread.
+    The dataset yields whole batches (use it with DataLoader(batch_size=None)). With drop_last (training),
+    every rank yields the same number of full batches so DDP collectives never wait on a rank that ran out of data,
+    and the few leftover rows of a shard are skipped. Without it (evaluation), every row is yielded.
+    '''
+    def __init__(
+        self,
+        df_path: str,
+        text_column_name: str,
+        label_column_name: str,
+        batch_size: int,
+        num_workers: int = 0,
+        shuffle: bool = False,
+        shuffle_buffer_size: int = 10_000,
+        seed: int = 0,
+        drop_last: bool = True,
+    ) -> None:
+        super().__init__()
+        self.df_path = df_path
+        self.text_column_name = text_column_name
+        self.label_column_name = label_column_name
+        self.batch_size = batch_size
+        self.num_workers = max(num_workers, 1)
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.drop_last = drop_last
+        # Shared memory, so that set_epoch in the main process also reaches persistent DataLoader workers
+        self.shared_epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+
+        with open_file(df_path, "rb") as f:
+            metadata = pq.ParquetFile(f).metadata
+        self.row_group_sizes = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+
+    @property
+    def epoch(self) -> int:
+        return int(self.shared_epoch.item())
+
+    def set_epoch(self, epoch: int) -> None:
+        self.shared_epoch.fill_(epoch)
+
+    def get_num_replicas_and_rank(self) -> tuple[int, int]:
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_world_size(), torch.distributed.get_rank()
+        return 1, 0
+
+    def get_shards(self) -> list[list[list[RowRange]]]:
+        '''Row ranges of every (rank, worker) shard: shards[rank][worker]'''
+        num_replicas, _ = self.get_num_replicas_and_rank()
+        num_shards = num_replicas * self.num_workers
+
+        row_groups = np.arange(len(self.row_group_sizes))
+        if self.shuffle:
+            row_groups = np.random.default_rng(self.seed + self.epoch).permutation(row_groups)
+
+        # Rows of the (shuffled) row groups laid end to end, cut into num_shards contiguous ranges
+        row_group_starts = np.concatenate([[0], np.cumsum([self.row_group_sizes[i] for i in row_groups])])
+        shard_bounds = np.linspace(0, row_group_starts[-1], num_shards + 1).astype(np.int64)
+
+        shards = []
+        for shard_start, shard_stop in zip(shard_bounds[:-1], shard_bounds[1:]):
+            row_ranges = []
+            for position, row_group in enumerate(row_groups.tolist()):
+                start = max(shard_start, row_group_starts[position])
+                stop = min(shard_stop, row_group_starts[position + 1])
+                if start < stop:
+                    offset = row_group_starts[position]
+                    row_ranges.append(RowRange(row_group, int(start - offset), int(stop - offset)))
+            shards.append(row_ranges)
+
+        return [shards[rank * self.num_workers : (rank + 1) * self.num_workers] for rank in range(num_replicas)]
+
+    def get_num_batches_per_worker(self) -> list[list[int]]:
+        '''Number of batches every (rank, worker) shard yields, such that all ranks yield the same total with drop_last'''
+        shard_sizes = [
+            [sum(row_range.stop - row_range.start for row_range in row_ranges) for row_ranges in rank_shards]
+            for rank_shards in self.get_shards()
+        ]
+        if not self.drop_last:
+            return [[-(-num_rows // self.batch_size) for num_rows in rank_sizes] for rank_sizes in shard_sizes]
+
+        available_batches = [[num_rows // self.batch_size for num_rows in rank_sizes] for rank_sizes in shard_sizes]
+        num_batches_per_rank = min(sum(rank_batches) for rank_batches in available_batches)
+        if num_batches_per_rank == 0:
+            raise ValueError(
+                f"{self.df_path} has too few rows ({sum(self.row_group_sizes)}) for a batch of {self.batch_size} "
+                f"on every one of the {len(shard_sizes)} ranks x {self.num_workers} workers"
+            )
+
+        num_batches_per_worker = []
+        for rank_batches in available_batches:
+            remaining = num_batches_per_rank
+            worker_budgets = []
+            for worker_batches in rank_batches:
+                worker_budgets.append(min(worker_batches, remaining))
+                remaining -= worker_budgets[-1]
+            num_batches_per_worker.append(worker_budgets)
+        return num_batches_per_worker
+
+    def get_batch_sizes(self) -> list[int]:
+        '''Sizes of the batches this rank yields: batch_size, and the last batch of every worker without drop_last'''
+        _, rank = self.get_num_replicas_and_rank()
+        last_batch_sizes = set()
+        if not self.drop_last:
+            for row_ranges in self.get_shards()[rank]:
+                last_batch_sizes.add(sum(row_range.stop - row_range.start for row_range in row_ranges) % self.batch_size)
+        return [self.batch_size, *sorted(last_batch_size for last_batch_size in last_batch_sizes if last_batch_size > 0)]
+
+    def read_row_ranges(self, row_ranges: list[RowRange]) -> Iterator[pa.Table]:
+        '''Read row ranges in order, always prefetching the next one in a background thread'''
+        prefetched: queue.Queue[Optional[pa.Table]] = queue.Queue(maxsize=1)
+        stop_event = threading.Event()
+
+        def prefetch() -> None:
+            with open_file(self.df_path, "rb") as f:
+                parquet_file = pq.ParquetFile(f)
+                for row_range in row_ranges:
+                    if stop_event.is_set():
+                        return
+                    table = parquet_file.read_row_group(row_range.row_group, columns=[self.text_column_name, self.label_column_name])
+                    prefetched.put(table.slice(row_range.start, row_range.stop - row_range.start))
+            prefetched.put(None)
+
+        thread = threading.Thread(target=prefetch, daemon=True)
+        thread.start()
+        try:
+            while (table := prefetched.get()) is not None:
+                yield table
+        finally:
+            stop_event.set()
+            while thread.is_alive():
+                try:
+                    prefetched.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.1)
+
+    def iterate_rows(self, row_ranges: list[RowRange], generator: np.random.Generator) -> Iterator[tuple[str, float]]:
+        buffer: list[tuple[str, float]] = []
+        for table in self.read_row_ranges(row_ranges):
+            texts = table.column(self.text_column_name).to_pylist()
+            labels = table.column(self.label_column_name).to_numpy().astype(np.float32)
+            for row in zip(texts, labels):
+                if not self.shuffle:
+                    yield row
+                    continue
+
+                buffer.append(row)
+                if len(buffer) >= self.shuffle_buffer_size:
+                    idx = generator.integers(len(buffer))
+                    buffer[idx], buffer[-1] = buffer[-1], buffer[idx]
+                    yield buffer.pop()
+
+        generator.shuffle(buffer)  # type: ignore
+        yield from buffer
+
+    def __iter__(self) -> Iterator[TextClassificationBatch]:
+        worker_info = get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        assert worker_info is None or worker_info.num_workers == self.num_workers, "num_workers must match DataLoader"
+        _, rank = self.get_num_replicas_and_rank()
+
+        row_ranges = self.get_shards()[rank][worker_id]
+        num_batches = self.get_num_batches_per_worker()[rank][worker_id]
+        generator = np.random.default_rng([self.seed, self.epoch, rank, worker_id])
+
+        if num_batches == 0:
+            return
+
+        texts: list[str] = []
+        labels: list[float] = []
+        for text, label in self.iterate_rows(row_ranges, generator):
+            texts.append(text)
+            labels.append(label)
+            if len(texts) == self.batch_size:
+                yield TextClassificationBatch(texts=texts, labels=torch.tensor(labels).unsqueeze(1))
+                texts, labels = [], []
+                num_batches -= 1
+                if num_batches == 0:
+                    return
+
+        if texts and not self.drop_last:
+            yield TextClassificationBatch(texts=texts, labels=torch.tensor(labels).unsqueeze(1))
+
+    def __len__(self) -> int:
+        '''Number of batches of this rank'''
+        _, rank = self.get_num_replicas_and_rank()
+        return sum(self.get_num_batches_per_worker()[rank])
+
+
+def read_parquet_columns(df_path: str, columns: list[str]) -> pa.Table:
+    if not df_path.startswith(GCS_PREFIX):
+        # Local (e.g. staged) files are memory-mapped instead of read into a buffer first
+        local_table: pa.Table = pq.read_table(df_path, columns=columns, memory_map=True)
+        return local_table
+    with open_file(df_path, "rb") as f:
+        table: pa.Table = pq.read_table(f, columns=columns)
+    return table
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.models.adapters import MLPWithPooling
+from jeffrey.models.backbones import Backbone, MaskedBaseModelOutputWithPooling
+from jeffrey.models.common.utils import get_local_rank, local_rank_zero_first
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation
+from jeffrey.utils.io_utils import get_remote_fingerprint
+from jeffrey.utils.torch_utils import hash_tensors
+from jeffrey.utils.utils import get_logger
+
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+EMBEDDING_OFFSETS_FILE_NAME = "offsets.npy"
+EMBEDDING_STORE_METADATA_FILE_NAME = "metadata.json"
+LOCAL_EMBEDDING_STORE_DIR = "/tmp/jeffrey-embedding-store"
+EMBEDDING_STORE_OUTPUTS = ["pooler_output", "last_hidden_state"]
+
+logger = get_logger(__name__)
+
+
+class EmbeddingStore:
+    '''
+    Backbone outputs of a whole split, memory-mapped from node-local files.
+    pooler_output stores are one (num_rows, hidden_size) array, last_hidden_state stores keep only the
+    real tokens of every row, as one flat (num_tokens, hidden_size) array plus (num_rows + 1) offsets.
+    '''
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        self._embeddings: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        if self._embeddings is None:
+            self._embeddings = np.load(os.path.join(self.store_dir, EMBEDDINGS_FILE_NAME), mmap_mode="r")
+        return self._embeddings
+
+    @property
+    def offsets(self) -> Optional[np.ndarray]:
+        '''None for pooler_output stores'''
+        offsets_path = os.path.join(self.store_dir, EMBEDDING_OFFSETS_FILE_NAME)
+        if self._offsets is None and os.path.exists(offsets_path):
+            self._offsets = np.load(offsets_path, mmap_mode="r")
+        return self._offsets
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        offsets = self.offsets
+        if offsets is None:
+            return self.embeddings[idx]
+        return self.embeddings[offsets[idx] : offsets[idx + 1]]
+
+    def __len__(self) -> int:
+        offsets = self.offsets
+        return len(self.embeddings) if offsets is None else len(offsets) - 1
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_embeddings"] = None
+        state["_offsets"] = None
+        return state
+
+
+def get_backbone_weights_hash(backbone: Backbone) -> str:
+    return hash_tensors(backbone.state_dict().items())
+
+
+def check_embedding_store_output(model: nn.Module, output_attribute: str) -> None:
+    '''Raise unless every adapter of a model reads the backbone output attribute an embedding store holds'''
+    adapter_attributes = {
+        module.output_attribute_to_use
+        for module in model.modules()
+        if isinstance(module, MLPWithPooling) and module.output_attribute_to_use is not None
+    }
+    if adapter_attributes - {output_attribute}:
+        raise ValueError(
+            f"The embedding store holds {output_attribute}, but the adapters read {sorted(adapter_attributes)}: "
+            "embedding_store_output has to match the output_attribute_to_use of every adapter"
+        )
+
+
+def get_embedding_store_dir(
+    df_path: str,
+    text_column_name: str,
+    backbone: Backbone,
+    output_attribute: str,
+    store_root_dir: str,
+    backbone_hash: Optional[str] = None,
+) -> str:
+    '''
+    Store directory keyed by the backbone weights, the tokenizer config and the source file version.
+    backbone_hash (see get_backbone_weights_hash) spares hashing the weights again for every split.
+    '''
+    transformation = backbone.get_transformation()
+    assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+    key_content = json.dumps(
+        {
+            "backbone": backbone_hash if backbone_hash is not None else get_backbone_weights_hash(backbone),
+            "tokenizer": transformation.get_tokenizer_fingerprint(),
+            "max_sequence_len": transformation.max_sequence_len,
+            "source": get_remote_fingerprint(df_path),
+            "text_column_name": text_column_name,
+            "output_attribute": output_attribute,
+        },
+        sort_keys=True,
+    )
+    key = hashlib.sha256(key_content.encode()).hexdigest()[:16]
+    split_name = os.path.splitext(os.path.basename(df_path.rstrip("/")))[0]
+    return os.path.join(store_root_dir, split_name, key)
+
+
+@torch.no_grad()
+def build_embedding_store(
+    df_path: str,
+    text_column_name: str,
+    backbone: Backbone,
+    output_attribute: str,
+    store_dir: str,
+    batch_size: int,
+) -> None:
+    '''Run the backbone once over a split, writing its outputs batch by batch into memory-mapped files'''
+    if os.path.exists(os.path.join(store_dir, EMBEDDING_STORE_METADATA_FILE_NAME)):
+        logger.info(f"Embedding store is up to date: {store_dir}")
+        return
+    if output_attribute not in EMBEDDING_STORE_OUTPUTS:
+        raise ValueError(f"Unknown embedding store output: {output_attribute}, expected one of {EMBEDDING_STORE_OUTPUTS}")
+
+    transformation = backbone.get_transformation()
+    assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+    texts: list[str] = read_parquet_columns(df_path, columns=[text_column_name]).column(text_column_name).to_pylist()
+    logger.info(f"Building embedding store ({output_attribute}) of {df_path} in {store_dir}...")
+
+    device = torch.device(f"cuda:{max(get_local_rank(), 0)}") if torch.cuda.is_available() else torch.device("cpu")
+    original_device = next(backbone.parameters()).device
+    was_training = backbone.training
+    backbone.to(device).eval()
+
+    # Files are written to a temporary directory renamed into place, so a store directory is always complete
+    tmp_store_dir = f"{store_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_store_dir, ignore_errors=True)
+    os.makedirs(tmp_store_dir)
+    embeddings: Optional[np.ndarray] = None
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    if output_attribute == "last_hidden_state":
+        # Lengths first, so the flat token array can be allocated before running the backbone
+        lengths = [len(input_ids) for input_ids in transformation.encode(texts)]
+        offsets[1:] = np.cumsum(lengths)
+
+    for start in range(0, len(texts), batch_size):
+        encodings = transformation(texts[start : start + batch_size]).to(device)
+        output = backbone(encodings)
+        if output_attribute == "pooler_output":
+            batch_embeddings = output.pooler_output.float().cpu().numpy()
+        else:
+            attention_mask = getattr(output, "attention_mask", None)
+            attention_mask = attention_mask if attention_mask is not None else encodings["attention_mask"]
+            # Padding side agnostic: real tokens are gathered in order, whatever their positions
+            batch_embeddings = output.last_hidden_state[attention_mask.bool()].float().cpu().numpy()
+
+        if embeddings is None:
+            num_embeddings = len(texts) if output_attribute == "pooler_output" else int(offsets[-1])
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(tmp_store_dir, EMBEDDINGS_FILE_NAME),
+                mode="w+",
+                dtype=np.float32,
+                shape=(num_embeddings, batch_embeddings.shape[-1]),
+            )
+        write_start = start if output_attribute == "pooler_output" else int(offsets[start])
+        embeddings[write_start : write_start + len(batch_embeddings)] = batch_embeddings
+
+    backbone.to(original_device).train(was_training)
+    if embeddings is not None:
+        embeddings.flush()
+    if output_attribute == "last_hidden_state":
+        np.save(os.path.join(tmp_store_dir, EMBEDDING_OFFSETS_FILE_NAME), offsets)
+    with open(os.path.join(tmp_store_dir, EMBEDDING_STORE_METADATA_FILE_NAME), "w") as f:
+        json.dump({"df_path": df_path, "num_rows": len(texts), "output_attribute": output_attribute}, f)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(store_dir), exist_ok=True)
+    os.replace(tmp_store_dir, store_dir)
+
+
+def get_embedding_store(
+    df_path: str,
+    text_column_name: str,
+    backbone: Backbone,
+    output_attribute: str = "pooler_output",
+    store_root_dir: str = LOCAL_EMBEDDING_STORE_DIR,
+    batch_size: int = 64,
+    backbone_hash: Optional[str] = None,
+) -> EmbeddingStore:
+    '''Build the store once per node (local rank zero), then memory-map it on every local rank'''
+    store_dir = get_embedding_store_dir(df_path, text_column_name, backbone, output_attribute, store_root_dir, backbone_hash)
+
+    with local_rank_zero_first():
+        if get_local_rank() in [0, -1]:
+            build_embedding_store(df_path, text_column_name, backbone, output_attribute, store_dir, batch_size)
+
+    return EmbeddingStore(store_dir)
+
+
+def collate_embeddings(embeddings: list[np.ndarray]) -> BaseModelOutputWithPooling:
+    '''Backbone output of a batch of stored embeddings, per-token outputs are right padded with an attention mask'''
+    if embeddings[0].ndim == 1:
+        return BaseModelOutputWithPooling(pooler_output=torch.from_numpy(np.stack(embeddings)))
+
+    lengths = torch.tensor([len(example_embeddings) for example_embeddings in embeddings])
+    last_hidden_state = torch.zeros((len(embeddings), int(lengths.max()), embeddings[0].shape[-1]), dtype=torch.float32)
+    for idx, example_embeddings in enumerate(embeddings):
+        last_hidden_state[idx, : len(example_embeddings)] = torch.from_numpy(np.asarray(example_embeddings))
+    attention_mask = (torch.arange(int(lengths.max())).unsqueeze(0) < lengths.unsqueeze(1)).long()
+    return MaskedBaseModelOutputWithPooling(last_hidden_state=last_hidden_state, attention_mask=attention_mask)
@@ -0,0 +1,203 @@
+from typing import Iterator, Optional, Sequence, Sized
+
+import numpy as np
+import torch.distributed
+from torch.utils.data import BatchSampler, DistributedSampler, Sampler, SequentialSampler
+
+
+class EpochAwareSequentialSampler(SequentialSampler):
+    '''
+    Lightning calls `set_epoch` on the sampler of a batch sampler, never on the batch sampler itself.
+    Without DDP this sampler is what carries the epoch to ShardedBatchSampler.
+    '''
+    def __init__(self, data_source: Sized) -> None:
+        super().__init__(data_source)
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+
+class ShardedBatchSampler(BatchSampler):
+    '''
+    Builds the batches of the whole dataset identically on every rank (seeded by seed + epoch)
+    and gives each rank an equal share of them.
+
+    `sampler` is only used for the dataset size, the epoch and, when Lightning injects a DistributedSampler
+    (use_distributed_sampler=True), the number of replicas and the rank. Without one, the default process group is used.
+
+    Since batches only depend on (seed, epoch), resuming mid-epoch is just skipping the first
+    resume_batch_idx batches of resume_epoch.
+    '''
+    def __init__(
+        self,
+        sampler: Sampler,
+        batch_size: int,
+        drop_last: bool,
+        shuffle: bool = False,
+        seed: int = 0,
+        resume_epoch: Optional[int] = None,
+        resume_batch_idx: int = 0,
+    ) -> None:
+        super().__init__(sampler, batch_size, drop_last)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.resume_epoch = resume_epoch
+        self.resume_batch_idx = resume_batch_idx
+
+    @property
+    def num_samples(self) -> int:
+        if isinstance(self.sampler, DistributedSampler):
+            return len(self.sampler.dataset)  # type: ignore
+        return len(self.sampler)  # type: ignore
+
+    @property
+    def epoch(self) -> int:
+        return int(getattr(self.sampler, "epoch", 0))
+
+    def get_num_replicas_and_rank(self) -> tuple[int, int]:
+        if isinstance(self.sampler, DistributedSampler):
+            return self.sampler.num_replicas, self.sampler.rank
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_world_size(), torch.distributed.get_rank()
+        return 1, 0
+
+    def create_batches(self, indices: np.ndarray, generator: np.random.Generator) -> list[list[int]]:
+        batches = [indices[i : i + self.batch_size].tolist() for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def get_rank_batches(self, skip_resumed: bool = True) -> list[list[int]]:
+        generator = np.random.default_rng(self.seed + self.epoch)
+        indices = generator.permutation(self.num_samples) if self.shuffle else np.arange(self.num_samples)
+
+        batches = self.create_batches(indices, generator)
+        if self.shuffle:
+            batches = [batches[i] for i in generator.permutation(len(batches))]
+
+        num_replicas, rank = self.get_num_replicas_and_rank()
+        if num_replicas > 1:
+            # Every rank has to run the same number of steps, otherwise DDP collectives hang
+            if self.drop_last:
+                num_batches_per_rank = len(batches) // num_replicas
+            else:
+                num_batches_per_rank = -(-len(batches) // num_replicas)
+                num_missing_batches = num_batches_per_rank * num_replicas - len(batches)
+                batches = batches + batches[:num_missing_batches]
+            batches = batches[rank : num_batches_per_rank * num_replicas : num_replicas]
+
+        if skip_resumed and self.epoch == self.resume_epoch:
+            return batches[self.resume_batch_idx :]
+        return batches
+
+    def __iter__(self) -> Iterator[list[int]]:
+        yield from self.get_rank_batches()
+
+    def __len__(self) -> int:
+        # Full epoch even when resuming: Lightning restores the number of batches already run and counts on from there
+        return len(self.get_rank_batches(skip_resumed=False))
+
+
+class LengthGroupedBatchSampler(ShardedBatchSampler):
+    '''
+    Groups samples of similar token length into the same batch to minimise padding.
+    (Shuffled) indices are split into buckets of batch_size * bucket_size_multiplier samples,
+    each bucket is sorted by length and cut into batches, and the batch order is shuffled every epoch.
+    With bucket_boundaries, samples are only sorted by the length range they fall into,
+    so batches stay random within a range.
+    '''
+    def __init__(
+        self,
+        sampler: Sampler,
+        batch_size: int,
+        drop_last: bool,
+        lengths: Sequence[int],
+        bucket_size_multiplier: int = 50,
+        shuffle: bool = False,
+        seed: int = 0,
+        bucket_boundaries: Optional[Sequence[int]] = None,
+        resume_epoch: Optional[int] = None,
+        resume_batch_idx: int = 0,
+    ) -> None:
+        super().__init__(
+            sampler=sampler,
+            batch_size=batch_size,
+            drop_last=drop_last,
+            shuffle=shuffle,
+            seed=seed,
+            resume_epoch=resume_epoch,
+            resume_batch_idx=resume_batch_idx,
+        )
+        self.lengths = np.asarray(lengths)
+        self.bucket_size_multiplier = bucket_size_multiplier
+        self.bucket_boundaries = bucket_boundaries
+        self.sort_keys = self.lengths if bucket_boundaries is None else np.digitize(self.lengths, bucket_boundaries)
+
+    def sort_by_length(self, indices: np.ndarray) -> np.ndarray:
+        '''Sort indices by descending length (or length range) within consecutive buckets'''
+        bucket_size = self.batch_size * self.bucket_size_multiplier
+
+        sorted_indices = []
+        for start in range(0, len(indices), bucket_size):
+            bucket = indices[start : start + bucket_size]
+            sorted_indices.append(bucket[np.argsort(-self.sort_keys[bucket], kind="stable")])
+
+        return np.concatenate(sorted_indices) if sorted_indices else indices
+
+    def create_batches(self, indices: np.ndarray, generator: np.random.Generator) -> list[list[int]]:
+        return super().create_batches(self.sort_by_length(indices), generator)
+
+
+class TokenBudgetBatchSampler(LengthGroupedBatchSampler):
+    '''
+    Length-grouped batches cut by a token budget instead of a fixed sample count:
+    a batch grows while (number of samples) * (its longest sample) stays within max_tokens,
+    so short texts come in large batches and long ones in small batches with the same peak memory.
+    batch_size only caps the number of samples per batch, and since every batch is complete
+    with respect to the budget, drop_last only affects how batches are sharded across ranks.
+    '''
+    def __init__(
+        self,
+        sampler: Sampler,
+        batch_size: int,
+        drop_last: bool,
+        lengths: Sequence[int],
+        max_tokens: int,
+        bucket_size_multiplier: int = 50,
+        shuffle: bool = False,
+        seed: int = 0,
+        bucket_boundaries: Optional[Sequence[int]] = None,
+        resume_epoch: Optional[int] = None,
+        resume_batch_idx: int = 0,
+    ) -> None:
+        super().__init__(
+            sampler=sampler,
+            batch_size=batch_size,
+            drop_last=drop_last,
+            lengths=lengths,
+            bucket_size_multiplier=bucket_size_multiplier,
+            shuffle=shuffle,
+            seed=seed,
+            bucket_boundaries=bucket_boundaries,
+            resume_epoch=resume_epoch,
+            resume_batch_idx=resume_batch_idx,
+        )
+        self.max_tokens = max_tokens
+
+    def create_batches(self, indices: np.ndarray, generator: np.random.Generator) -> list[list[int]]:
+        batches = []
+        batch: list[int] = []
+        max_length = 0
+        for idx in self.sort_by_length(indices).tolist():
+            length = int(self.lengths[idx])
+            padded_length = max(max_length, length)
+            if batch and (len(batch) == self.batch_size or (len(batch) + 1) * padded_length > self.max_tokens):
+                batches.append(batch)
+                batch, padded_length = [], length
+            batch.append(idx)
+            max_length = padded_length
+
+        if batch:
+            batches.append(batch)
+        return batches
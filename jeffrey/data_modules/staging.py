@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Optional
+
+from jeffrey.models.common.utils import get_local_rank, local_rank_zero_first
+from jeffrey.utils.io_utils import GCS_PREFIX, get_remote_fingerprint, open_file
+from jeffrey.utils.utils import get_logger
+
+LOCAL_STAGING_DIR = "/tmp/jeffrey-staging"
+STAGING_METADATA_FILE_SUFFIX = ".staged.json"
+STAGING_CHUNK_SIZE = 16 * 1024 * 1024
+
+logger = get_logger(__name__)
+
+
+def get_staged_path(path: str, staging_dir: str = LOCAL_STAGING_DIR) -> str:
+    path_hash = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(staging_dir, path_hash, os.path.basename(path.rstrip("/")))
+
+
+def compute_checksum(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(STAGING_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def load_staging_metadata(staged_path: str) -> Optional[dict[str, Any]]:
+    metadata_path = staged_path + STAGING_METADATA_FILE_SUFFIX
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r") as f:
+        metadata: dict[str, Any] = json.load(f)
+    return metadata
+
+
+def is_staged(staged_path: str, remote_fingerprint: dict[str, Any]) -> bool:
+    metadata = load_staging_metadata(staged_path)
+    if metadata is None or metadata["remote_fingerprint"] != remote_fingerprint or not os.path.exists(staged_path):
+        return False
+    return compute_checksum(staged_path) == metadata["sha256"]
+
+
+def download_to_staging(path: str, staging_dir: str = LOCAL_STAGING_DIR) -> str:
+    '''
+    Download a remote file into the node-local staging dir, unless an intact copy of the same remote version is there.
+    The file is written under a temporary name and renamed, so a staged file is always complete.
+    '''
+    staged_path = get_staged_path(path, staging_dir)
+    remote_fingerprint = get_remote_fingerprint(path)
+    if is_staged(staged_path, remote_fingerprint):
+        logger.info(f"{path} is already staged at {staged_path}")
+        return staged_path
+
+    logger.info(f"Staging {path} to {staged_path}...")
+    os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+    tmp_path = f"{staged_path}.{os.getpid()}.tmp"
+    hasher = hashlib.sha256()
+    with open_file(path, "rb") as source, open(tmp_path, "wb") as target:
+        while chunk := source.read(STAGING_CHUNK_SIZE):
+            hasher.update(chunk)
+            target.write(chunk)
+    os.replace(tmp_path, staged_path)
+
+    with open(staged_path + STAGING_METADATA_FILE_SUFFIX, "w") as f:
+        json.dump({"remote_fingerprint": remote_fingerprint, "sha256": hasher.hexdigest()}, f)
+    return staged_path
+
+
+def stage_file(path: str, staging_dir: str = LOCAL_STAGING_DIR) -> str:
+    '''
+    Local rank 0 downloads a remote file once per node, the other local ranks wait and reuse its copy.
+    Local paths are returned as they are.
+    '''
+    if not path.startswith(GCS_PREFIX):
+        return path
+
+    with local_rank_zero_first():
+        if get_local_rank() in [0, -1]:
+            download_to_staging(path, staging_dir)
+
+    staged_path = get_staged_path(path, staging_dir)
+    assert load_staging_metadata(staged_path) is not None, f"{path} was not staged at {staged_path}"
+    return staged_path
+
+
+class BackgroundStager:
+    '''
+    Starts downloading remote files on local rank 0 right away (e.g. while the model is being built),
+    `wait` joins it. Only downloads, synchronization with the other ranks is left to `stage_file`.
+    '''
+    def __init__(self, paths: list[str], staging_dir: str = LOCAL_STAGING_DIR) -> None:
+        self.paths = [path for path in paths if path.startswith(GCS_PREFIX)]
+        self.staging_dir = staging_dir
+        self.error: Optional[BaseException] = None
+        self.thread: Optional[threading.Thread] = None
+
+        if self.paths and get_local_rank() in [0, -1]:
+            self.thread = threading.Thread(target=self.download, daemon=True)
+            self.thread.start()
+
+    def download(self) -> None:
+        try:
+            for path in self.paths:
+                download_to_staging(path, self.staging_dir)
+        except BaseException as error:
+            self.error = error
+
+    def wait(self) -> None:
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            # stage_file retries in the foreground and raises if it fails again
+            logger.warning(f"Background staging failed: {self.error}")
+            self.error = None
@@ -0,0 +1,151 @@
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.data_modules.tokenization_cache import TOKENIZATION_CHUNK_SIZE
+from jeffrey.models.common.utils import get_global_rank, global_rank_zero_first
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation
+from jeffrey.utils.io_utils import get_remote_fingerprint, is_file, make_dirs, open_file
+from jeffrey.utils.utils import get_logger
+
+STATISTICS_DIR_SUFFIX = ".statistics"
+RECOMMENDED_MAX_SEQUENCE_LEN_COVERAGE = 0.99
+NUM_RECOMMENDED_BUCKETS = 8
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class SplitStatistics:
+    df_path: str
+    num_rows: int
+    label_counts: dict[str, int]
+    token_length_counts: list[int]  # token_length_counts[length]: number of rows with that many tokens
+    max_sequence_len: int  # of the tokenizer the lengths were measured with, longer rows were truncated
+    recommended_max_sequence_len: int
+    recommended_bucket_boundaries: list[int]
+
+    @property
+    def pos_weight(self) -> float:
+        if self.label_counts["1"] == 0:
+            raise ValueError(f"{self.df_path} has no positive rows, pos_weight is undefined")
+        return self.label_counts["0"] / self.label_counts["1"]
+
+    @property
+    def num_truncated_rows(self) -> int:
+        return self.token_length_counts[self.max_sequence_len] if len(self.token_length_counts) > self.max_sequence_len else 0
+
+
+def get_statistics_path(
+    df_path: str,
+    text_column_name: str,
+    label_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+    statistics_dir: Optional[str] = None,
+) -> str:
+    '''Manifest path of a split, keyed by the source file version, the columns and the tokenizer'''
+    key_content = json.dumps(
+        {
+            "source": get_remote_fingerprint(df_path),
+            "text_column_name": text_column_name,
+            "label_column_name": label_column_name,
+            "tokenizer": transformation.get_tokenizer_fingerprint(),
+            "max_sequence_len": transformation.max_sequence_len,
+        },
+        sort_keys=True,
+    )
+    key = hashlib.sha256(key_content.encode()).hexdigest()[:16]
+
+    split_name = os.path.splitext(os.path.basename(df_path.rstrip("/")))[0]
+    if statistics_dir is None:
+        return f"{os.path.splitext(df_path.rstrip('/'))[0]}{STATISTICS_DIR_SUFFIX}/{key}.json"
+    return os.path.join(statistics_dir, f"{split_name}{STATISTICS_DIR_SUFFIX}", f"{key}.json")
+
+
+def recommend_max_sequence_len(token_length_counts: np.ndarray) -> int:
+    '''Shortest length that fits RECOMMENDED_MAX_SEQUENCE_LEN_COVERAGE of the rows without truncation'''
+    coverage = np.cumsum(token_length_counts) / max(token_length_counts.sum(), 1)
+    return int(np.searchsorted(coverage, RECOMMENDED_MAX_SEQUENCE_LEN_COVERAGE))
+
+
+def recommend_bucket_boundaries(token_length_counts: np.ndarray) -> list[int]:
+    '''Length boundaries splitting the rows into NUM_RECOMMENDED_BUCKETS buckets of about the same size'''
+    coverage = np.cumsum(token_length_counts) / max(token_length_counts.sum(), 1)
+    quantiles = np.arange(1, NUM_RECOMMENDED_BUCKETS) / NUM_RECOMMENDED_BUCKETS
+    boundaries = np.unique(np.searchsorted(coverage, quantiles) + 1)
+    return [int(boundary) for boundary in boundaries if boundary < len(token_length_counts)]
+
+
+def compute_split_statistics(
+    df_path: str,
+    text_column_name: str,
+    label_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+) -> SplitStatistics:
+    logger.info(f"Computing statistics of {df_path}...")
+    table = read_parquet_columns(df_path, columns=[text_column_name, label_column_name])
+
+    labels, counts = np.unique(table.column(label_column_name).to_numpy().astype(np.int64), return_counts=True)
+    label_counts = {str(label): int(count) for label, count in zip(labels.tolist(), counts.tolist())}
+    label_counts = {"0": 0, "1": 0, **label_counts}
+
+    texts: list[str] = table.column(text_column_name).to_pylist()
+    token_length_counts = np.zeros(transformation.max_sequence_len + 1, dtype=np.int64)
+    for start in range(0, len(texts), TOKENIZATION_CHUNK_SIZE):
+        lengths = [len(input_ids) for input_ids in transformation.encode(texts[start : start + TOKENIZATION_CHUNK_SIZE])]
+        token_length_counts += np.bincount(lengths, minlength=len(token_length_counts))[: len(token_length_counts)]
+
+    return SplitStatistics(
+        df_path=df_path,
+        num_rows=len(texts),
+        label_counts=label_counts,
+        token_length_counts=token_length_counts.tolist(),
+        max_sequence_len=transformation.max_sequence_len,
+        recommended_max_sequence_len=recommend_max_sequence_len(token_length_counts),
+        recommended_bucket_boundaries=recommend_bucket_boundaries(token_length_counts),
+    )
+
+
+def load_split_statistics(statistics_path: str) -> Optional[SplitStatistics]:
+    if not is_file(statistics_path):
+        return None
+    with open_file(statistics_path, "r") as f:
+        try:
+            return SplitStatistics(**json.load(f))
+        except json.JSONDecodeError:
+            # Another process is still writing it
+            return None
+
+
+def save_split_statistics(statistics: SplitStatistics, statistics_path: str) -> None:
+    make_dirs(os.path.dirname(statistics_path))
+    with open_file(statistics_path, "w") as f:
+        json.dump(asdict(statistics), f)
+
+
+def get_split_statistics(
+    df_path: str,
+    text_column_name: str,
+    label_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+    statistics_dir: Optional[str] = None,
+) -> SplitStatistics:
+    '''
+    Load the statistics manifest of a split, computing it on the first call (global rank zero only,
+    the other ranks load the manifest it wrote)
+    '''
+    statistics_path = get_statistics_path(df_path, text_column_name, label_column_name, transformation, statistics_dir)
+    with global_rank_zero_first():
+        if get_global_rank() in [0, -1] and load_split_statistics(statistics_path) is None:
+            save_split_statistics(
+                compute_split_statistics(df_path, text_column_name, label_column_name, transformation), statistics_path
+            )
+
+    statistics = load_split_statistics(statistics_path)
+    assert statistics is not None, f"Statistics manifest is missing: {statistics_path}"
+    return statistics
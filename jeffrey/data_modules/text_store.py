@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.models.common.utils import get_local_rank, local_rank_zero_first
+from jeffrey.utils.io_utils import get_remote_fingerprint
+from jeffrey.utils.utils import get_logger
+
+TEXTS_FILE_NAME = "texts.bin"
+TEXT_OFFSETS_FILE_NAME = "text_offsets.npy"
+LABELS_FILE_NAME = "labels.npy"
+TEXT_STORE_METADATA_FILE_NAME = "metadata.json"
+LOCAL_TEXT_STORE_DIR = "/tmp/jeffrey-text-store"
+
+logger = get_logger(__name__)
+
+
+class MemoryMappedTextStore:
+    '''
+    Texts of a split as one UTF-8 bytes buffer plus (num_rows + 1) offsets, and labels as one float32 array,
+    all memory-mapped from node-local files. Every DataLoader worker and every co-located DDP rank maps the same
+    page cache pages, and since there are no Python objects per row, reading them never triggers copy-on-write.
+    '''
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = store_dir
+        self._texts: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._labels: Optional[np.ndarray] = None
+
+    @property
+    def texts(self) -> np.ndarray:
+        if self._texts is None:
+            self._texts = np.memmap(os.path.join(self.store_dir, TEXTS_FILE_NAME), dtype=np.uint8, mode="r")
+        return self._texts
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.load(os.path.join(self.store_dir, TEXT_OFFSETS_FILE_NAME), mmap_mode="r")
+        return self._offsets
+
+    @property
+    def labels(self) -> np.ndarray:
+        if self._labels is None:
+            self._labels = np.load(os.path.join(self.store_dir, LABELS_FILE_NAME), mmap_mode="r")
+        return self._labels
+
+    def get_text(self, idx: int) -> str:
+        return self.texts[self.offsets[idx] : self.offsets[idx + 1]].tobytes().decode()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_texts"] = None
+        state["_offsets"] = None
+        state["_labels"] = None
+        return state
+
+
+def get_text_store_dir(df_path: str, text_column_name: str, label_column_name: str, store_root_dir: str) -> str:
+    '''Store directory keyed by the source file version and the columns it holds'''
+    key_content = json.dumps(
+        {
+            "source": get_remote_fingerprint(df_path),
+            "text_column_name": text_column_name,
+            "label_column_name": label_column_name,
+        },
+        sort_keys=True,
+    )
+    key = hashlib.sha256(key_content.encode()).hexdigest()[:16]
+    split_name = os.path.splitext(os.path.basename(df_path.rstrip("/")))[0]
+    return os.path.join(store_root_dir, split_name, key)
+
+
+def build_text_store(df_path: str, text_column_name: str, label_column_name: str, store_dir: str) -> None:
+    if os.path.exists(os.path.join(store_dir, TEXT_STORE_METADATA_FILE_NAME)):
+        logger.info(f"Text store is up to date: {store_dir}")
+        return
+
+    logger.info(f"Building text store of {df_path} in {store_dir}...")
+    table = read_parquet_columns(df_path, columns=[text_column_name, label_column_name])
+
+    # A large_string array already is a bytes buffer plus int64 offsets, so it is written as it is
+    texts = pc.cast(pc.fill_null(table.column(text_column_name), ""), pa.large_string()).combine_chunks()
+    _, offsets_buffer, data_buffer = texts.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[texts.offset : texts.offset + len(texts) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, dtype=np.uint8)
+    data = data[offsets[0] : offsets[-1]]
+    offsets = offsets - offsets[0]
+
+    labels = table.column(label_column_name).to_numpy().astype(np.float32)
+
+    os.makedirs(store_dir, exist_ok=True)
+    data.tofile(os.path.join(store_dir, TEXTS_FILE_NAME))
+    np.save(os.path.join(store_dir, TEXT_OFFSETS_FILE_NAME), offsets)
+    np.save(os.path.join(store_dir, LABELS_FILE_NAME), labels)
+    with open(os.path.join(store_dir, TEXT_STORE_METADATA_FILE_NAME), "w") as f:
+        json.dump({"df_path": df_path, "num_rows": len(labels), "num_bytes": len(data)}, f)
+
+
+def get_text_store(
+    df_path: str,
+    text_column_name: str,
+    label_column_name: str,
+    store_root_dir: str = LOCAL_TEXT_STORE_DIR,
+) -> MemoryMappedTextStore:
+    '''Build the store once per node (local rank zero), then memory-map it on every local rank'''
+    store_dir = get_text_store_dir(df_path, text_column_name, label_column_name, store_root_dir)
+
+    with local_rank_zero_first():
+        if get_local_rank() in [0, -1]:
+            build_text_store(df_path, text_column_name, label_column_name, store_dir)
+
+    return MemoryMappedTextStore(store_dir)
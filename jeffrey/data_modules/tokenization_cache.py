@@ -0,0 +1,232 @@
+import hashlib
+import io
+import json
+import os
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.models.common.utils import get_global_rank, get_local_rank, global_rank_zero_first, local_rank_zero_first
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation
+from jeffrey.utils.io_utils import GCS_PREFIX, get_remote_fingerprint, is_file, make_dirs, open_file
+from jeffrey.utils.utils import get_logger
+
+INPUT_IDS_FILE_NAME = "input_ids.npy"
+OFFSETS_FILE_NAME = "offsets.npy"
+METADATA_FILE_NAME = "metadata.json"
+TOKENIZATION_CACHE_DIR_SUFFIX = ".tokenized"
+LOCAL_TOKENIZATION_CACHE_DIR = "/tmp/jeffrey-tokenization-cache"
+TOKENIZATION_CHUNK_SIZE = 10_000
+
+logger = get_logger(__name__)
+
+
+class TokenizedSplit:
+    '''
+    Token ids of a whole split, stored unpadded as one flat int32 array plus (num_rows + 1) offsets.
+    Arrays are memory-mapped lazily, so pickling the split into DataLoader workers never copies them.
+    '''
+    def __init__(self, local_cache_dir: str) -> None:
+        self.local_cache_dir = local_cache_dir
+        self._input_ids: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    @property
+    def input_ids(self) -> np.ndarray:
+        if self._input_ids is None:
+            self._input_ids = np.load(os.path.join(self.local_cache_dir, INPUT_IDS_FILE_NAME), mmap_mode="r")
+        return self._input_ids
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            self._offsets = np.load(os.path.join(self.local_cache_dir, OFFSETS_FILE_NAME), mmap_mode="r")
+        return self._offsets
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.input_ids[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_input_ids"] = None
+        state["_offsets"] = None
+        return state
+
+
+def get_tokenization_cache_dir(
+    df_path: str,
+    text_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+    cache_root_dir: Optional[str] = None,
+) -> str:
+    '''Cache directory for a split, keyed by tokenizer files, max_sequence_len and the source file'''
+    key_content = json.dumps(
+        {
+            "tokenizer": transformation.get_tokenizer_fingerprint(),
+            "max_sequence_len": transformation.max_sequence_len,
+            "df_path": df_path,
+            "text_column_name": text_column_name,
+        },
+        sort_keys=True,
+    )
+    key = hashlib.sha256(key_content.encode()).hexdigest()[:16]
+
+    split_name = os.path.splitext(os.path.basename(df_path.rstrip("/")))[0]
+    if cache_root_dir is None:
+        return f"{os.path.splitext(df_path.rstrip('/'))[0]}{TOKENIZATION_CACHE_DIR_SUFFIX}/{key}"
+    return os.path.join(cache_root_dir, f"{split_name}{TOKENIZATION_CACHE_DIR_SUFFIX}", key)
+
+
+def hash_texts(texts: Iterable[str]) -> str:
+    hasher = hashlib.sha256()
+    for text in texts:
+        hasher.update(text.encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def load_metadata(cache_dir: str) -> Optional[dict[str, Any]]:
+    metadata_path = os.path.join(cache_dir, METADATA_FILE_NAME)
+    if not is_file(metadata_path):
+        return None
+    with open_file(metadata_path, "r") as f:
+        metadata: dict[str, Any] = json.load(f)
+    return metadata
+
+
+def load_array(path: str) -> np.ndarray:
+    with open_file(path, "rb") as f:
+        array: np.ndarray = np.load(io.BytesIO(f.read()))
+    return array
+
+
+def save_array(array: np.ndarray, path: str) -> None:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    with open_file(path, "wb") as f:
+        f.write(buffer.getvalue())
+
+
+def tokenize_in_chunks(
+    texts: list[str], transformation: HuggingFaceTokenizationTransformation
+) -> tuple[np.ndarray, np.ndarray]:
+    input_ids_chunks = []
+    lengths_chunks = []
+    for start in range(0, len(texts), TOKENIZATION_CHUNK_SIZE):
+        encoded = transformation.encode(texts[start : start + TOKENIZATION_CHUNK_SIZE])
+        lengths_chunks.append(np.fromiter((len(ids) for ids in encoded), dtype=np.int64, count=len(encoded)))
+        input_ids_chunks.append(np.fromiter((token_id for ids in encoded for token_id in ids), dtype=np.int32))
+
+    input_ids = np.concatenate(input_ids_chunks) if input_ids_chunks else np.zeros(0, dtype=np.int32)
+    lengths = np.concatenate(lengths_chunks) if lengths_chunks else np.zeros(0, dtype=np.int64)
+    return input_ids, lengths
+
+
+def build_tokenization_cache(
+    df_path: str,
+    text_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+    cache_dir: str,
+) -> None:
+    '''
+    Tokenize a split into cache_dir. If the cache already holds a prefix of the split
+    (the split was appended to), only the new rows are tokenized.
+    The texts are only read when the source file changed since the cache was built.
+    '''
+    source_fingerprint = get_remote_fingerprint(df_path)
+    metadata = load_metadata(cache_dir)
+    if metadata is not None and metadata.get("source") == source_fingerprint:
+        logger.info(f"Tokenization cache is up to date: {cache_dir}")
+        return
+
+    texts: list[str] = read_parquet_columns(df_path, columns=[text_column_name]).column(text_column_name).to_pylist()
+
+    num_cached_rows = 0
+    input_ids = np.zeros(0, dtype=np.int32)
+    offsets = np.zeros(1, dtype=np.int64)
+    if metadata is not None and metadata["num_rows"] <= len(texts):
+        if hash_texts(texts[: metadata["num_rows"]]) == metadata["texts_hash"]:
+            num_cached_rows = metadata["num_rows"]
+
+    if metadata is not None and num_cached_rows == len(texts):
+        logger.info(f"Tokenization cache is up to date: {cache_dir}")
+        # The file was rewritten with the same rows: record it, so that the next setup does not read the texts again
+        metadata["source"] = source_fingerprint
+        with open_file(os.path.join(cache_dir, METADATA_FILE_NAME), "w") as f:
+            json.dump(metadata, f)
+        return
+
+    if num_cached_rows > 0:
+        input_ids = load_array(os.path.join(cache_dir, INPUT_IDS_FILE_NAME))
+        offsets = load_array(os.path.join(cache_dir, OFFSETS_FILE_NAME))
+
+    logger.info(f"Tokenizing {len(texts) - num_cached_rows} new rows of {df_path} into {cache_dir}...")
+    new_input_ids, new_lengths = tokenize_in_chunks(texts[num_cached_rows:], transformation)
+
+    input_ids = np.concatenate([input_ids, new_input_ids])
+    offsets = np.concatenate([offsets, offsets[-1] + np.cumsum(new_lengths)])
+
+    make_dirs(cache_dir)
+    save_array(input_ids, os.path.join(cache_dir, INPUT_IDS_FILE_NAME))
+    save_array(offsets, os.path.join(cache_dir, OFFSETS_FILE_NAME))
+    with open_file(os.path.join(cache_dir, METADATA_FILE_NAME), "w") as f:
+        json.dump(
+            {
+                "df_path": df_path,
+                "text_column_name": text_column_name,
+                "max_sequence_len": transformation.max_sequence_len,
+                "num_rows": len(texts),
+                "texts_hash": hash_texts(texts),
+                "source": source_fingerprint,
+            },
+            f,
+        )
+
+
+def localize_tokenization_cache(cache_dir: str) -> str:
+    '''Memory mapping needs local files, so caches next to remote splits are mirrored under /tmp'''
+    if not cache_dir.startswith(GCS_PREFIX):
+        return cache_dir
+
+    metadata = load_metadata(cache_dir)
+    assert metadata is not None, f"Tokenization cache is missing: {cache_dir}"
+
+    local_cache_dir = os.path.join(
+        LOCAL_TOKENIZATION_CACHE_DIR, hashlib.sha256(cache_dir.encode()).hexdigest()[:16], metadata["texts_hash"][:16]
+    )
+    if not os.path.exists(os.path.join(local_cache_dir, METADATA_FILE_NAME)):
+        os.makedirs(local_cache_dir, exist_ok=True)
+        for file_name in [INPUT_IDS_FILE_NAME, OFFSETS_FILE_NAME, METADATA_FILE_NAME]:
+            with open_file(os.path.join(cache_dir, file_name), "rb") as source:
+                content = source.read()
+            with open(os.path.join(local_cache_dir, file_name), "wb") as target:
+                target.write(content)
+    return local_cache_dir
+
+
+def get_tokenized_split(
+    df_path: str,
+    text_column_name: str,
+    transformation: HuggingFaceTokenizationTransformation,
+    cache_root_dir: Optional[str] = None,
+) -> TokenizedSplit:
+    '''Build (global rank zero only) or extend the cache of a split, then memory-map it on every rank'''
+    cache_dir = get_tokenization_cache_dir(df_path, text_column_name, transformation, cache_root_dir)
+
+    with global_rank_zero_first():
+        if get_global_rank() in [0, -1]:
+            build_tokenization_cache(df_path, text_column_name, transformation, cache_dir)
+
+    with local_rank_zero_first():
+        if get_local_rank() in [0, -1]:
+            localize_tokenization_cache(cache_dir)
+
+    return TokenizedSplit(localize_tokenization_cache(cache_dir))
@@ -1,18 +1,41 @@
 from abc import abstractmethod
-from typing import Any, Protocol
+from typing import Any, Optional, Protocol
 
 from torch import nn, Tensor
 from lightning.pytorch import LightningModule
 
-from jeffrey.models.models import Model
-from jeffrey.models.transformations import Transformation
+from jeffrey.models.models import EarlyExitBinaryTextClassificationModel, Model
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation, Transformation
+from jeffrey.utils.torch_utils import compile_model_forward, get_warm_up_batch_sizes, warm_up_compiled_model
 
 
 class EvaluationLightningModule(LightningModule):
-    def __init__(self, model: Model) -> None:
+    def __init__(self, model: Model, compile_model: bool = False, compile_mode: Optional[str] = None) -> None:
         super().__init__()
         
+        if compile_model and isinstance(model, EarlyExitBinaryTextClassificationModel):
+            # Its test step calls forward_all_exits, not the compiled forward
+            raise ValueError("compile_model does not support early exit models")
+        
         self.model = model
+        self.compile_model = compile_model
+        self.compile_mode = compile_mode
+        
+    def on_test_start(self) -> None:
+        if self.compile_model:
+            transformation = self.get_transformation()
+            assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+            datamodule = self.trainer.datamodule  # type: ignore
+            compile_model_forward(self.model, mode=self.compile_mode)
+            warm_up_compiled_model(
+                self.model, 
+                transformation, 
+                batch_sizes=get_warm_up_batch_sizes(datamodule, "test_dataset"), 
+                device=self.device, 
+                training=False,
+                compact_batches=getattr(datamodule, "compact_batches", False)
+            )
+        return super().on_test_start()
         
     @abstractmethod
     def test_step(self, batch: Any, batch_idx: int) -> Tensor:
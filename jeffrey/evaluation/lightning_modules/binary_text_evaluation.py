@@ -12,17 +12,20 @@
 )
 
 from jeffrey.models.transformations import Transformation
-from jeffrey.models.models import Model
+from jeffrey.models.models import DEFAULT_EXIT_THRESHOLDS, EarlyExitBinaryTextClassificationModel, Model
 from jeffrey.evaluation.lightning_modules.bases import EvaluationLightningModule
-from jeffrey.utils.torch_utils import plot_confusion_matrix
+from jeffrey.utils.torch_utils import all_gather_samples, get_early_exit_tradeoff, plot_confusion_matrix
 
 
 class BinaryTextEvaluationLightningModule(EvaluationLightningModule):
     def __init__(
         self,
-        model: Model
+        model: Model,
+        compile_model: bool = False,
+        compile_mode: Optional[str] = None,
+        exit_thresholds: Optional[list[float]] = None
     ) -> None:
-        super().__init__(model=model)
+        super().__init__(model=model, compile_model=compile_model, compile_mode=compile_mode)
         
         self.test_accuracy = BinaryAccuracy()
         self.test_f1_score = BinaryF1Score()
@@ -30,12 +33,21 @@ def __init__(
 
         self.test_step_outputs = defaultdict(list)
         
+        # Early exit models only: thresholds of the accuracy / layers executed tradeoff
+        self.exit_thresholds = exit_thresholds if exit_thresholds is not None else DEFAULT_EXIT_THRESHOLDS
+        
     def forward(self, texts: BatchEncoding) -> Tensor:
         return self.model(texts)
     
     def test_step(self, batch: Tuple[BatchEncoding, Tensor], batch_idx: int) -> None:
         texts, labels = batch
-        logits = self(texts)  # (batch_size, 1)
+        if isinstance(self.model, EarlyExitBinaryTextClassificationModel):
+            all_exit_logits = self.model.forward_all_exits(texts)
+            logits, layers_executed = self.model.select_exit_outputs(all_exit_logits, self.model.exit_threshold)
+            self.log(name="test_mean_layers_executed", value=layers_executed.float().mean(), on_step=False, on_epoch=True)
+            self.test_step_outputs["all_exit_logits"].append(torch.stack(all_exit_logits))
+        else:
+            logits = self(texts)  # (batch_size, 1)
         
         self.test_accuracy(logits, labels)
         self.test_f1_score(logits, labels)
@@ -48,13 +60,22 @@ def test_step(self, batch: Tuple[BatchEncoding, Tensor], batch_idx: int) -> None
         self.test_step_outputs["labels"].append(labels)
     
     def on_test_epoch_end(self) -> None:
-        all_logits = torch.stack(self.test_step_outputs["logits"])
-        all_labels = torch.stack(self.test_step_outputs["labels"])
+        # Batches of samplers grouping by length or token budget have different sizes
+        all_logits = torch.cat(self.test_step_outputs["logits"])
+        all_labels = torch.cat(self.test_step_outputs["labels"])
         
         confusion_matrix = self.test_confusion_matrix(all_logits, all_labels)
         figure = plot_confusion_matrix(confusion_matrix, class_names=["0", "1"])
         mlflow.log_figure(figure, artifact_file="test_confusion_matrix.png")
         
+        if isinstance(self.model, EarlyExitBinaryTextClassificationModel):
+            # The tradeoff covers the samples of every rank: (num_exits + 1, num_samples, ...) -> samples first to gather
+            all_exit_logits = torch.cat(self.test_step_outputs["all_exit_logits"], dim=1)
+            all_exit_logits = all_gather_samples(self, all_exit_logits.transpose(0, 1)).transpose(0, 1)
+            all_labels = all_gather_samples(self, all_labels)
+            tradeoff = get_early_exit_tradeoff(self.model, list(all_exit_logits), all_labels, self.exit_thresholds)
+            mlflow.log_dict({"tradeoff": tradeoff}, artifact_file="test_early_exit_tradeoff.json")
+        
         self.test_step_outputs = defaultdict(list)
         
     def get_transformation(self) -> Transformation:
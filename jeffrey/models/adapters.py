@@ -146,11 +146,14 @@ def __init__(
             
         if pooling_method == "mean_pooler":
             self.pooler = mean_pool_tokens
+        elif pooling_method == "max_pooler":
+            self.pooler = max_pool_tokens
         elif pooling_method == "cls_pooler":
             self.pooler = cls_pool_tokens
         else:
             self.pooler = nn.Identity()
             
+        self.output_attribute_to_use = output_attribute_to_use
         if output_attribute_to_use is not None:
             self.get_output_tensor = attrgetter(output_attribute_to_use)
         else:
@@ -158,24 +161,45 @@ def __init__(
             
     def forward(self, backbone_output: BaseModelOutputWithPooling) -> Tensor:
         output = self.get_output_tensor(backbone_output)
-        output = self.pooler(output)
+        if isinstance(self.pooler, nn.Identity):
+            output = self.pooler(output)
+        else:
+            # Set by backbones whose hidden states carry padding, pooling then ignores the padded positions
+            output = self.pooler(output, attention_mask=getattr(backbone_output, "attention_mask", None))
         output = self.projection(output)
         return output
             
         
-def mean_pool_tokens(tensor: Tensor) -> Tensor:
-    # tensor: (batch_size, num_tokens, embed_size)
+def mean_pool_tokens(tensor: Tensor, attention_mask: Optional[Tensor] = None) -> Tensor:
+    # tensor: (batch_size, num_tokens, embed_size), attention_mask: (batch_size, num_tokens)
+    dims = len(tensor.shape)
+    if dims != 3:
+        raise ValueError(f"Tokens pooling expects exactly 3 dimensional tensor, got: {dims}")
+    if attention_mask is None:
+        return torch.mean(tensor, dim=1)
+    mask = attention_mask.unsqueeze(-1).to(tensor.dtype)
+    return torch.sum(tensor * mask, dim=1) / torch.clamp(mask.sum(dim=1), min=1.0)
+
+def max_pool_tokens(tensor: Tensor, attention_mask: Optional[Tensor] = None) -> Tensor:
+    # tensor: (batch_size, num_tokens, embed_size), attention_mask: (batch_size, num_tokens)
     dims = len(tensor.shape)
     if dims != 3:
         raise ValueError(f"Tokens pooling expects exactly 3 dimensional tensor, got: {dims}")
-    return torch.mean(tensor, dim=1)
+    if attention_mask is None:
+        return torch.amax(tensor, dim=1)
+    padding = ~attention_mask.bool().unsqueeze(-1)
+    return torch.amax(tensor.masked_fill(padding, torch.finfo(tensor.dtype).min), dim=1)
 
-def cls_pool_tokens(tensor: Tensor) -> Tensor:
+def cls_pool_tokens(tensor: Tensor, attention_mask: Optional[Tensor] = None) -> Tensor:
     # tensor: (batch_size, num_tokens, embed_size)
     dims = len(tensor.shape)
     if dims != 3:
         raise ValueError(f"Tokens pooling expects exactly 3 dimensional tensor, got: {dims}")
-    return tensor[:, 0, :]
+    if attention_mask is None:
+        return tensor[:, 0, :]
+    # First real token, which is not at position 0 with left padding
+    first_token_positions = attention_mask.long().argmax(dim=1)
+    return tensor[torch.arange(len(tensor), device=tensor.device), first_token_positions]
 
 
 
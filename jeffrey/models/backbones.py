@@ -1,9 +1,27 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import torch
 from torch import nn
 from transformers import AutoConfig, AutoModel, BatchEncoding
 from transformers.modeling_outputs import BaseModelOutputWithPooling
 
-from jeffrey.models.transformations import Transformation
-from jeffrey.utils.io_utils import translate_gcs_dir_to_local
+from jeffrey.models.transformations import (
+    PACKED_EXAMPLE_POSITIONS_KEY, 
+    CompactEncodings, 
+    HuggingFaceTokenizationTransformation, 
+    Transformation
+)
+from jeffrey.models.lora import LORA_PARAMETER_NAMES, inject_lora, merge_lora
+from jeffrey.models.pruning import PRUNABLE_MODEL_TYPES, apply_pruned_layout, get_pruned_layout
+from jeffrey.models.unpadded import UNPADDED_MODEL_TYPES, bert_unpadded_forward
+from jeffrey.utils.artifact_cache import translate_gcs_dir_to_local
+
+
+@dataclass
+class MaskedBaseModelOutputWithPooling(BaseModelOutputWithPooling):
+    '''Output whose last_hidden_state is padded per example, attention_mask marks its real tokens'''
+    attention_mask: Optional[torch.LongTensor] = None
 
 
 class Backbone(nn.Module):
@@ -20,15 +38,191 @@ def __init__(
         self, 
         pretrained_model_name_or_path: str, 
         transformation: Transformation, 
-        pretrained: bool = False
+        pretrained: bool = False,
+        trim_vocab: bool = False,
+        trimmed_vocab_size: Optional[int] = None,
+        unpadded: bool = False,
+        pruned_num_layers: Optional[int] = None,
+        pruned_heads: Optional[list[list[int]]] = None,
+        intermediate_sizes: Optional[list[int]] = None,
+        lora_rank: Optional[int] = None,
+        lora_alpha: float = 16.0,
+        lora_dropout: float = 0.0,
+        lora_target_modules: Optional[list[str]] = None
     ) -> None:
         super().__init__(transformation=transformation)
         
         self.backbone = self.get_backbone(pretrained_model_name_or_path, pretrained)
+        self.unpadded = unpadded
+        if unpadded and self.backbone.config.model_type not in UNPADDED_MODEL_TYPES:
+            raise ValueError(f"No unpadded forward for {self.backbone.config.model_type} models, only for {UNPADDED_MODEL_TYPES}")
+        self.trim_vocab = trim_vocab
+        # Tokenizer id -> row of the trimmed word embeddings, None until the vocab is trimmed
+        self.token_id_mapping: Optional[torch.Tensor]
+        self.register_buffer("token_id_mapping", None)
+        
+        if trimmed_vocab_size is not None:
+            # Layout of an already trimmed backbone (exported model), its rows and mapping come with its state dict
+            self.resize_word_embeddings(trimmed_vocab_size)
+        
+        if pruned_num_layers is not None or pruned_heads is not None or intermediate_sizes is not None:
+            # Layout of an already pruned backbone (exported model), its weights come with its state dict
+            self.check_prunable()
+            apply_pruned_layout(self.backbone, pruned_num_layers, pruned_heads, intermediate_sizes)
+        
+        self.lora_rank = lora_rank
+        self.lora_alpha = lora_alpha
+        if lora_rank is not None:
+            # Only the low-rank updates of the backbone are trained, its pretrained weights stay frozen
+            inject_lora(self.backbone, lora_rank, lora_alpha, lora_dropout, lora_target_modules)
+            for name, parameter in self.backbone.named_parameters():
+                parameter.requires_grad_(name.rpartition(".")[2] in LORA_PARAMETER_NAMES)
+        
+    @property
+    def is_vocab_trimmed(self) -> bool:
+        return self.token_id_mapping is not None
+        
+    @property
+    def trimmed_vocab_size(self) -> Optional[int]:
+        return self.backbone.get_input_embeddings().num_embeddings if self.is_vocab_trimmed else None
+        
+    def resize_word_embeddings(self, num_embeddings: int) -> nn.Embedding:
+        '''Replace the word embeddings by num_embeddings new rows, return the original ones'''
+        word_embeddings = self.backbone.get_input_embeddings()
+        assert isinstance(word_embeddings, nn.Embedding)
+        self.backbone.set_input_embeddings(
+            nn.Embedding(num_embeddings, word_embeddings.embedding_dim)
+        )
+        self.backbone.config.vocab_size = num_embeddings
+        self.token_id_mapping = torch.zeros(word_embeddings.num_embeddings, dtype=torch.long)
+        return word_embeddings
+        
+    def trim_vocab_to_token_ids(self, token_ids: Sequence[int]) -> None:
+        '''
+        Keep the word embeddings of token_ids and of the special tokens only.
+        The tokenizer is left as it is: its ids are remapped by the token_id_mapping buffer, which is part of
+        the state dict, and trimmed tokens are mapped to the unknown token
+        '''
+        assert not self.is_vocab_trimmed, "The vocab is already trimmed"
+        assert isinstance(self.transformation, HuggingFaceTokenizationTransformation)
+        tokenizer = self.transformation.tokenizer
+        
+        kept_token_ids = torch.as_tensor(sorted({int(token_id) for token_id in token_ids} | set(tokenizer.all_special_ids)))
+        word_embeddings = self.resize_word_embeddings(len(kept_token_ids))
+        device = word_embeddings.weight.device
+        
+        unknown_token_id = tokenizer.unk_token_id if tokenizer.unk_token_id is not None else tokenizer.pad_token_id
+        token_id_mapping = torch.full(
+            (word_embeddings.num_embeddings,), int(torch.searchsorted(kept_token_ids, torch.tensor(unknown_token_id)))
+        )
+        token_id_mapping[kept_token_ids] = torch.arange(len(kept_token_ids))
+        self.token_id_mapping = token_id_mapping.to(device)
+        
+        trimmed_word_embeddings = self.backbone.get_input_embeddings().to(device)
+        trimmed_word_embeddings.weight.requires_grad_(word_embeddings.weight.requires_grad)
+        if word_embeddings.padding_idx is not None:
+            trimmed_word_embeddings.padding_idx = int(token_id_mapping[word_embeddings.padding_idx])
+        with torch.no_grad():
+            trimmed_word_embeddings.weight.copy_(word_embeddings.weight[kept_token_ids.to(device)])
+        
+    @property
+    def num_layers(self) -> int:
+        return int(self.backbone.config.num_hidden_layers)
+        
+    def merge_lora(self) -> None:
+        '''Merge the low-rank updates into the weights, so that inference runs the plain backbone'''
+        if self.lora_rank is None:
+            return
+        merge_lora(self.backbone)
+        self.lora_rank = None
+        
+    def check_prunable(self) -> None:
+        if self.backbone.config.model_type not in PRUNABLE_MODEL_TYPES:
+            raise ValueError(f"No structured pruning of {self.backbone.config.model_type} models, only of {PRUNABLE_MODEL_TYPES}")
+        
+    def get_pruned_layout(self) -> tuple[int, list[list[int]], list[int]]:
+        '''Values of pruned_num_layers, pruned_heads and intermediate_sizes rebuilding this backbone'''
+        return get_pruned_layout(self.backbone)
+        
+    def prepare_encodings(self, encodings: Union[BatchEncoding, CompactEncodings]) -> BatchEncoding:
+        if isinstance(encodings, CompactEncodings):
+            encodings = encodings.expand()
+        if self.token_id_mapping is not None:
+            encodings = BatchEncoding({**encodings, "input_ids": self.token_id_mapping[encodings["input_ids"]]})
+        return encodings
+        
+    def embed(self, encodings: Union[BatchEncoding, CompactEncodings]) -> tuple[torch.Tensor, torch.Tensor]:
+        '''Input of the first encoder layer and the attention mask, for models running the layers themselves'''
+        encodings = self.prepare_encodings(encodings)
+        hidden_states = self.backbone.embeddings(
+            input_ids=encodings["input_ids"],
+            token_type_ids=encodings.get("token_type_ids")
+        )
+        return hidden_states, encodings["attention_mask"]
+        
+    def run_layers(self, hidden_states: torch.Tensor, attention_mask: torch.Tensor, start: int, end: int) -> torch.Tensor:
+        '''Encoder layers start to end (exclusive) on hidden states of embed or of previous run_layers calls'''
+        extended_attention_mask = self.backbone.get_extended_attention_mask(attention_mask, attention_mask.shape)
+        for layer in self.backbone.encoder.layer[start:end]:
+            hidden_states = layer(hidden_states, attention_mask=extended_attention_mask)[0]
+        return hidden_states
+        
+    def pool(self, hidden_states: torch.Tensor) -> Optional[torch.Tensor]:
+        pooler = getattr(self.backbone, "pooler", None)
+        return pooler(hidden_states) if pooler is not None else None
+        
+    def forward(self, encodings: Union[BatchEncoding, CompactEncodings]) -> BaseModelOutputWithPooling:
+        encodings = self.prepare_encodings(encodings)
+        if PACKED_EXAMPLE_POSITIONS_KEY in encodings:
+            return self.forward_packed(encodings)
+        if self.unpadded:
+            return self.forward_unpadded(encodings)
         
-    def forward(self, encodings: BatchEncoding) -> BaseModelOutputWithPooling:
         output = self.backbone(**encodings)
-        return output
+        # The attention mask lets adapters pool over real tokens only
+        return MaskedBaseModelOutputWithPooling(
+            last_hidden_state=output.last_hidden_state,
+            pooler_output=output.pooler_output,
+            hidden_states=output.hidden_states,
+            attentions=output.attentions,
+            attention_mask=encodings.get("attention_mask")
+        )
+    
+    def forward_unpadded(self, encodings: BatchEncoding) -> MaskedBaseModelOutputWithPooling:
+        '''Run the real tokens only (see bert_unpadded_forward), outputs come back right padded whatever the padding side'''
+        last_hidden_state, pooler_output, attention_mask = bert_unpadded_forward(
+            self.backbone, 
+            input_ids=encodings["input_ids"], 
+            attention_mask=encodings["attention_mask"], 
+            token_type_ids=encodings.get("token_type_ids")
+        )
+        return MaskedBaseModelOutputWithPooling(
+            last_hidden_state=last_hidden_state, 
+            pooler_output=pooler_output, 
+            attention_mask=attention_mask
+        )
+    
+    def forward_packed(self, encodings: BatchEncoding) -> MaskedBaseModelOutputWithPooling:
+        '''Run packed rows (see HuggingFaceTokenizationTransformation.pack) and split them back into examples'''
+        model_inputs = {key: value for key, value in encodings.items() if key != PACKED_EXAMPLE_POSITIONS_KEY}
+        packed_hidden_state = self.backbone(**model_inputs).last_hidden_state  # (num_rows, row_len, hidden_size)
+        
+        example_positions = encodings[PACKED_EXAMPLE_POSITIONS_KEY]  # (num_examples, 3): row, start, length
+        rows, starts, lengths = example_positions.unbind(dim=1)
+        offsets = torch.arange(int(lengths.max()), device=packed_hidden_state.device)
+        attention_mask = offsets.unsqueeze(0) < lengths.unsqueeze(1)  # (num_examples, max_length)
+        token_indices = (starts.unsqueeze(1) + offsets.unsqueeze(0)).clamp(max=packed_hidden_state.shape[1] - 1)
+        
+        last_hidden_state = packed_hidden_state[rows.unsqueeze(1), token_indices]
+        last_hidden_state = last_hidden_state * attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        
+        pooler_output = self.pool(last_hidden_state)
+        
+        return MaskedBaseModelOutputWithPooling(
+            last_hidden_state=last_hidden_state, 
+            pooler_output=pooler_output, 
+            attention_mask=attention_mask.long()
+        )
         
     def get_backbone(self, pretrained_model_name_or_path: str, pretrained: bool) -> nn.Module:
         path = translate_gcs_dir_to_local(pretrained_model_name_or_path)
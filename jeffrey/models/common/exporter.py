@@ -1,3 +1,4 @@
+import copy
 import os
 import sys
 import tarfile
@@ -9,7 +10,9 @@
 from hydra.utils import instantiate
 
 from jeffrey.models.common.io_utils import cache_gcs_resource_locally, copy_file
+from jeffrey.models.lora import merge_lora_state_dict
 from jeffrey.models.common.utils import get_local_rank, global_rank_zero_first, get_global_rank, local_rank_zero_first
+from jeffrey.utils.registry import get_config_hash, get_registry
 from jeffrey.utils.utils import get_logger
 
 
@@ -20,6 +23,10 @@
 EXPORTED_MODEL_FILE_NAME = "exported_model.tar.gz"
 
 
+def get_tar_model_registry_key(tar_model_path: str) -> str:
+    return get_config_hash({"tar_model": tar_model_path})
+
+
 class TarModelExporter:
     def __init__(
         self,
@@ -37,6 +44,23 @@ def download_model_state_dict(self) -> str:
         '''Save state dict for modle into local & Return local path'''
         return cache_gcs_resource_locally(self.model_state_dict_path)
     
+    def merge_lora_weights(self, state_dict_path: str) -> str:
+        '''
+        Merge the low-rank updates of a LoRA backbone into its weights & Return local path of the merged state dict.
+        The exported config builds the plain backbone, so inference costs the same as without LoRA
+        '''
+        backbone_config = OmegaConf.select(self.model_config, "backbone")
+        state_dict = torch.load(state_dict_path, map_location=torch.device("cpu"))
+        state_dict = merge_lora_state_dict(state_dict, scaling=backbone_config.lora_alpha / backbone_config.lora_rank)
+        
+        merged_state_dict_path = os.path.join(tempfile.gettempdir(), f"merged_{STATE_DICT_PATH}")
+        torch.save(state_dict, merged_state_dict_path)
+        
+        self.model_config = copy.deepcopy(self.model_config)
+        self.model_config.backbone.lora_rank = None
+        self.logger.info("Merged LoRA weights into the backbone weights")
+        return merged_state_dict_path
+    
     def save_model_config(self) -> str:
         '''Save model configuration into local & Return local path'''
         model_config_save_path = os.path.join(tempfile.gettempdir(), MODEL_CONFIG_PATH)
@@ -47,6 +71,8 @@ def export(self) -> None:
         with global_rank_zero_first():
             if get_global_rank() in [0, -1]:
                 state_dict_path = self.download_model_state_dict()
+                if OmegaConf.select(self.model_config, "backbone.lora_rank") is not None:
+                    state_dict_path = self.merge_lora_weights(state_dict_path)
                 model_config_path = self.save_model_config()
                 local_tar_path = os.path.join(tempfile.gettempdir(), EXPORTED_MODEL_FILE_NAME)
                 
@@ -86,6 +112,11 @@ def __init__(self, exported_model_path: str) -> None:
         self.logger = get_logger(self.__class__.__name__)
 
     def load(self) -> Any:
+        # Callers compile, move and load weights into the model in place: the registered one is never handed out
+        model = get_registry().get_or_build(get_tar_model_registry_key(self.exported_model_path), self.load_from_tar)
+        return copy.deepcopy(model)
+
+    def load_from_tar(self) -> Any:
         temp_target_path = "/tmp/temp_jeffrey"
 
         with local_rank_zero_first():
@@ -3,10 +3,11 @@
 from typing import Any
 from fsspec import AbstractFileSystem, filesystem
 
+from jeffrey.utils.artifact_cache import get_cached_artifact
+
 GCS_PREFIX = "gs://"
 GCS_FILE_SYSTEM_NAME = "gcs"
 LOCAL_FILE_SYSTEM_NAME = "file"
-TMP_FILE_PATH = "/tmp/"
 
 
 def choose_file_system(path: str) -> AbstractFileSystem:
@@ -71,36 +72,8 @@ def copy_dir(source_dir: str, target_dir: str) -> None:
             raise ValueError(f"Source file {source_file} is not a file.")
         
 
-def convert_gcs_path_to_local_path(path: str) -> str:
-    if path.startswith(GCS_PREFIX):
-        path = path.rstrip("/")
-        local_path = os.path.join(TMP_FILE_PATH, os.path.split(path)[-1])
-        return local_path
-    return path
-        
-
 def cache_gcs_resource_locally(path: str) -> str:
+    '''Local copy of a gs:// file or directory, kept in (and validated against the remote version by) the artifact cache'''
     if path.startswith(GCS_PREFIX):
-        local_path = convert_gcs_path_to_local_path(path)
-        
-        if os.path.exists(local_path):
-            return local_path
-        
-        if is_dir(path):
-            os.makedirs(local_path, exist_ok=True)
-            copy_dir(path, local_path)
-        else:
-            copy_file(path, local_path)
-        return local_path
-    
+        return get_cached_artifact(path)
     return path
-        
-
-def translate_gcs_dir_to_local(path: str) -> str:
-    if path.startswith(GCS_PREFIX):
-        path = path.rstrip("/")
-        local_path = os.path.join(TMP_FILE_PATH, os.path.split(path)[-1])
-        os.makedirs(local_path, exist_ok=True)
-        copy_dir(path, local_path)
-        return local_path
-    return path
\ No newline at end of file
@@ -0,0 +1,93 @@
+import math
+from typing import Optional, Sequence
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+# Attention and feed-forward projections of BERT-like encoders, matched as module name suffixes
+LORA_TARGET_MODULES = ["query", "key", "value", "output.dense", "intermediate.dense"]
+LORA_PARAMETER_NAMES = ["lora_A", "lora_B"]
+
+
+class LoRALinear(nn.Linear):
+    '''
+    Linear layer with a trainable low-rank update: W x + b + (alpha / rank) B A x.
+    It keeps the weight and bias names of nn.Linear, so merging the update (see merge_lora_state_dict)
+    gives the state dict of the plain model.
+    '''
+    def __init__(self, in_features: int, out_features: int, rank: int, alpha: float, dropout: float = 0.0, bias: bool = True) -> None:
+        super().__init__(in_features, out_features, bias=bias)
+        self.rank = rank
+        self.scaling = alpha / rank
+        self.lora_A = nn.Parameter(torch.empty(rank, in_features))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, rank))  # The update starts at zero
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.lora_dropout = nn.Dropout(dropout)
+
+    @classmethod
+    def from_linear(cls, linear: nn.Linear, rank: int, alpha: float, dropout: float = 0.0) -> "LoRALinear":
+        lora_linear = cls(linear.in_features, linear.out_features, rank, alpha, dropout, bias=linear.bias is not None)
+        lora_linear.to(linear.weight.device)
+        lora_linear.weight = linear.weight
+        lora_linear.bias = linear.bias
+        return lora_linear
+
+    def forward(self, x: Tensor) -> Tensor:
+        lora_A, lora_B = self.lora_A.to(x.dtype), self.lora_B.to(x.dtype)
+        return F.linear(x, self.weight, self.bias) + F.linear(F.linear(self.lora_dropout(x), lora_A), lora_B) * self.scaling
+
+    def merge(self) -> nn.Linear:
+        '''Plain linear layer computing the same function'''
+        linear = nn.Linear(self.in_features, self.out_features, bias=self.bias is not None).to(self.weight.device)
+        with torch.no_grad():
+            linear.weight.copy_(self.weight + self.scaling * self.lora_B @ self.lora_A)
+            if self.bias is not None:
+                linear.bias.copy_(self.bias)
+        linear.requires_grad_(self.weight.requires_grad)
+        return linear
+
+
+def is_lora_target(module_name: str, target_modules: Sequence[str]) -> bool:
+    return any(module_name == target or module_name.endswith(f".{target}") for target in target_modules)
+
+
+def inject_lora(
+    model: nn.Module,
+    rank: int,
+    alpha: float,
+    dropout: float = 0.0,
+    target_modules: Optional[Sequence[str]] = None
+) -> list[str]:
+    '''Replace the target linear layers of a model by LoRALinear layers, return their names'''
+    target_modules = target_modules if target_modules is not None else LORA_TARGET_MODULES
+    targets = [
+        name for name, module in model.named_modules()
+        if type(module) is nn.Linear and is_lora_target(name, target_modules)
+    ]
+    for name in targets:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        setattr(parent, child_name, LoRALinear.from_linear(getattr(parent, child_name), rank, alpha, dropout))
+    return targets
+
+
+def merge_lora(model: nn.Module) -> None:
+    '''Replace every LoRALinear layer of a model by its merged linear layer'''
+    lora_names = [name for name, module in model.named_modules() if isinstance(module, LoRALinear)]
+    for name in lora_names:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        setattr(parent, child_name, getattr(parent, child_name).merge())
+
+
+def merge_lora_state_dict(state_dict: dict[str, Tensor], scaling: float) -> dict[str, Tensor]:
+    '''State dict of the plain model, with the low-rank updates added to the weights they belong to'''
+    merged_state_dict = {key: value for key, value in state_dict.items() if key.rpartition(".")[2] not in LORA_PARAMETER_NAMES}
+    for key, lora_A in state_dict.items():
+        prefix, _, parameter_name = key.rpartition(".")
+        if parameter_name == "lora_A":
+            lora_B = state_dict[f"{prefix}.lora_B"]
+            weight = merged_state_dict[f"{prefix}.weight"]
+            merged_state_dict[f"{prefix}.weight"] = (weight.float() + scaling * lora_B.float() @ lora_A.float()).to(weight.dtype)
+    return merged_state_dict
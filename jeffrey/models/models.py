@@ -1,11 +1,13 @@
 from abc import abstractmethod
-from typing import Optional
+from typing import Optional, Union
+import torch
 from torch import Tensor, nn
 from transformers import BatchEncoding
+from transformers.modeling_outputs import BaseModelOutputWithPooling
 
-from jeffrey.models.transformations import Transformation
+from jeffrey.models.transformations import PACKED_EXAMPLE_POSITIONS_KEY, CompactEncodings, Transformation
 from jeffrey.models.adapters import Adapter
-from jeffrey.models.backbones import Backbone
+from jeffrey.models.backbones import Backbone, HuggingFaceBackbone, MaskedBaseModelOutputWithPooling
 from jeffrey.models.heads import Head
 
 
@@ -28,8 +30,9 @@ def __init__(
         self.head = head
         self.adapter = adapter
         
-    def forward(self, encodings: BatchEncoding) -> Tensor:
-        output = self.backbone(encodings)
+    def forward(self, encodings: Union[BatchEncoding, BaseModelOutputWithPooling]) -> Tensor:
+        # Outputs of a frozen backbone read from an embedding store skip the backbone
+        output = encodings if isinstance(encodings, BaseModelOutputWithPooling) else self.backbone(encodings)
         if self.adapter is not None:
             output = self.adapter(output)
         output = self.head(output)
@@ -37,4 +40,205 @@ def forward(self, encodings: BatchEncoding) -> Tensor:
         return output
     
     def get_transformation(self) -> Transformation:
-        return self.backbone.get_transformation()
\ No newline at end of file
+        return self.backbone.get_transformation()
+
+
+class MultiBranchBinaryTextClassificationModel(BinaryTextClassificationModel):
+    '''
+    BinaryTextClassificationModel with K adapter / head branches on one shared backbone output:
+    branch 0 is adapter and head, branch k > 0 is branch_adapters[k - 1] and branch_heads[k - 1].
+    forward returns the mean of the branch outputs, or the output of output_branch only when it is set.
+    '''
+    def __init__(
+        self,
+        backbone: Backbone,
+        head: Head,
+        adapter: Optional[Adapter],
+        branch_heads: list[Head],
+        branch_adapters: Optional[list[Optional[Adapter]]] = None,
+        output_branch: Optional[int] = None
+    ) -> None:
+        super().__init__(backbone=backbone, head=head, adapter=adapter)
+        
+        branch_adapters = branch_adapters if branch_adapters is not None else [None] * len(branch_heads)
+        assert len(branch_adapters) == len(branch_heads) > 0, "Every extra branch needs a head, and an adapter or None"
+        
+        # Missing adapters pass the backbone output through, like adapter=None
+        self.branch_adapters = nn.ModuleList([
+            branch_adapter if branch_adapter is not None else nn.Identity() for branch_adapter in branch_adapters
+        ])
+        self.branch_heads = nn.ModuleList(branch_heads)
+        
+        if output_branch is not None and not 0 <= output_branch < self.num_branches:
+            raise ValueError(f"output_branch has to be in [0, {self.num_branches}), got {output_branch}")
+        self.output_branch = output_branch
+    
+    @property
+    def num_branches(self) -> int:
+        return 1 + len(self.branch_heads)
+    
+    def forward_branch(self, branch_idx: int, output: BaseModelOutputWithPooling) -> Tensor:
+        if branch_idx == 0:
+            if self.adapter is not None:
+                output = self.adapter(output)
+            return self.head(output)
+        return self.branch_heads[branch_idx - 1](self.branch_adapters[branch_idx - 1](output))
+    
+    def forward_branches(self, encodings: Union[BatchEncoding, BaseModelOutputWithPooling]) -> Tensor:
+        '''Outputs of every branch, (num_branches, batch_size, num_outputs), from a single backbone pass'''
+        output = encodings if isinstance(encodings, BaseModelOutputWithPooling) else self.backbone(encodings)
+        return torch.stack([self.forward_branch(branch_idx, output) for branch_idx in range(self.num_branches)])
+    
+    def combine_branch_outputs(self, branch_outputs: Tensor) -> Tensor:
+        '''Model output from the outputs of forward_branches'''
+        return branch_outputs.mean(dim=0) if self.output_branch is None else branch_outputs[self.output_branch]
+    
+    def get_branch_model(self, branch_idx: int) -> BinaryTextClassificationModel:
+        '''Model of a single branch, sharing the backbone and the modules of that branch'''
+        if branch_idx == 0:
+            return BinaryTextClassificationModel(backbone=self.backbone, head=self.head, adapter=self.adapter)
+        branch_adapter = self.branch_adapters[branch_idx - 1]
+        return BinaryTextClassificationModel(
+            backbone=self.backbone,
+            head=self.branch_heads[branch_idx - 1],
+            adapter=None if isinstance(branch_adapter, nn.Identity) else branch_adapter
+        )
+    
+    def forward(self, encodings: Union[BatchEncoding, BaseModelOutputWithPooling]) -> Tensor:
+        if self.output_branch is None:
+            return self.combine_branch_outputs(self.forward_branches(encodings))
+        # A single branch costs the backbone and that branch only
+        output = encodings if isinstance(encodings, BaseModelOutputWithPooling) else self.backbone(encodings)
+        return self.forward_branch(self.output_branch, output)
+
+
+# Exit thresholds of the accuracy / layers executed tradeoff reported in validation and evaluation
+DEFAULT_EXIT_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+
+def get_exit_confidences(outputs: Tensor) -> Tensor:
+    '''Confidence max(p, 1 - p) of (batch_size, num_outputs) sigmoid outputs, of the least confident output'''
+    return torch.maximum(outputs, 1 - outputs).amin(dim=1)
+
+
+class EarlyExitBinaryTextClassificationModel(BinaryTextClassificationModel):
+    '''
+    BinaryTextClassificationModel with exits on intermediate layers: exit i runs exit_adapters[i], then exit_heads[i],
+    on the hidden states of backbone layer exit_layers[i] (1 is the first layer). Exit adapters pool last_hidden_state,
+    intermediate layers have no pooler output.
+    In training every exit is computed (see forward_all_exits) for a joint loss. At inference a sample leaves
+    at the first exit whose confidence reaches exit_threshold, and the remaining layers only run on the others.
+    '''
+    def __init__(
+        self,
+        backbone: Backbone,
+        head: Head,
+        adapter: Optional[Adapter],
+        exit_layers: list[int],
+        exit_adapters: list[Adapter],
+        exit_heads: list[Head],
+        exit_threshold: float = 0.9
+    ) -> None:
+        super().__init__(backbone=backbone, head=head, adapter=adapter)
+        
+        if not isinstance(backbone, HuggingFaceBackbone) or backbone.unpadded:
+            raise ValueError("Early exits need a HuggingFaceBackbone running its layers one by one, not unpadded")
+        assert len(exit_layers) == len(exit_adapters) == len(exit_heads) > 0, "Every exit needs a layer, an adapter and a head"
+        assert list(exit_layers) == sorted(set(exit_layers)) and 0 < exit_layers[0] and exit_layers[-1] < backbone.num_layers, \
+            "exit_layers have to be increasing layer numbers below the number of backbone layers"
+        
+        self.exit_layers = list(exit_layers)
+        self.exit_adapters = nn.ModuleList(exit_adapters)
+        self.exit_heads = nn.ModuleList(exit_heads)
+        self.exit_threshold = exit_threshold
+        
+    @property
+    def num_layers(self) -> int:
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        return self.backbone.num_layers
+        
+    def forward(self, encodings: Union[BatchEncoding, BaseModelOutputWithPooling]) -> Tensor:
+        if self.training:
+            return self.forward_all_exits(encodings)[-1]
+        return self.forward_early_exit(encodings)[0]
+    
+    def check_encodings(self, encodings: Union[BatchEncoding, CompactEncodings, BaseModelOutputWithPooling]) -> None:
+        '''Exits need the hidden states of intermediate layers, of one example per row'''
+        if isinstance(encodings, BaseModelOutputWithPooling):
+            raise ValueError("Early exit models run the backbone layers themselves, they cannot use an embedding store")
+        if isinstance(encodings, BatchEncoding) and PACKED_EXAMPLE_POSITIONS_KEY in encodings:
+            raise ValueError("Early exit models need one example per row, packed batches are not supported")
+        
+    def get_exit_output(self, exit_idx: int, hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
+        output = MaskedBaseModelOutputWithPooling(last_hidden_state=hidden_states, attention_mask=attention_mask)
+        return self.exit_heads[exit_idx](self.exit_adapters[exit_idx](output))
+    
+    def get_final_output(self, hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        output = MaskedBaseModelOutputWithPooling(
+            last_hidden_state=hidden_states, 
+            pooler_output=self.backbone.pool(hidden_states), 
+            attention_mask=attention_mask
+        )
+        if self.adapter is not None:
+            output = self.adapter(output)
+        return self.head(output)
+    
+    def forward_all_exits(self, encodings: BatchEncoding) -> list[Tensor]:
+        '''Outputs of every exit in layer order, then of the final head, all from a single pass'''
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        self.check_encodings(encodings)
+        hidden_states, attention_mask = self.backbone.embed(encodings)
+        outputs = []
+        start = 0
+        for exit_idx, exit_layer in enumerate(self.exit_layers):
+            hidden_states = self.backbone.run_layers(hidden_states, attention_mask, start, exit_layer)
+            outputs.append(self.get_exit_output(exit_idx, hidden_states, attention_mask))
+            start = exit_layer
+        hidden_states = self.backbone.run_layers(hidden_states, attention_mask, start, self.num_layers)
+        outputs.append(self.get_final_output(hidden_states, attention_mask))
+        return outputs
+    
+    def forward_early_exit(self, encodings: BatchEncoding) -> tuple[Tensor, Tensor]:
+        '''Outputs and number of layers executed of every sample, samples leaving at an exit are dropped from the batch'''
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        self.check_encodings(encodings)
+        hidden_states, attention_mask = self.backbone.embed(encodings)
+        batch_size = len(hidden_states)
+        remaining = torch.arange(batch_size, device=hidden_states.device)
+        layers_executed = torch.full((batch_size,), self.num_layers, device=hidden_states.device)
+        outputs: Optional[Tensor] = None
+        
+        start = 0
+        for exit_idx, exit_layer in enumerate(self.exit_layers):
+            hidden_states = self.backbone.run_layers(hidden_states, attention_mask, start, exit_layer)
+            exit_outputs = self.get_exit_output(exit_idx, hidden_states, attention_mask)
+            if outputs is None:
+                outputs = exit_outputs.new_empty((batch_size, *exit_outputs.shape[1:]))
+            
+            leaving = get_exit_confidences(exit_outputs) >= self.exit_threshold
+            outputs[remaining[leaving]] = exit_outputs[leaving]
+            layers_executed[remaining[leaving]] = exit_layer
+            remaining, hidden_states, attention_mask = remaining[~leaving], hidden_states[~leaving], attention_mask[~leaving]
+            start = exit_layer
+            if len(remaining) == 0:
+                return outputs, layers_executed
+        
+        assert outputs is not None
+        hidden_states = self.backbone.run_layers(hidden_states, attention_mask, start, self.num_layers)
+        outputs[remaining] = self.get_final_output(hidden_states, attention_mask)
+        return outputs, layers_executed
+    
+    def select_exit_outputs(self, all_exit_outputs: list[Tensor], exit_threshold: float) -> tuple[Tensor, Tensor]:
+        '''
+        Outputs and number of layers executed that forward_early_exit would give with exit_threshold,
+        from the outputs of forward_all_exits, so that thresholds can be compared without running the model again
+        '''
+        stacked_outputs = torch.stack(all_exit_outputs)  # (num_exits + 1, batch_size, num_outputs)
+        leaving = torch.stack([get_exit_confidences(outputs) >= exit_threshold for outputs in all_exit_outputs[:-1]])
+        leaving = torch.cat([leaving, torch.ones_like(leaving[:1])])  # Every sample leaves at the final head at the latest
+        exit_indices = leaving.long().argmax(dim=0)  # First exit every sample leaves at
+        
+        outputs = stacked_outputs[exit_indices, torch.arange(stacked_outputs.shape[1], device=stacked_outputs.device)]
+        layers = torch.tensor([*self.exit_layers, self.num_layers], device=stacked_outputs.device)
+        return outputs, layers[exit_indices]
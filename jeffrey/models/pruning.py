@@ -0,0 +1,61 @@
+from typing import Optional, Sequence
+
+import torch
+from torch import nn
+from transformers.pytorch_utils import prune_linear_layer
+
+# Encoders whose layers the functions below know how to prune
+PRUNABLE_MODEL_TYPES = ["bert"]
+
+
+def get_remaining_heads(layer: nn.Module, num_attention_heads: int) -> list[int]:
+    '''Original numbers of the attention heads left in a layer, in the order of its weights'''
+    return [head for head in range(num_attention_heads) if head not in layer.attention.pruned_heads]
+
+
+def remove_layers(model: nn.Module, layer_indices: Sequence[int]) -> None:
+    '''Remove whole encoder layers, the following ones are renumbered'''
+    removed_layers = set(layer_indices)
+    model.encoder.layer = nn.ModuleList(
+        [layer for idx, layer in enumerate(model.encoder.layer) if idx not in removed_layers]
+    )
+    model.config.num_hidden_layers = len(model.encoder.layer)
+
+
+def prune_attention_heads(layer: nn.Module, heads: Sequence[int]) -> None:
+    '''Remove the query, key, value and output weights of heads, given by their original numbers'''
+    layer.attention.prune_heads(set(heads))
+
+
+def prune_ffn_neurons(layer: nn.Module, kept_neurons: torch.Tensor) -> None:
+    '''Keep only the kept_neurons of the feed-forward intermediate layer'''
+    kept_neurons = kept_neurons.to(layer.intermediate.dense.weight.device)
+    layer.intermediate.dense = prune_linear_layer(layer.intermediate.dense, kept_neurons, dim=0)
+    layer.output.dense = prune_linear_layer(layer.output.dense, kept_neurons, dim=1)
+
+
+def get_pruned_layout(model: nn.Module) -> tuple[int, list[list[int]], list[int]]:
+    '''Number of layers, pruned heads (original numbers) and intermediate size of every layer'''
+    layers = model.encoder.layer
+    pruned_heads = [sorted(layer.attention.pruned_heads) for layer in layers]
+    intermediate_sizes = [layer.intermediate.dense.out_features for layer in layers]
+    return len(layers), pruned_heads, intermediate_sizes
+
+
+def apply_pruned_layout(
+    model: nn.Module,
+    num_layers: Optional[int],
+    pruned_heads: Optional[list[list[int]]],
+    intermediate_sizes: Optional[list[int]]
+) -> None:
+    '''
+    Give a freshly built model the shapes of a pruned one (see get_pruned_layout), so that its state dict loads.
+    Kept weights are arbitrary until then: the first layers and first neurons of every layer.
+    '''
+    if num_layers is not None:
+        remove_layers(model, range(num_layers, len(model.encoder.layer)))
+    for idx, layer in enumerate(model.encoder.layer):
+        if pruned_heads is not None:
+            prune_attention_heads(layer, pruned_heads[idx])
+        if intermediate_sizes is not None and intermediate_sizes[idx] != layer.intermediate.dense.out_features:
+            prune_ffn_neurons(layer, torch.arange(intermediate_sizes[idx]))
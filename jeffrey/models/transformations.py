@@ -1,10 +1,102 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib
+import json
 import os
-from typing import List
+import tempfile
+from typing import Any, List, Optional, Sequence
 
+import torch
+from torch.utils.data import get_worker_info
 from transformers import BatchEncoding, PreTrainedTokenizerBase, AutoTokenizer
 
-from jeffrey.utils.io_utils import is_dir, is_file, translate_gcs_dir_to_local
+from jeffrey.utils.artifact_cache import translate_gcs_dir_to_local
+from jeffrey.utils.io_utils import is_dir, is_file
+from jeffrey.utils.registry import get_config_hash, get_registry
+
+PACKED_EXAMPLE_POSITIONS_KEY = "example_positions"
+TOKENIZER_HASH_FILE_NAME = "tokenizer_hash.txt"
+
+
+def get_tokenizer_content_hash(tokenizer: PreTrainedTokenizerBase) -> str:
+    '''Hash of the files that fully describe the tokenizer, independent of where it was loaded from'''
+    hasher = hashlib.sha256()
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        tokenizer.save_pretrained(tokenizer_dir)
+        for file_name in sorted(os.listdir(tokenizer_dir)):
+            hasher.update(file_name.encode())
+            with open(os.path.join(tokenizer_dir, file_name), "rb") as f:
+                content = f.read()
+            if file_name == "tokenizer.json":
+                # Truncation / padding state of the backend tokenizer depends on the last call, not the tokenizer
+                tokenizer_json = json.loads(content)
+                tokenizer_json["truncation"] = None
+                tokenizer_json["padding"] = None
+                content = json.dumps(tokenizer_json, sort_keys=True).encode()
+            hasher.update(content)
+    return hasher.hexdigest()
+
+
+def get_tokenizer_registry_key(pretrained_tokenizer_name_or_path: str) -> str:
+    return get_config_hash({"tokenizer": pretrained_tokenizer_name_or_path})
+
+
+def load_tokenizer_hash(tokenizer_dir: str) -> Optional[str]:
+    '''Content hash saved next to a trained tokenizer, None for tokenizers that were not saved with one'''
+    tokenizer_hash_path = os.path.join(tokenizer_dir, TOKENIZER_HASH_FILE_NAME)
+    if not os.path.isfile(tokenizer_hash_path):
+        return None
+    with open(tokenizer_hash_path, "r") as f:
+        return f.read().strip()
+
+
+class CompactEncodings:
+    '''
+    Compact form of a padded BatchEncoding for the trip from DataLoader workers to the model:
+    token ids in the smallest integer dtype that fits the vocabulary (int16 up to 32767 ids, int32 above)
+    followed by the length of every example, both stored in one contiguous buffer, so that moving a batch
+    across processes or to the device is a single copy of 2-4 bytes per token instead of three int64 tensors.
+    The attention mask is rebuilt from the lengths by expand(), on whatever device the batch is on;
+    token_type_ids are dropped, models that take them default to zeros, which is what the tokenizer returns
+    for single sequences.
+    '''
+    def __init__(self, buffer: torch.Tensor, batch_size: int, max_len: int, padding_side: str, pad_token_id: int) -> None:
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.padding_side = padding_side
+        self.pad_token_id = pad_token_id
+        
+    @property
+    def input_ids(self) -> torch.Tensor:
+        return self.buffer[: self.batch_size * self.max_len].view(self.batch_size, self.max_len)
+    
+    @property
+    def lengths(self) -> torch.Tensor:
+        return self.buffer[self.batch_size * self.max_len :]
+    
+    def __len__(self) -> int:
+        return self.batch_size
+    
+    def to(self, *args: Any, **kwargs: Any) -> "CompactEncodings":
+        return self.replace_buffer(self.buffer.to(*args, **kwargs))
+    
+    def pin_memory(self) -> "CompactEncodings":
+        return self.replace_buffer(self.buffer.pin_memory())
+    
+    def replace_buffer(self, buffer: torch.Tensor) -> "CompactEncodings":
+        return CompactEncodings(buffer, self.batch_size, self.max_len, self.padding_side, self.pad_token_id)
+    
+    def get_attention_mask(self) -> torch.Tensor:
+        positions = torch.arange(self.max_len, device=self.buffer.device)
+        lengths = self.lengths.long().unsqueeze(1)
+        if self.padding_side == "left":
+            return (positions.unsqueeze(0) >= self.max_len - lengths).long()
+        return (positions.unsqueeze(0) < lengths).long()
+    
+    def expand(self) -> BatchEncoding:
+        '''The int64 input_ids / attention_mask BatchEncoding the backbone takes'''
+        return BatchEncoding({"input_ids": self.input_ids.long(), "attention_mask": self.get_attention_mask()})
 
 
 class Transformation(ABC):
@@ -17,14 +109,33 @@ class HuggingFaceTokenizationTransformation(Transformation):
     def __init__(
         self,
         pretrained_tokenizer_name_or_path: str,
-        max_sequence_len: int
+        max_sequence_len: int,
+        cache_size: int = 0,
+        static_sequence_lengths: Optional[List[int]] = None
     ) -> None:
         super().__init__()
         
         self.max_sequence_len = max_sequence_len
+        # Padded batches only ever have one of these lengths (max_sequence_len included) when set,
+        # so that compiled models see a small fixed set of shapes
+        self.static_sequence_lengths = (
+            sorted({length for length in static_sequence_lengths if length < max_sequence_len} | {max_sequence_len})
+            if static_sequence_lengths is not None else None
+        )
         self.tokenizer = self.get_tokenizer(pretrained_tokenizer_name_or_path)
         
+        # LRU of text hash -> token ids, disabled when cache_size is 0. Every DataLoader worker gets its own copy.
+        # Hits and misses are counted per process, one (hits, misses) row each: row 0 for the main process,
+        # row i + 1 for DataLoader worker i (see share_cache_counters). The rows live in shared memory,
+        # so that the main process reads the lookups of its workers.
+        self.cache_size = cache_size
+        self.cache: OrderedDict[bytes, List[int]] = OrderedDict()
+        self.cache_counters = torch.zeros((1, 2), dtype=torch.long).share_memory_()
+        
     def __call__(self, texts: List[str]) -> BatchEncoding:
+        if self.cache_size > 0 or self.static_sequence_lengths is not None:
+            return self.pad(self.encode_cached(texts))
+        
         output = self.tokenizer.batch_encode_plus(
             texts,
             truncation=True,
@@ -33,8 +144,183 @@ def __call__(self, texts: List[str]) -> BatchEncoding:
             max_length=self.max_sequence_len
         )
         return output
+    
+    def encode(self, texts: List[str]) -> List[List[int]]:
+        '''Tokenize texts into unpadded (but truncated) token ids'''
+        output = self.tokenizer(
+            texts,
+            truncation=True,
+            padding=False,
+            max_length=self.max_sequence_len,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        input_ids: List[List[int]] = output["input_ids"]
+        return input_ids
+    
+    def encode_cached(self, texts: List[str]) -> List[List[int]]:
+        '''encode() through the LRU cache: only texts not seen recently are tokenized, all in one call'''
+        if self.cache_size == 0:
+            return self.encode(texts)
+        
+        keys = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+        
+        missing_texts = {}
+        num_hits = 0
+        for key, text in zip(keys, texts):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                num_hits += 1
+            else:
+                missing_texts[key] = text
+        self.count_cache_lookups(num_hits, len(texts) - num_hits)
+                
+        encoded = dict(zip(missing_texts, self.encode(list(missing_texts.values())))) if missing_texts else {}
+        input_ids = [self.cache[key] if key in self.cache else encoded[key] for key in keys]
+        
+        for key, ids in encoded.items():
+            self.cache[key] = ids
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            
+        return input_ids
+    
+    def share_cache_counters(self, num_workers: int) -> None:
+        '''Counter rows for the main process and num_workers DataLoader workers, before the workers start'''
+        # Deep copies (e.g. of registered models) hold counters outside shared memory
+        if len(self.cache_counters) < num_workers + 1 or not self.cache_counters.is_shared():
+            self.cache_counters = torch.zeros((num_workers + 1, 2), dtype=torch.long).share_memory_()
+    
+    def count_cache_lookups(self, num_hits: int, num_misses: int) -> None:
+        worker_info = get_worker_info()
+        # Workers beyond the shared rows (share_cache_counters was not called) count in the last one
+        row = min(worker_info.id + 1, len(self.cache_counters) - 1) if worker_info is not None else 0
+        self.cache_counters[row, 0] += num_hits
+        self.cache_counters[row, 1] += num_misses
+    
+    @property
+    def cache_hits(self) -> int:
+        '''Hits of the main process and of its DataLoader workers since the last reset_cache_counters'''
+        return int(self.cache_counters[:, 0].sum())
+    
+    @property
+    def cache_misses(self) -> int:
+        return int(self.cache_counters[:, 1].sum())
+    
+    @property
+    def cache_hit_rate(self) -> float:
+        num_lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / num_lookups if num_lookups > 0 else 0.0
+    
+    def reset_cache_counters(self) -> None:
+        self.cache_counters.zero_()
+    
+    def get_padded_length(self, max_len: int) -> int:
+        '''Length a batch whose longest example has max_len tokens is padded to'''
+        if self.static_sequence_lengths is None:
+            return max_len
+        return next(length for length in self.static_sequence_lengths if length >= max_len)
+    
+    def pad(self, input_ids: Sequence[Sequence[int]]) -> BatchEncoding:
+        '''Pad already tokenized ids into the same tensors __call__ would return for the original texts'''
+        max_len = self.get_padded_length(max(len(ids) for ids in input_ids))
+        padded_input_ids = torch.full((len(input_ids), max_len), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+        
+        for i, ids in enumerate(input_ids):
+            length = len(ids)
+            if self.tokenizer.padding_side == "left":
+                padded_input_ids[i, max_len - length:] = torch.as_tensor(ids, dtype=torch.long)
+                attention_mask[i, max_len - length:] = 1
+            else:
+                padded_input_ids[i, :length] = torch.as_tensor(ids, dtype=torch.long)
+                attention_mask[i, :length] = 1
+        
+        data = {"input_ids": padded_input_ids}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            data["token_type_ids"] = torch.zeros_like(padded_input_ids)
+        data["attention_mask"] = attention_mask
+        
+        return BatchEncoding(data)
+    
+    def compact(self, input_ids: Sequence[Sequence[int]]) -> CompactEncodings:
+        '''Pad already tokenized ids into CompactEncodings, which expand() into what pad() would return'''
+        batch_size = len(input_ids)
+        max_len = self.get_padded_length(max(len(ids) for ids in input_ids))
+        dtype = torch.int16 if len(self.tokenizer) <= torch.iinfo(torch.int16).max else torch.int32
+        
+        buffer = torch.full((batch_size * max_len + batch_size,), self.tokenizer.pad_token_id, dtype=dtype)
+        compact_encodings = CompactEncodings(buffer, batch_size, max_len, self.tokenizer.padding_side, self.tokenizer.pad_token_id)
+        padded_input_ids = compact_encodings.input_ids
+        for i, ids in enumerate(input_ids):
+            length = len(ids)
+            if self.tokenizer.padding_side == "left":
+                padded_input_ids[i, max_len - length:] = torch.as_tensor(ids, dtype=dtype)
+            else:
+                padded_input_ids[i, :length] = torch.as_tensor(ids, dtype=dtype)
+        compact_encodings.lengths.copy_(torch.as_tensor([len(ids) for ids in input_ids], dtype=dtype))
+        
+        return compact_encodings
+    
+    def pack(self, input_ids: Sequence[Sequence[int]]) -> BatchEncoding:
+        '''
+        Pack several tokenized examples into each row of up to max_sequence_len tokens (first fit decreasing).
+        Examples only attend to themselves through a block diagonal (num_rows, row_len, row_len) attention_mask,
+        position ids restart at every example, and `example_positions` holds (row, start, length) of every example
+        in the original order, so the backbone can split its output back into one sequence per example.
+        '''
+        rows: List[List[int]] = []
+        row_lengths: List[int] = []
+        example_positions = torch.zeros((len(input_ids), 3), dtype=torch.long)
+        
+        for idx in sorted(range(len(input_ids)), key=lambda i: -len(input_ids[i])):
+            length = len(input_ids[idx])
+            row = next(
+                (row for row, row_length in enumerate(row_lengths) if row_length + length <= self.max_sequence_len), 
+                None
+            )
+            if row is None:
+                row = len(rows)
+                rows.append([])
+                row_lengths.append(0)
+            example_positions[idx] = torch.tensor([row, row_lengths[row], length])
+            rows[row].append(idx)
+            row_lengths[row] += length
+            
+        row_len = max(row_lengths)
+        packed_input_ids = torch.full((len(rows), row_len), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), row_len, row_len), dtype=torch.long)
+        position_ids = torch.zeros((len(rows), row_len), dtype=torch.long)
+        
+        for idx, (row, start, length) in enumerate(example_positions.tolist()):
+            end = start + length
+            packed_input_ids[row, start:end] = torch.as_tensor(input_ids[idx], dtype=torch.long)
+            attention_mask[row, start:end, start:end] = 1
+            position_ids[row, start:end] = torch.arange(length)
+            
+        data = {"input_ids": packed_input_ids}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            data["token_type_ids"] = torch.zeros_like(packed_input_ids)
+        data["attention_mask"] = attention_mask
+        data["position_ids"] = position_ids
+        data[PACKED_EXAMPLE_POSITIONS_KEY] = example_positions
+        
+        return BatchEncoding(data)
+    
+    def get_tokenizer_fingerprint(self) -> str:
+        '''Hash of the files that fully describe the tokenizer, independent of where it was loaded from'''
+        if self.saved_tokenizer_hash is not None:
+            return self.saved_tokenizer_hash
+        return get_tokenizer_content_hash(self.tokenizer)
         
     def get_tokenizer(self, pretrained_tokenizer_name_or_path: str) -> PreTrainedTokenizerBase:
+        tokenizer, self.saved_tokenizer_hash = get_registry().get_or_build(
+            get_tokenizer_registry_key(pretrained_tokenizer_name_or_path),
+            lambda: self.load_tokenizer(pretrained_tokenizer_name_or_path)
+        )
+        return tokenizer
+    
+    def load_tokenizer(self, pretrained_tokenizer_name_or_path: str) -> tuple[PreTrainedTokenizerBase, Optional[str]]:
         if is_dir(pretrained_tokenizer_name_or_path):
             tokenizer_dir = translate_gcs_dir_to_local(pretrained_tokenizer_name_or_path)
         elif is_file(pretrained_tokenizer_name_or_path):
@@ -44,4 +330,4 @@ def get_tokenizer(self, pretrained_tokenizer_name_or_path: str) -> PreTrainedTok
             tokenizer_dir = pretrained_tokenizer_name_or_path
             
         tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
-        return tokenizer
\ No newline at end of file
+        return tokenizer, load_tokenizer_hash(tokenizer_dir)
@@ -0,0 +1,106 @@
+from typing import NamedTuple, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+# Encoders whose modules bert_unpadded_forward knows how to run
+UNPADDED_MODEL_TYPES = ["bert"]
+
+
+class UnpaddedTokens(NamedTuple):
+    indices: Tensor  # (num_tokens,) positions of the real tokens in the flattened (batch_size * seq_len) inputs
+    output_indices: Tensor  # (num_tokens,) positions of the real tokens in the flattened right padded outputs
+    cu_seqlens: Tensor  # (batch_size + 1,) cumulative sequence lengths, sequence i is tokens cu_seqlens[i]:cu_seqlens[i+1]
+    position_ids: Tensor  # (num_tokens,) position of every token in its sequence
+    batch_size: int
+    max_seqlen: int
+
+
+def unpad_tokens(attention_mask: Tensor) -> UnpaddedTokens:
+    '''Ragged layout of the real tokens of a padded batch, whatever its padding side'''
+    batch_size = attention_mask.shape[0]
+    mask = attention_mask.bool()
+    lengths = mask.sum(dim=1)
+    max_seqlen = int(lengths.max())
+    cu_seqlens = F.pad(torch.cumsum(lengths, dim=0), (1, 0))
+
+    indices = torch.nonzero(mask.flatten(), as_tuple=False).flatten()
+    position_ids = torch.arange(len(indices), device=mask.device) - torch.repeat_interleave(cu_seqlens[:-1], lengths)
+    rows = torch.repeat_interleave(torch.arange(batch_size, device=mask.device), lengths)
+    output_indices = rows * max_seqlen + position_ids
+
+    return UnpaddedTokens(indices, output_indices, cu_seqlens, position_ids, batch_size, max_seqlen)
+
+
+def attend(query: Tensor, key: Tensor, value: Tensor, tokens: UnpaddedTokens, dropout_p: float) -> Tensor:
+    '''
+    Attention of every sequence over its own tokens, for (num_tokens, num_heads, head_size) inputs.
+    Only this step goes through a (batch_size, max_seqlen) view, with padded keys masked out;
+    nested tensors have neither a CPU backward nor a faster CPU kernel in the pinned torch version.
+    '''
+    num_heads, head_size = query.shape[1:]
+    padded_shape = (tokens.batch_size * tokens.max_seqlen, num_heads, head_size)
+
+    def pad(x: Tensor) -> Tensor:
+        padded = x.new_zeros(padded_shape).index_copy(0, tokens.output_indices, x)
+        return padded.view(tokens.batch_size, tokens.max_seqlen, num_heads, head_size).transpose(1, 2)
+
+    lengths = tokens.cu_seqlens[1:] - tokens.cu_seqlens[:-1]
+    key_mask = torch.arange(tokens.max_seqlen, device=query.device).unsqueeze(0) < lengths.unsqueeze(1)
+    context = F.scaled_dot_product_attention(
+        pad(query), pad(key), pad(value), attn_mask=key_mask[:, None, None, :], dropout_p=dropout_p
+    )
+    return context.transpose(1, 2).reshape(padded_shape)[tokens.output_indices]
+
+
+def bert_unpadded_forward(
+    model: nn.Module,
+    input_ids: Tensor,
+    attention_mask: Tensor,
+    token_type_ids: Optional[Tensor] = None
+) -> tuple[Tensor, Optional[Tensor], Tensor]:
+    '''
+    Forward of a HuggingFace BertModel on the real tokens only: embeddings, projections, feed-forward layers
+    and layer norms run on one (num_tokens, hidden_size) stream, so their cost scales with real tokens.
+    Returns the right padded last hidden state, the pooler output and the matching attention mask.
+    '''
+    tokens = unpad_tokens(attention_mask)
+    flat_input_ids = input_ids.flatten()[tokens.indices]
+    flat_token_type_ids = token_type_ids.flatten()[tokens.indices] if token_type_ids is not None else torch.zeros_like(flat_input_ids)
+
+    embeddings = model.embeddings
+    hidden_states = (
+        embeddings.word_embeddings(flat_input_ids)
+        + embeddings.token_type_embeddings(flat_token_type_ids)
+        + embeddings.position_embeddings(tokens.position_ids)
+    )
+    hidden_states = embeddings.dropout(embeddings.LayerNorm(hidden_states))
+
+    for layer in model.encoder.layer:
+        self_attention = layer.attention.self
+        head_shape = (-1, self_attention.num_attention_heads, self_attention.attention_head_size)
+        context = attend(
+            self_attention.query(hidden_states).view(head_shape),
+            self_attention.key(hidden_states).view(head_shape),
+            self_attention.value(hidden_states).view(head_shape),
+            tokens,
+            dropout_p=self_attention.dropout.p if self_attention.training else 0.0
+        )
+        attention_output = layer.attention.output(context.flatten(start_dim=1), hidden_states)
+        hidden_states = layer.output(layer.intermediate(attention_output), attention_output)
+
+    pooler_output = None
+    if getattr(model, "pooler", None) is not None:
+        pooler_output = model.pooler(hidden_states[tokens.cu_seqlens[:-1]].unsqueeze(1))
+
+    last_hidden_state = hidden_states.new_zeros((tokens.batch_size * tokens.max_seqlen, hidden_states.shape[-1]))
+    last_hidden_state = last_hidden_state.index_copy(0, tokens.output_indices, hidden_states)
+    output_attention_mask = torch.zeros(tokens.batch_size * tokens.max_seqlen, dtype=torch.long, device=input_ids.device)
+    output_attention_mask[tokens.output_indices] = 1
+
+    return (
+        last_hidden_state.view(tokens.batch_size, tokens.max_seqlen, -1),
+        pooler_output,
+        output_attention_mask.view(tokens.batch_size, tokens.max_seqlen)
+    )
@@ -0,0 +1,78 @@
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+SHINGLE_HASH_BASE = np.uint64(1_000_003)
+
+
+def get_permutations(num_permutations: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    '''Parameters (a, b) of the universal hash functions (a * x + b) mod MERSENNE_PRIME used as permutations'''
+    generator = np.random.default_rng(seed)
+    a = generator.integers(1, MAX_HASH, size=num_permutations, dtype=np.uint64)
+    b = generator.integers(0, MAX_HASH, size=num_permutations, dtype=np.uint64)
+    return a, b
+
+
+def get_shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    '''32 bit polynomial hashes of all character shingles of a text, computed over the utf-32 code points at once'''
+    code_points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(code_points) < shingle_size:
+        code_points = np.pad(code_points, (0, shingle_size - len(code_points)))
+    shingles = np.lib.stride_tricks.sliding_window_view(code_points, shingle_size)
+    powers = SHINGLE_HASH_BASE ** np.arange(shingle_size, dtype=np.uint64)
+    return np.unique((shingles * powers).sum(axis=1) & MAX_HASH)
+
+
+def compute_minhash_signatures(
+    texts: list[str],
+    num_permutations: int,
+    shingle_size: int,
+    seed: int,
+) -> np.ndarray:
+    '''(len(texts), num_permutations) uint32 MinHash signatures, every permutation of a text is computed in one NumPy op'''
+    a, b = get_permutations(num_permutations, seed)
+    signatures = np.empty((len(texts), num_permutations), dtype=np.uint32)
+    for text_idx, text in enumerate(texts):
+        shingle_hashes = get_shingle_hashes(text, shingle_size)
+        permuted_hashes = (np.outer(shingle_hashes, a) + b) % MERSENNE_PRIME & MAX_HASH
+        signatures[text_idx] = permuted_hashes.min(axis=0)
+    return signatures
+
+
+def get_candidate_pairs(signatures: np.ndarray, num_bands: int) -> np.ndarray:
+    '''
+    (num_pairs, 2) row pairs sharing all signature values of at least one band (LSH banding).
+    Rows of a band bucket are chained (first-second, second-third, ...) instead of paired exhaustively,
+    which connects the same clusters with a number of pairs linear in the number of rows
+    '''
+    num_rows, num_permutations = signatures.shape
+    assert num_permutations % num_bands == 0, "num_permutations has to be divisible by num_bands"
+    rows_per_band = num_permutations // num_bands
+
+    pairs = []
+    for band_idx in range(num_bands):
+        band = np.ascontiguousarray(signatures[:, band_idx * rows_per_band : (band_idx + 1) * rows_per_band])
+        band_keys = band.view(np.dtype((np.void, band.dtype.itemsize * rows_per_band))).ravel()
+        order = np.argsort(band_keys, kind="stable")
+        same_bucket = band_keys[order[1:]] == band_keys[order[:-1]]
+        pairs.append(np.stack([order[:-1][same_bucket], order[1:][same_bucket]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def estimate_jaccard_similarities(signatures: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+    return (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+
+
+def get_connected_components(num_rows: int, pairs: np.ndarray) -> np.ndarray:
+    '''Cluster id (smallest row index of the cluster) of every row, by min label propagation with pointer jumping'''
+    labels = np.arange(num_rows)
+    while True:
+        previous_labels = labels.copy()
+        pair_labels = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        np.minimum.at(labels, pairs[:, 0], pair_labels)
+        np.minimum.at(labels, pairs[:, 1], pair_labels)
+        labels = labels[labels]
+        if np.array_equal(labels, previous_labels):
+            return labels
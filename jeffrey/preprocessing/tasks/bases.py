@@ -0,0 +1,20 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from jeffrey.utils.utils import get_logger
+
+if TYPE_CHECKING:
+    from jeffrey.config_schemas.config_schema import Config
+    from jeffrey.config_schemas.preprocessing.preprocessing_task_schemas import PreprocessingTaskConfig
+
+
+class PreprocessingTask(ABC):
+    def __init__(self, task_name: str) -> None:
+        super().__init__()
+
+        self.task_name = task_name
+        self.logger = get_logger(self.__class__.__name__)
+
+    @abstractmethod
+    def run(self, config: "Config", task_config: "PreprocessingTaskConfig") -> None:
+        ...
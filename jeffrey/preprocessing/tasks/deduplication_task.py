@@ -0,0 +1,176 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
+import os
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.models.common.utils import get_global_rank, global_rank_zero_first
+from jeffrey.preprocessing.minhash import (
+    compute_minhash_signatures,
+    estimate_jaccard_similarities,
+    get_candidate_pairs,
+    get_connected_components,
+)
+from jeffrey.preprocessing.tasks.bases import PreprocessingTask
+from jeffrey.utils.io_utils import make_dirs, open_file
+
+if TYPE_CHECKING:
+    from jeffrey.config_schemas.config_schema import Config
+    from jeffrey.config_schemas.preprocessing.preprocessing_task_schemas import PreprocessingTaskConfig
+
+DEDUPLICATION_REPORT_FILE_NAME = "deduplication_report.json"
+
+
+class DeduplicationTask(PreprocessingTask):
+    '''
+    Removes near-duplicate rows (estimated Jaccard similarity of character shingles >= similarity_threshold)
+    within and across the train/valid/test splits, using MinHash signatures and LSH banding.
+    Clusters spanning several splits are only kept in the split that comes first in split_priority
+    (test, then valid, then train by default), so that no training row leaks into the evaluation splits.
+    Within a split, max_rows_per_cluster rows of every cluster are kept: 1 drops all duplicates,
+    larger values only down-weight big clusters.
+    Signatures are computed in parallel chunks, the splits are rewritten batch by batch.
+    '''
+    def __init__(
+        self,
+        task_name: str,
+        df_paths: dict[str, str],
+        output_dir: str,
+        text_column_name: str = "cleaned_text",
+        split_priority: Optional[list[str]] = None,
+        similarity_threshold: float = 0.8,
+        max_rows_per_cluster: int = 1,
+        num_permutations: int = 128,
+        num_bands: int = 32,
+        shingle_size: int = 5,
+        chunk_size: int = 10_000,
+        row_group_size: int = 50_000,
+        num_workers: Optional[int] = None,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(task_name=task_name)
+
+        self.df_paths = df_paths
+        self.output_dir = output_dir
+        self.text_column_name = text_column_name
+        self.split_priority = split_priority if split_priority is not None else ["test", "valid", "train"]
+        self.similarity_threshold = similarity_threshold
+        self.max_rows_per_cluster = max_rows_per_cluster
+        self.num_permutations = num_permutations
+        self.num_bands = num_bands
+        self.shingle_size = shingle_size
+        self.chunk_size = chunk_size
+        self.row_group_size = row_group_size
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count() or 1
+        self.seed = seed
+
+        assert set(self.df_paths) == set(self.split_priority), "split_priority has to rank exactly the splits of df_paths"
+
+    def run(self, config: "Config", task_config: "PreprocessingTaskConfig") -> None:
+        with global_rank_zero_first():
+            if get_global_rank() in [0, -1]:
+                self.deduplicate()
+
+    def deduplicate(self) -> None:
+        split_names = list(self.df_paths)
+        signatures = []
+        split_ids = []
+        for split_id, split_name in enumerate(split_names):
+            split_signatures = self.compute_signatures(self.df_paths[split_name])
+            signatures.append(split_signatures)
+            split_ids.append(np.full(len(split_signatures), split_id))
+        all_signatures = np.concatenate(signatures)
+        all_split_ids = np.concatenate(split_ids)
+
+        pairs = get_candidate_pairs(all_signatures, self.num_bands)
+        pairs = pairs[estimate_jaccard_similarities(all_signatures, pairs) >= self.similarity_threshold]
+        clusters = get_connected_components(len(all_signatures), pairs)
+        self.logger.info(f"Found {len(pairs)} near-duplicate pairs in {len(all_signatures)} rows")
+
+        keep = self.get_rows_to_keep(clusters, all_split_ids, split_names)
+
+        report: dict[str, dict[str, int]] = {}
+        make_dirs(self.output_dir)
+        for split_id, split_name in enumerate(split_names):
+            split_mask = all_split_ids == split_id
+            split_keep = keep[split_mask]
+            other_split_clusters = np.unique(clusters[~split_mask])
+            report[split_name] = {
+                "num_rows": int(split_mask.sum()),
+                "num_kept_rows": int(split_keep.sum()),
+                "num_rows_in_other_splits_clusters": int(np.isin(clusters[split_mask], other_split_clusters).sum()),
+            }
+            if "train" in split_names and split_name != "train":
+                train_mask = all_split_ids == split_names.index("train")
+                leaked_train_rows = np.isin(clusters[train_mask], clusters[split_mask])
+                report[split_name]["num_leaked_train_rows"] = int(leaked_train_rows.sum())
+            self.write_split(self.df_paths[split_name], os.path.join(self.output_dir, f"{split_name}.parquet"), split_keep)
+
+        self.report(report)
+
+    def compute_signatures(self, df_path: str) -> np.ndarray:
+        texts = read_parquet_columns(df_path, columns=[self.text_column_name]).column(0).to_pylist()
+        texts = [text if text is not None else "" for text in texts]
+        chunks = [texts[start : start + self.chunk_size] for start in range(0, len(texts), self.chunk_size)]
+        compute = partial(
+            compute_minhash_signatures,
+            num_permutations=self.num_permutations,
+            shingle_size=self.shingle_size,
+            seed=self.seed,
+        )
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            chunk_signatures = list(executor.map(compute, chunks))
+        if not chunk_signatures:
+            return np.empty((0, self.num_permutations), dtype=np.uint32)
+        return np.concatenate(chunk_signatures)
+
+    def get_rows_to_keep(self, clusters: np.ndarray, split_ids: np.ndarray, split_names: list[str]) -> np.ndarray:
+        # Every cluster belongs to the highest priority split it has rows in
+        split_priorities = np.array([self.split_priority.index(split_name) for split_name in split_names])[split_ids]
+        cluster_priorities = np.full(len(clusters), len(self.split_priority))
+        np.minimum.at(cluster_priorities, clusters, split_priorities)
+        keep = split_priorities == cluster_priorities[clusters]
+
+        # Rank of every row within its cluster, in file order
+        order = np.lexsort((np.arange(len(clusters)), ~keep, clusters))
+        sorted_clusters = clusters[order]
+        cluster_starts = np.flatnonzero(np.r_[True, sorted_clusters[1:] != sorted_clusters[:-1]])
+        ranks = np.empty(len(clusters), dtype=np.int64)
+        ranks[order] = np.arange(len(clusters)) - np.repeat(cluster_starts, np.diff(np.r_[cluster_starts, len(clusters)]))
+        return keep & (ranks < self.max_rows_per_cluster)
+
+    def write_split(self, df_path: str, output_df_path: str, keep: np.ndarray) -> None:
+        with open_file(df_path, "rb") as source, open_file(output_df_path, "wb") as target:
+            parquet_file = pq.ParquetFile(source)
+            with pq.ParquetWriter(target, parquet_file.schema_arrow) as writer:
+                start = 0
+                for record_batch in parquet_file.iter_batches(batch_size=self.row_group_size):
+                    batch_keep = keep[start : start + len(record_batch)]
+                    writer.write_batch(record_batch.filter(batch_keep), row_group_size=self.row_group_size)
+                    start += len(record_batch)
+
+    def report(self, report: dict[str, dict[str, int]]) -> None:
+        for split_name, split_report in report.items():
+            reduction = 1 - split_report["num_kept_rows"] / max(split_report["num_rows"], 1)
+            self.logger.info(
+                f"{split_name}: kept {split_report['num_kept_rows']} of {split_report['num_rows']} rows ({reduction:.1%} fewer), "
+                f"{split_report['num_rows_in_other_splits_clusters']} rows are near-duplicates of rows of other splits"
+            )
+
+        if "train" in report:
+            for split_name, split_report in report.items():
+                if split_name != "train":
+                    self.logger.info(
+                        f"Train/{split_name} leakage: {split_report['num_leaked_train_rows']} train rows "
+                        f"are near-duplicates of {split_name} rows"
+                    )
+            # Training steps per epoch, and so training time, are proportional to the number of training rows
+            saving = 1 - report["train"]["num_kept_rows"] / max(report["train"]["num_rows"], 1)
+            self.logger.info(f"Estimated training time saving per epoch: {saving:.1%}")
+
+        with open_file(os.path.join(self.output_dir, DEDUPLICATION_REPORT_FILE_NAME), "w") as f:
+            json.dump(report, f, indent=2)
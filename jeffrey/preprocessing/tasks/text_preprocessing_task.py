@@ -0,0 +1,203 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import os
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from jeffrey.data_modules.dataset import read_parquet_columns
+from jeffrey.models.common.utils import get_global_rank, global_rank_zero_first
+from jeffrey.preprocessing.cleaning import clean_texts
+from jeffrey.preprocessing.tasks.bases import PreprocessingTask
+from jeffrey.utils.io_utils import make_dirs, open_file
+
+if TYPE_CHECKING:
+    from jeffrey.config_schemas.config_schema import Config
+    from jeffrey.config_schemas.preprocessing.preprocessing_task_schemas import PreprocessingTaskConfig
+
+SPLIT_NAMES = ["train", "valid", "test"]
+
+
+def clean_chunk(
+    df: pd.DataFrame,
+    text_column_name: str,
+    cleaned_text_column_name: str,
+    cleaning_kwargs: dict[str, Any],
+) -> pd.DataFrame:
+    '''Runs in a worker process, rows left empty by the cleaning are dropped'''
+    df[cleaned_text_column_name] = clean_texts(df[text_column_name], **cleaning_kwargs)
+    return df[df[cleaned_text_column_name] != ""]
+
+
+class SplitWriter:
+    '''Appends chunks to a parquet file, buffering them so every row group but the last has row_group_size rows'''
+    def __init__(self, path: str, row_group_size: int) -> None:
+        self.path = path
+        self.row_group_size = row_group_size
+        self.buffer: list[pa.Table] = []
+        self.num_buffered_rows = 0
+        self.num_rows = 0
+        self.schema: Optional[pa.Schema] = None
+        self.file: Any = None
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if len(df) == 0:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.schema is None:
+            self.schema = table.schema
+        self.buffer.append(table.cast(self.schema))
+        self.num_buffered_rows += len(table)
+        if self.num_buffered_rows >= self.row_group_size:
+            self.flush(final=False)
+
+    def flush(self, final: bool) -> None:
+        assert self.schema is not None
+        table = pa.concat_tables(self.buffer)
+        num_rows_to_write = len(table) if final else len(table) // self.row_group_size * self.row_group_size
+
+        if self.writer is None:
+            self.file = open_file(self.path, "wb")
+            self.writer = pq.ParquetWriter(self.file, self.schema)
+        self.writer.write_table(table.slice(0, num_rows_to_write), row_group_size=self.row_group_size)
+        self.num_rows += num_rows_to_write
+
+        rest = table.slice(num_rows_to_write)
+        self.buffer = [rest] if len(rest) > 0 else []
+        self.num_buffered_rows = len(rest)
+
+    def close(self) -> None:
+        if self.buffer:
+            self.flush(final=True)
+        if self.writer is not None:
+            self.writer.close()
+            self.file.close()
+
+
+class TextPreprocessingTask(PreprocessingTask):
+    '''
+    Cleans raw parquet files into train/valid/test splits without ever holding a whole file in memory.
+    Raw files are streamed in chunks, cleaned in a process pool (at most 2 * num_workers chunks in flight),
+    optionally rebalanced by downsampling every label to the size of the rarest one, randomly split
+    and appended to the split files in row groups of row_group_size rows.
+    Results only depend on the seed: chunks are written in order and every chunk draws from its own generator.
+    '''
+    def __init__(
+        self,
+        task_name: str,
+        raw_df_paths: list[str],
+        output_dir: str,
+        text_column_name: str = "text",
+        cleaned_text_column_name: str = "cleaned_text",
+        label_column_name: str = "label",
+        valid_ratio: float = 0.1,
+        test_ratio: float = 0.1,
+        rebalance: bool = True,
+        chunk_size: int = 100_000,
+        row_group_size: int = 50_000,
+        num_workers: Optional[int] = None,
+        lowercase: bool = True,
+        url_replacement: str = " ",
+        mention_replacement: str = " ",
+        remove_emojis: bool = True,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(task_name=task_name)
+
+        self.raw_df_paths = raw_df_paths
+        self.output_dir = output_dir
+        self.text_column_name = text_column_name
+        self.cleaned_text_column_name = cleaned_text_column_name
+        self.label_column_name = label_column_name
+        self.valid_ratio = valid_ratio
+        self.test_ratio = test_ratio
+        self.rebalance = rebalance
+        self.chunk_size = chunk_size
+        self.row_group_size = row_group_size
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count() or 1
+        self.cleaning_kwargs = {
+            "lowercase": lowercase,
+            "url_replacement": url_replacement,
+            "mention_replacement": mention_replacement,
+            "remove_emojis": remove_emojis,
+        }
+        self.seed = seed
+
+    def run(self, config: "Config", task_config: "PreprocessingTaskConfig") -> None:
+        with global_rank_zero_first():
+            if get_global_rank() in [0, -1]:
+                self.preprocess()
+
+    def preprocess(self) -> None:
+        keep_probabilities = self.get_keep_probabilities() if self.rebalance else None
+
+        make_dirs(self.output_dir)
+        writers = {
+            split_name: SplitWriter(os.path.join(self.output_dir, f"{split_name}.parquet"), self.row_group_size)
+            for split_name in SPLIT_NAMES
+        }
+
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            pending: deque[tuple[int, Future]] = deque()
+            for chunk_idx, chunk in enumerate(self.iterate_chunks()):
+                future = executor.submit(
+                    clean_chunk, chunk, self.text_column_name, self.cleaned_text_column_name, self.cleaning_kwargs
+                )
+                pending.append((chunk_idx, future))
+                if len(pending) >= 2 * self.num_workers:
+                    chunk_idx, future = pending.popleft()
+                    self.split_chunk(chunk_idx, future.result(), keep_probabilities, writers)
+
+            while pending:
+                chunk_idx, future = pending.popleft()
+                self.split_chunk(chunk_idx, future.result(), keep_probabilities, writers)
+
+        for split_name, writer in writers.items():
+            writer.close()
+            if writer.num_rows == 0:
+                self.logger.warning(f"{split_name} split is empty, nothing was written")
+            self.logger.info(f"{split_name}: {writer.num_rows} rows written to {writer.path}")
+
+    def iterate_chunks(self) -> Iterator[pd.DataFrame]:
+        for raw_df_path in self.raw_df_paths:
+            self.logger.info(f"Preprocessing {raw_df_path}...")
+            with open_file(raw_df_path, "rb") as f:
+                for record_batch in pq.ParquetFile(f).iter_batches(batch_size=self.chunk_size):
+                    yield record_batch.to_pandas()
+
+    def get_keep_probabilities(self) -> dict[Any, float]:
+        '''Probability to keep a row of each label so that all labels end up about as frequent as the rarest one'''
+        # Label columns are concatenated first: adding per-file counts gives NaN for a label missing from a file
+        label_counts = pd.concat(
+            [
+                read_parquet_columns(raw_df_path, columns=[self.label_column_name]).column(self.label_column_name).to_pandas()
+                for raw_df_path in self.raw_df_paths
+            ],
+            ignore_index=True,
+        ).value_counts()
+        self.logger.info(f"Raw label counts: {label_counts.to_dict()}")
+        return {label: label_counts.min() / count for label, count in label_counts.items()}
+
+    def split_chunk(
+        self,
+        chunk_idx: int,
+        chunk: pd.DataFrame,
+        keep_probabilities: Optional[dict[Any, float]],
+        writers: dict[str, SplitWriter],
+    ) -> None:
+        generator = np.random.default_rng([self.seed, chunk_idx])
+
+        if keep_probabilities is not None:
+            keep = generator.random(len(chunk)) < chunk[self.label_column_name].map(keep_probabilities).to_numpy()
+            chunk = chunk[keep]
+
+        draws = generator.random(len(chunk))
+        split_names = np.where(
+            draws < self.test_ratio, "test", np.where(draws < self.test_ratio + self.valid_ratio, "valid", "train")
+        )
+        for split_name, writer in writers.items():
+            writer.write(chunk[split_names == split_name])
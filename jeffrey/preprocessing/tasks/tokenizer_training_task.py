@@ -0,0 +1,83 @@
+import os
+import tempfile
+from typing import TYPE_CHECKING, Iterator
+
+import pyarrow.parquet as pq
+from transformers import AutoTokenizer
+
+from jeffrey.models.common.utils import get_global_rank, global_rank_zero_first
+from jeffrey.models.transformations import (
+    TOKENIZER_HASH_FILE_NAME,
+    get_tokenizer_content_hash,
+    get_tokenizer_registry_key,
+)
+from jeffrey.preprocessing.tasks.bases import PreprocessingTask
+from jeffrey.utils.io_utils import copy_dir, open_file
+from jeffrey.utils.registry import get_registry
+
+if TYPE_CHECKING:
+    from jeffrey.config_schemas.config_schema import Config
+    from jeffrey.config_schemas.preprocessing.preprocessing_task_schemas import PreprocessingTaskConfig
+
+
+class TokenizerTrainingTask(PreprocessingTask):
+    '''
+    Trains a fast tokenizer with the pipeline (normalizer, pre-tokenizer, model type, special tokens)
+    of base_tokenizer_name_or_path on the texts of train_df_path.
+    Texts are streamed into the trainer batch by batch, only one batch is in memory at a time.
+    The content hash of the trained tokenizer is saved next to it (TOKENIZER_HASH_FILE_NAME) and is what
+    HuggingFaceTokenizationTransformation.get_tokenizer_fingerprint returns, so caches keyed by the
+    fingerprint (tokenization cache, statistics manifests) are invalidated when the tokenizer is retrained.
+    '''
+    def __init__(
+        self,
+        task_name: str,
+        train_df_path: str,
+        output_dir: str,
+        base_tokenizer_name_or_path: str,
+        vocab_size: int,
+        text_column_name: str = "cleaned_text",
+        batch_size: int = 10_000,
+    ) -> None:
+        super().__init__(task_name=task_name)
+
+        self.train_df_path = train_df_path
+        self.output_dir = output_dir
+        self.base_tokenizer_name_or_path = base_tokenizer_name_or_path
+        self.vocab_size = vocab_size
+        self.text_column_name = text_column_name
+        self.batch_size = batch_size
+
+    def run(self, config: "Config", task_config: "PreprocessingTaskConfig") -> None:
+        with global_rank_zero_first():
+            if get_global_rank() in [0, -1]:
+                self.train_tokenizer()
+        # Transformations built later in the run have to load the new tokenizer
+        get_registry().remove(get_tokenizer_registry_key(self.output_dir))
+
+    def train_tokenizer(self) -> None:
+        base_tokenizer = AutoTokenizer.from_pretrained(self.base_tokenizer_name_or_path)
+        assert base_tokenizer.is_fast, "Only fast tokenizers can be trained"
+
+        with open_file(self.train_df_path, "rb") as f:
+            num_rows = pq.ParquetFile(f).metadata.num_rows
+        self.logger.info(f"Training tokenizer with {self.vocab_size} tokens on {num_rows} rows of {self.train_df_path}...")
+
+        tokenizer = base_tokenizer.train_new_from_iterator(
+            self.iterate_text_batches(), vocab_size=self.vocab_size, length=num_rows
+        )
+        tokenizer_hash = get_tokenizer_content_hash(tokenizer)
+
+        with tempfile.TemporaryDirectory() as tokenizer_dir:
+            tokenizer.save_pretrained(tokenizer_dir)
+            with open(os.path.join(tokenizer_dir, TOKENIZER_HASH_FILE_NAME), "w") as f:
+                f.write(tokenizer_hash)
+
+            copy_dir(tokenizer_dir, self.output_dir)
+
+        self.logger.info(f"Saved tokenizer {tokenizer_hash} with {len(tokenizer)} tokens to {self.output_dir}")
+
+    def iterate_text_batches(self) -> Iterator[list[str]]:
+        with open_file(self.train_df_path, "rb") as f:
+            for record_batch in pq.ParquetFile(f).iter_batches(batch_size=self.batch_size, columns=[self.text_column_name]):
+                yield [text for text in record_batch.column(0).to_pylist() if text is not None]
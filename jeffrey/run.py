@@ -5,6 +5,7 @@
 
 from jeffrey.config_schemas.config_schema import Config
 from jeffrey.utils.config_utils import get_config
+from jeffrey.utils.registry import get_registry
 from jeffrey.utils.torch_utils import get_local_rank
 from jeffrey.utils.utils import get_logger
 
@@ -22,6 +23,7 @@ def run_tasks(config: Config) -> None:
     torch.distributed.init_process_group(backend=backend)
     
     seed_everything(seed=config.seed, workers=True)
+    get_registry().set_max_memory_bytes(config.registry_max_memory_mb * 1024**2)
     
     for task_name, task_config in config.tasks.items():
         logger.info(f"Running task: {task_name}")
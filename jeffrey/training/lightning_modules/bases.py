@@ -8,11 +8,12 @@
 from torch import Tensor
 from torch.optim import Optimizer
 
-from jeffrey.models.transformations import Transformation
+from jeffrey.models.transformations import HuggingFaceTokenizationTransformation, Transformation
 from jeffrey.training.loss_functions import LossFunction
 from jeffrey.training.schedulers import LightningScheduler
-from jeffrey.models.models import Model
+from jeffrey.models.models import EarlyExitBinaryTextClassificationModel, Model, MultiBranchBinaryTextClassificationModel
 from jeffrey.utils.io_utils import open_file
+from jeffrey.utils.torch_utils import compile_model_forward, get_warm_up_batch_sizes, hash_tensors, warm_up_compiled_model
 from jeffrey.utils.utils import get_logger
 
 
@@ -25,7 +26,9 @@ def __init__(
         model: Model,
         loss: LossFunction,
         optimizer: PartialOptimizerType,
-        scheduler: Optional[LightningScheduler]
+        scheduler: Optional[LightningScheduler],
+        compile_model: bool = False,
+        compile_mode: Optional[str] = None
     ) -> None:
         super().__init__()
         
@@ -33,9 +36,17 @@ def __init__(
         self.loss = loss
         self.partial_optimizer = optimizer
         self.scheduler = scheduler
+        self.compile_model = compile_model
+        self.compile_mode = compile_mode
+        
+        if compile_model and isinstance(model, (EarlyExitBinaryTextClassificationModel, MultiBranchBinaryTextClassificationModel)):
+            # Their training and validation steps call forward_all_exits / forward_branches, not the compiled forward
+            raise ValueError("compile_model supports neither early exit nor multi-branch models")
         
         self.model_size = self._calculate_model_size()
         self.logging_logger = get_logger(self.__class__.__name__)
+        # Sorted names and hash of the frozen parameters, computed once per fit: they cannot change during it
+        self.frozen_parameters: Optional[tuple[list[str], str]] = None
     
     def _calculate_model_size(self) -> float:
         param_size = 0
@@ -52,7 +63,8 @@ def _calculate_model_size(self) -> float:
     
     # https://lightning.ai/docs/pytorch/stable/_modules/lightning/pytorch/core/module.html#LightningModule.configure_optimizers    
     def configure_optimizers(self) -> Union[Optimizer, tuple[list[Optimizer], list[dict[str, Any]]]]:
-        optimizer = self.partial_optimizer(self.parameters())
+        # Frozen parameters (e.g. a backbone whose outputs come from an embedding store) get no optimizer state
+        optimizer = self.partial_optimizer([parameter for parameter in self.parameters() if parameter.requires_grad])
         
         if self.scheduler is not None:
             scheduler = self.scheduler.configure_scheduler(
@@ -63,11 +75,95 @@ def configure_optimizers(self) -> Union[Optimizer, tuple[list[Optimizer], list[d
         
         return optimizer
         
+    def on_fit_start(self) -> None:
+        # Model surgery (e.g. vocab trimming or pruning) may have changed the frozen parameters since the last fit
+        self.frozen_parameters = None
+        if self.compile_model:
+            transformation = self.get_transformation()
+            assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+            datamodule = self.trainer.datamodule  # type: ignore
+            compile_model_forward(self.model, mode=self.compile_mode)
+            for training, dataset_name in [(True, "train_dataset"), (False, "valid_dataset")]:
+                warm_up_compiled_model(
+                    self.model, 
+                    transformation, 
+                    batch_sizes=get_warm_up_batch_sizes(datamodule, dataset_name), 
+                    device=self.device, 
+                    training=training,
+                    compact_batches=getattr(datamodule, "compact_batches", False)
+                )
+        return super().on_fit_start()
+        
+    def on_train_epoch_start(self) -> None:
+        # Lightning only sets the epoch on samplers, streaming datasets shuffle by themselves
+        dataset = getattr(self.trainer.train_dataloader, "dataset", None)
+        if hasattr(dataset, "set_epoch"):
+            dataset.set_epoch(self.current_epoch)
+        return super().on_train_epoch_start()
+        
+    def on_train_epoch_end(self) -> None:
+        self.log_tokenization_cache_counters()
+        return super().on_train_epoch_end()
+        
+    def log_tokenization_cache_counters(self) -> None:
+        '''Tokenization cache lookups since the last epoch (its validation included), of every DataLoader worker and rank'''
+        transformation = self.get_transformation()
+        if not isinstance(transformation, HuggingFaceTokenizationTransformation) or transformation.cache_size == 0:
+            return
+        cache_counters = torch.tensor([transformation.cache_hits, transformation.cache_misses], device=self.device)
+        transformation.reset_cache_counters()
+        if self.trainer.world_size > 1:
+            cache_counters = self.all_gather(cache_counters).sum(dim=0)
+        
+        cache_hits, cache_misses = cache_counters.tolist()
+        self.log(name="tokenization_cache_hits", value=float(cache_hits))
+        self.log(name="tokenization_cache_misses", value=float(cache_misses))
+        self.log(name="tokenization_cache_hit_rate", value=cache_hits / max(cache_hits + cache_misses, 1))
+        
+    def get_frozen_parameter_names(self) -> set[str]:
+        return {name for name, parameter in self.named_parameters() if not parameter.requires_grad}
+        
+    def on_save_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        # Frozen parameters (e.g. the pretrained weights under LoRA updates) are rebuilt with the model,
+        # checkpoints only keep what training changes
+        if self.frozen_parameters is None:
+            frozen_parameter_names = sorted(self.get_frozen_parameter_names())
+            self.frozen_parameters = (frozen_parameter_names, self.get_frozen_parameters_hash(frozen_parameter_names))
+        frozen_parameter_names, frozen_parameters_hash = self.frozen_parameters
+        frozen_parameter_name_set = set(frozen_parameter_names)
+        checkpoint["state_dict"] = {
+            key: value for key, value in checkpoint["state_dict"].items() if key not in frozen_parameter_name_set
+        }
+        checkpoint["frozen_parameter_names"] = frozen_parameter_names
+        checkpoint["frozen_parameters_hash"] = frozen_parameters_hash
+        return super().on_save_checkpoint(checkpoint)
+    
+    def get_frozen_parameters_hash(self, frozen_parameter_names: list[str]) -> str:
+        state_dict = self.state_dict()
+        return hash_tensors((name, state_dict[name]) for name in frozen_parameter_names)
+    
+    def on_load_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        # Called before the state dict is loaded: frozen parameters are taken from the model as it was built,
+        # which has to hold the frozen weights the checkpoint was trained with
+        frozen_parameter_names = checkpoint.get("frozen_parameter_names", [])
+        frozen_parameters_hash = checkpoint.get("frozen_parameters_hash")
+        if frozen_parameters_hash is not None and frozen_parameters_hash != self.get_frozen_parameters_hash(frozen_parameter_names):
+            raise ValueError(
+                "The frozen parameters of the model differ from the ones the checkpoint was trained with, "
+                "build the model from the same pretrained weights to resume from it"
+            )
+        state_dict = self.state_dict()
+        for key in frozen_parameter_names:
+            checkpoint["state_dict"].setdefault(key, state_dict[key].cpu())
+        return super().on_load_checkpoint(checkpoint)
+        
     def on_train_end(self) -> None:
-        try:
+        # Model surgery (e.g. vocab trimming) may have changed the size since __init__
+        self.model_size = self._calculate_model_size()
+        if mlflow.active_run() is None:
+            self.logging_logger.warning("No active MLflow run, model_size is not logged")
+        elif self.trainer.is_global_zero:
             mlflow.log_metric(key="model_size", value=self.model_size)
-        except Exception:
-            pass
         return super().on_train_end()
     
     @abstractmethod
@@ -93,7 +189,9 @@ def export_model_state_dict(self, checkpoint_path: str) -> str:
         
     def common_export_model_state_dict(self, checkpoint_path: str) -> str:
         with open_file(checkpoint_path, "rb") as f:
-            state_dict = torch.load(f, map_location=torch.device("cpu"))["state_dict"]
+            checkpoint = torch.load(f, map_location=torch.device("cpu"))
+        self.on_load_checkpoint(checkpoint)
+        state_dict = checkpoint["state_dict"]
             
         model_state_dict = {}
         for key, value in state_dict.items():
@@ -2,9 +2,10 @@
 from collections import defaultdict
 
 import mlflow
-from torch import Tensor
+from torch import Tensor, nn
 import torch
 from transformers import BatchEncoding
+from torchmetrics import SumMetric
 from torchmetrics.classification import (
     BinaryAccuracy, 
     BinaryF1Score, 
@@ -12,11 +13,21 @@
 )
 
 from jeffrey.models.transformations import Transformation
-from jeffrey.models.models import Model
+from jeffrey.models.models import (
+    DEFAULT_EXIT_THRESHOLDS, 
+    EarlyExitBinaryTextClassificationModel, 
+    Model, 
+    MultiBranchBinaryTextClassificationModel
+)
 from jeffrey.training.lightning_modules.bases import ModelStateDictExportingTrainingLightningModule, PartialOptimizerType
 from jeffrey.training.loss_functions import LossFunction
 from jeffrey.training.schedulers import LightningScheduler
-from jeffrey.utils.torch_utils import plot_confusion_matrix
+from jeffrey.utils.torch_utils import (
+    all_gather_samples,
+    count_real_and_padded_tokens,
+    get_early_exit_tradeoff,
+    plot_confusion_matrix
+)
 
 
 class BinaryTextClassificationLightningModule(ModelStateDictExportingTrainingLightningModule):
@@ -25,9 +36,21 @@ def __init__(
         model: Model,
         loss: LossFunction,
         optimizer: PartialOptimizerType,
-        scheduler: Optional[LightningScheduler]
+        scheduler: Optional[LightningScheduler],
+        compile_model: bool = False,
+        compile_mode: Optional[str] = None,
+        exit_loss_weight: float = 1.0,
+        exit_thresholds: Optional[list[float]] = None,
+        export_branch: str = "best"
     ) -> None:
-        super().__init__(model=model, loss=loss, optimizer=optimizer, scheduler=scheduler)
+        super().__init__(
+            model=model, 
+            loss=loss, 
+            optimizer=optimizer, 
+            scheduler=scheduler, 
+            compile_model=compile_model, 
+            compile_mode=compile_mode
+        )
         
         self.training_accuracy = BinaryAccuracy()
         self.validation_accuracy = BinaryAccuracy()
@@ -38,11 +61,26 @@ def __init__(
         self.training_confusion_matrix = BinaryConfusionMatrix()
         self.validation_confusion_matrix = BinaryConfusionMatrix()
         
+        self.training_real_tokens = SumMetric()
+        self.training_padded_tokens = SumMetric()
+        
         self.training_step_outputs = defaultdict(list)
         self.validation_step_outputs = defaultdict(list)
         
         self.pos_weight: Optional[Tensor] = None
         
+        # Early exit models only: weight of the mean exit loss in the training loss, thresholds of the validation tradeoff
+        self.exit_loss_weight = exit_loss_weight
+        self.exit_thresholds = exit_thresholds if exit_thresholds is not None else DEFAULT_EXIT_THRESHOLDS
+        
+        # Multi-branch models only: metrics of every branch, and the exported model ("best" branch or averaged "ensemble")
+        if export_branch not in ["best", "ensemble"]:
+            raise ValueError(f"Unknown export_branch: {export_branch}, expected best or ensemble")
+        self.export_branch = export_branch
+        num_branches = model.num_branches if isinstance(model, MultiBranchBinaryTextClassificationModel) else 0
+        self.validation_branch_accuracies = nn.ModuleList([BinaryAccuracy() for _ in range(num_branches)])
+        self.validation_branch_f1_scores = nn.ModuleList([BinaryF1Score() for _ in range(num_branches)])
+        
     def set_pos_weight(self, pos_weight: Tensor) -> None:
         self.pos_weight = pos_weight
         
@@ -51,46 +89,91 @@ def forward(self, texts: BatchEncoding) -> Tensor:
     
     def training_step(self, batch: Tuple[BatchEncoding, Tensor], batch_idx: int) -> Tensor:
         texts, labels = batch
-        logits = self(texts)  # (batch_size, 1)
-        
+        batch_size = len(labels)  # Not necessarily the configured one with token budgets or packing
         self.pos_weight = self.pos_weight.to(self.device)
-        loss = self.loss(logits, labels, pos_weight=self.pos_weight)
-        self.log(name="loss", value=loss, sync_dist=True)
+        
+        if isinstance(self.model, EarlyExitBinaryTextClassificationModel):
+            # Exits and final head are trained jointly, from a single backbone pass
+            *all_exit_logits, logits = self.model.forward_all_exits(texts)
+            exit_loss = torch.stack([self.loss(exit_logits, labels, pos_weight=self.pos_weight) for exit_logits in all_exit_logits]).mean()
+            self.log(name="exit_loss", value=exit_loss, sync_dist=True, batch_size=batch_size)
+            loss = self.loss(logits, labels, pos_weight=self.pos_weight) + self.exit_loss_weight * exit_loss
+        elif isinstance(self.model, MultiBranchBinaryTextClassificationModel):
+            # Every branch has its own loss on the shared backbone output, the backbone gets their mean
+            branch_logits = self.model.forward_branches(texts)  # (num_branches, batch_size, 1)
+            branch_losses = [self.loss(branch_output, labels, pos_weight=self.pos_weight) for branch_output in branch_logits]
+            for branch_idx, branch_loss in enumerate(branch_losses):
+                self.log(name=f"loss_branch_{branch_idx}", value=branch_loss, sync_dist=True, batch_size=batch_size)
+            loss = torch.stack(branch_losses).mean()
+            logits = self.model.combine_branch_outputs(branch_logits)
+        else:
+            logits = self(texts)  # (batch_size, 1)
+            loss = self.loss(logits, labels, pos_weight=self.pos_weight)
+        self.log(name="loss", value=loss, sync_dist=True, batch_size=batch_size)
+        self.log(name="training_batch_size", value=float(batch_size), on_step=True, on_epoch=False)
         
         self.training_accuracy(logits, labels)
         self.training_f1_score(logits, labels)
         self.training_confusion_matrix(logits, labels)
         
-        self.log(name="training_accuracy", value=self.training_accuracy, on_step=False, on_epoch=True)
-        self.log(name="training_f1_score", value=self.training_f1_score, on_step=False, on_epoch=True)
+        self.log(name="training_accuracy", value=self.training_accuracy, on_step=False, on_epoch=True, batch_size=batch_size)
+        self.log(name="training_f1_score", value=self.training_f1_score, on_step=False, on_epoch=True, batch_size=batch_size)
         
         self.training_step_outputs["logits"].append(logits)
         self.training_step_outputs["labels"].append(labels)
         
+        real_tokens, padded_tokens = count_real_and_padded_tokens(texts)
+        self.training_real_tokens.update(real_tokens)
+        self.training_padded_tokens.update(padded_tokens)
+        
         return loss
     
     def on_train_epoch_end(self) -> None:
-        all_logits = torch.stack(self.training_step_outputs["logits"])
-        all_labels = torch.stack(self.training_step_outputs["labels"])
+        all_logits = torch.cat(self.training_step_outputs["logits"])
+        all_labels = torch.cat(self.training_step_outputs["labels"])
+        
+        batch_sizes = torch.tensor([len(logits) for logits in self.training_step_outputs["logits"]], dtype=torch.float)
+        self.log(name="training_min_batch_size", value=batch_sizes.min())
+        self.log(name="training_mean_batch_size", value=batch_sizes.mean())
+        self.log(name="training_max_batch_size", value=batch_sizes.max())
         
         confusion_matrix = self.training_confusion_matrix(all_logits, all_labels)
         figure = plot_confusion_matrix(confusion_matrix, class_names=["0", "1"])
         mlflow.log_figure(figure, artifact_file="training_confusion_matrix.png")
         
+        # Share of the computed token slots that hold real tokens (1.0 means no padding at all)
+        padding_efficiency = self.training_real_tokens.compute() / self.training_padded_tokens.compute()
+        self.log(name="training_padding_efficiency", value=padding_efficiency)
+        self.training_real_tokens.reset()
+        self.training_padded_tokens.reset()
+        
         self.training_step_outputs = defaultdict(list)
+        return super().on_train_epoch_end()
     
     def validation_step(self, batch: Tuple[BatchEncoding, Tensor], batch_idx: int) -> Dict[str, Tensor]:
         texts, labels = batch
-        logits = self(texts)  # (batch_size, 1)
+        batch_size = len(labels)
+        
+        if isinstance(self.model, EarlyExitBinaryTextClassificationModel):
+            # Outputs of every exit, so that the tradeoff of every threshold comes from a single pass
+            all_exit_logits = self.model.forward_all_exits(texts)
+            logits, _ = self.model.select_exit_outputs(all_exit_logits, self.model.exit_threshold)
+            self.validation_step_outputs["all_exit_logits"].append(torch.stack(all_exit_logits))
+        elif isinstance(self.model, MultiBranchBinaryTextClassificationModel):
+            branch_logits = self.model.forward_branches(texts)
+            logits = self.model.combine_branch_outputs(branch_logits)
+            self.log_branch_metrics(branch_logits, labels)
+        else:
+            logits = self(texts)  # (batch_size, 1)
         
         loss = self.loss(logits, labels)
-        self.log(name="validation_loss", value=loss, sync_dist=True)
+        self.log(name="validation_loss", value=loss, sync_dist=True, batch_size=batch_size)
         
         self.validation_f1_score(logits, labels)
         self.validation_accuracy(logits, labels)
         
-        self.log(name="validation_accuracy", value=self.validation_accuracy, on_step=False, on_epoch=True)
-        self.log(name="validation_f1_score", value=self.validation_f1_score, on_step=False, on_epoch=True)
+        self.log(name="validation_accuracy", value=self.validation_accuracy, on_step=False, on_epoch=True, batch_size=batch_size)
+        self.log(name="validation_f1_score", value=self.validation_f1_score, on_step=False, on_epoch=True, batch_size=batch_size)
         
         self.validation_step_outputs["logits"].append(logits)
         self.validation_step_outputs["labels"].append(labels)
@@ -98,14 +181,38 @@ def validation_step(self, batch: Tuple[BatchEncoding, Tensor], batch_idx: int) -
         return {"loss": loss, "predictions": logits, "labels": labels}
     
     def on_validation_epoch_end(self) -> None:
-        all_predictions = torch.stack(self.validation_step_outputs["logits"])
-        all_labels = torch.stack(self.validation_step_outputs["labels"])
+        all_predictions = torch.cat(self.validation_step_outputs["logits"])
+        all_labels = torch.cat(self.validation_step_outputs["labels"])
         
         confusion_matrix = self.validation_confusion_matrix(all_predictions, all_labels)
         figure = plot_confusion_matrix(confusion_matrix, class_names=["0", "1"])
         mlflow.log_figure(figure, artifact_file="validation_confusion_matrix.png")
         
+        if isinstance(self.model, EarlyExitBinaryTextClassificationModel):
+            self.log_early_exit_tradeoff(torch.cat(self.validation_step_outputs["all_exit_logits"], dim=1), all_labels)
+        
         self.validation_step_outputs = defaultdict(list)
+        
+    def log_branch_metrics(self, branch_logits: Tensor, labels: Tensor) -> None:
+        for branch_idx, branch_output in enumerate(branch_logits):
+            branch_accuracy = self.validation_branch_accuracies[branch_idx]
+            branch_f1_score = self.validation_branch_f1_scores[branch_idx]
+            branch_accuracy(branch_output, labels)
+            branch_f1_score(branch_output, labels)
+            self.log(name=f"validation_accuracy_branch_{branch_idx}", value=branch_accuracy, on_step=False, on_epoch=True, batch_size=len(labels))
+            self.log(name=f"validation_f1_score_branch_{branch_idx}", value=branch_f1_score, on_step=False, on_epoch=True, batch_size=len(labels))
+        
+    def log_early_exit_tradeoff(self, all_exit_logits: Tensor, all_labels: Tensor) -> None:
+        assert isinstance(self.model, EarlyExitBinaryTextClassificationModel)
+        # The tradeoff covers the samples of every rank: (num_exits + 1, num_samples, ...) -> samples first to gather
+        all_exit_logits = all_gather_samples(self, all_exit_logits.transpose(0, 1)).transpose(0, 1)
+        all_labels = all_gather_samples(self, all_labels)
+        all_exit_logits_list = list(all_exit_logits)
+        tradeoff = get_early_exit_tradeoff(self.model, all_exit_logits_list, all_labels, self.exit_thresholds)
+        mlflow.log_dict({"tradeoff": tradeoff}, artifact_file="validation_early_exit_tradeoff.json")
+        
+        _, layers_executed = self.model.select_exit_outputs(all_exit_logits_list, self.model.exit_threshold)
+        self.log(name="validation_mean_layers_executed", value=layers_executed.float().mean())
     
     def get_transformation(self) -> Transformation:
         return self.model.get_transformation()
@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+import torch
+from lightning.pytorch.utilities import move_data_to_device
+from torch import Tensor, nn
+
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.pruning import get_remaining_heads, prune_attention_heads, prune_ffn_neurons, remove_layers
+
+
+@dataclass
+class PruningLevel:
+    '''Shares of the layers, attention heads and FFN neurons of the original backbone removed at this level'''
+    layers: float = 0.0
+    heads: float = 0.0
+    ffn_neurons: float = 0.0
+
+
+@dataclass
+class PruningImportances:
+    layers: Tensor  # (num_layers,)
+    heads: list[Tensor]  # (num_heads,) of every layer, in the order of its weights
+    ffn_neurons: list[Tensor]  # (intermediate_size,) of every layer
+
+
+def count_backbone_units(backbone: HuggingFaceBackbone) -> dict[str, int]:
+    layers = backbone.backbone.encoder.layer
+    return {
+        "layers": len(layers),
+        "heads": sum(layer.attention.self.num_attention_heads for layer in layers),
+        "ffn_neurons": sum(layer.intermediate.dense.out_features for layer in layers),
+    }
+
+
+@contextmanager
+def pruning_gates(backbone: HuggingFaceBackbone) -> Iterator[PruningImportances]:
+    '''
+    Gates of value 1 on the output of every layer, attention head and FFN neuron, through forward hooks.
+    |d loss / d gate| is the first order estimate of the loss change when the unit is removed.
+    '''
+    layers = backbone.backbone.encoder.layer
+    device = next(backbone.parameters()).device
+    gates = PruningImportances(
+        layers=torch.ones(len(layers), device=device, requires_grad=True),
+        heads=[torch.ones(layer.attention.self.num_attention_heads, device=device, requires_grad=True) for layer in layers],
+        ffn_neurons=[torch.ones(layer.intermediate.dense.out_features, device=device, requires_grad=True) for layer in layers],
+    )
+
+    def gate_layer(gate: Tensor) -> Callable[..., Any]:
+        # A closed gate skips the layer: its input goes through unchanged
+        return lambda module, args, output: (gate * output[0] + (1 - gate) * args[0], *output[1:])
+
+    def gate_heads(gate: Tensor, head_size: int) -> Callable[..., Any]:
+        return lambda module, args, output: (output[0] * gate.repeat_interleave(head_size), *output[1:])
+
+    def gate_ffn_neurons(gate: Tensor) -> Callable[..., Any]:
+        return lambda module, args, output: output * gate
+
+    handles = []
+    for idx, layer in enumerate(layers):
+        handles.append(layer.register_forward_hook(gate_layer(gates.layers[idx])))
+        handles.append(
+            layer.attention.self.register_forward_hook(gate_heads(gates.heads[idx], layer.attention.self.attention_head_size))
+        )
+        handles.append(layer.intermediate.register_forward_hook(gate_ffn_neurons(gates.ffn_neurons[idx])))
+
+    # The unpadded forward calls the projections of the layers directly, the gated modules only run padded
+    unpadded = backbone.unpadded
+    backbone.unpadded = False
+    try:
+        yield gates
+    finally:
+        backbone.unpadded = unpadded
+        for handle in handles:
+            handle.remove()
+
+
+def score_importances(
+    model: nn.Module,
+    backbone: HuggingFaceBackbone,
+    batches: Iterable[tuple[Any, Tensor]],
+    loss_function: Callable[[Tensor, Tensor], Tensor],
+    device: torch.device
+) -> PruningImportances:
+    '''
+    Importance of every layer, head and FFN neuron of the backbone, summed over batches (of every rank).
+    Heads and neurons are normalized per layer, so that they can be ranked across layers.
+    '''
+    was_training = model.training
+    model.eval()
+    with pruning_gates(backbone) as gates:
+        gate_tensors = [gates.layers, *gates.heads, *gates.ffn_neurons]
+        importances = [torch.zeros_like(gate, requires_grad=False) for gate in gate_tensors]
+        for texts, labels in batches:
+            texts, labels = move_data_to_device((texts, labels), device)
+            loss = loss_function(model(texts), labels)
+            for importance, grad in zip(importances, torch.autograd.grad(loss, gate_tensors, allow_unused=True)):
+                if grad is not None:
+                    importance += grad.abs()
+    model.train(was_training)
+
+    # Ranks score different batches: summed over ranks, they all prune the same units
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        for importance in importances:
+            torch.distributed.all_reduce(importance)
+
+    num_layers = len(gates.layers)
+    normalize = lambda importance: importance / importance.norm().clamp(min=1e-12)  # noqa: E731
+    return PruningImportances(
+        layers=importances[0],
+        heads=[normalize(importance) for importance in importances[1 : num_layers + 1]],
+        ffn_neurons=[normalize(importance) for importance in importances[num_layers + 1 :]],
+    )
+
+
+def select_units_to_prune(importances: list[Tensor], num_kept_units: int) -> list[list[int]]:
+    '''Least important units of all layers until num_kept_units are left, every layer keeps at least one'''
+    pruned_units: list[list[int]] = [[] for _ in importances]
+    num_units = [len(layer_importances) for layer_importances in importances]
+    num_units_to_prune = sum(num_units) - num_kept_units
+
+    candidates = sorted(
+        (score, layer_idx, unit)
+        for layer_idx, layer_importances in enumerate(importances)
+        for unit, score in enumerate(layer_importances.tolist())
+    )
+    for _, layer_idx, unit in candidates:
+        if num_units_to_prune <= 0:
+            break
+        if num_units[layer_idx] > 1:
+            pruned_units[layer_idx].append(unit)
+            num_units[layer_idx] -= 1
+            num_units_to_prune -= 1
+    return pruned_units
+
+
+def prune_backbone(
+    backbone: HuggingFaceBackbone,
+    importances: PruningImportances,
+    level: PruningLevel,
+    original_num_layers: int
+) -> None:
+    '''
+    Remove the least important layers, then heads, then FFN neurons, until the shares of level are removed
+    from the original backbone. Units of removed layers count as removed.
+    '''
+    model = backbone.backbone
+    config = model.config
+
+    num_kept_layers = max(original_num_layers - round(level.layers * original_num_layers), 1)
+    num_layers_to_remove = max(len(model.encoder.layer) - num_kept_layers, 0)
+    removed_layers = set(importances.layers.argsort()[:num_layers_to_remove].tolist())
+    kept_layers = [idx for idx in range(len(model.encoder.layer)) if idx not in removed_layers]
+    remove_layers(model, sorted(removed_layers))
+    layers = model.encoder.layer
+
+    num_kept_heads = round((1 - level.heads) * original_num_layers * config.num_attention_heads)
+    head_importances = [importances.heads[idx] for idx in kept_layers]
+    for layer, heads in zip(layers, select_units_to_prune(head_importances, num_kept_heads)):
+        remaining_heads = get_remaining_heads(layer, config.num_attention_heads)
+        prune_attention_heads(layer, [remaining_heads[head] for head in heads])
+
+    num_kept_neurons = round((1 - level.ffn_neurons) * original_num_layers * config.intermediate_size)
+    neuron_importances = [importances.ffn_neurons[idx] for idx in kept_layers]
+    for layer, neurons in zip(layers, select_units_to_prune(neuron_importances, num_kept_neurons)):
+        if len(neurons) > 0:
+            pruned_neurons = set(neurons)
+            kept_neurons = [neuron for neuron in range(layer.intermediate.dense.out_features) if neuron not in pruned_neurons]
+            prune_ffn_neurons(layer, torch.tensor(kept_neurons))
+
+
+@torch.no_grad()
+def measure_latency_ms(model: nn.Module, batches: list[Any], device: torch.device) -> float:
+    '''Mean inference time of a batch, in milliseconds'''
+    was_training = model.training
+    model.eval()
+    batches = [move_data_to_device(texts, device) for texts in batches]
+    model(batches[0])  # Warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for texts in batches:
+        model(texts)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    model.train(was_training)
+    return (time.perf_counter() - start) * 1000 / len(batches)
@@ -1,11 +1,22 @@
 from abc import ABC, abstractmethod
+import copy
 from functools import partial
-from typing import Union, TYPE_CHECKING
+from typing import Any, Union, TYPE_CHECKING
 
+from hydra.utils import instantiate
 from lightning import Trainer
+import mlflow
+from omegaconf import OmegaConf
+from torch import Tensor
 
-from jeffrey.data_modules.data_modules import DataModule, PartialDataModule
+from jeffrey.config_schemas.models.model_schemas import BinaryTextClassificationModelConfig
+from jeffrey.data_modules.data_modules import DataModule, PartialDataModule, TextClassificationDataModule
+from jeffrey.data_modules.embedding_store import check_embedding_store_output
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.common.exporter import get_tar_model_registry_key
+from jeffrey.models.models import MultiBranchBinaryTextClassificationModel
 from jeffrey.training.lightning_modules.bases import TrainingLightningModule
+from jeffrey.utils.registry import get_registry
 from jeffrey.utils.utils import get_logger
 
 
@@ -14,6 +25,20 @@
     from jeffrey.config_schemas.training.training_task_schemas import TrainingTaskConfig
 
 
+def get_branch_model_config(model_config: Any, branch_idx: int) -> Any:
+    '''Config of MultiBranchBinaryTextClassificationModel.get_branch_model'''
+    branch_model_config = OmegaConf.structured(BinaryTextClassificationModelConfig)
+    branch_model_config.backbone = model_config.backbone
+    if branch_idx == 0:
+        branch_model_config.head = model_config.head
+        branch_model_config.adapter = model_config.adapter
+    else:
+        branch_model_config.head = model_config.branch_heads[branch_idx - 1]
+        if model_config.branch_adapters is not None:
+            branch_model_config.adapter = model_config.branch_adapters[branch_idx - 1]
+    return branch_model_config
+
+
 class TrainingTask(ABC):
     def __init__(
         self,
@@ -39,6 +64,71 @@ def __init__(
         else:
             self.data_module = data_module
             
+        if isinstance(self.data_module, TextClassificationDataModule) and self.data_module.use_embedding_store:
+            # Only the adapter and head are trained, from backbone outputs computed once per split
+            backbone = getattr(self.lightning_module.model, "backbone")
+            check_embedding_store_output(self.lightning_module.model, self.data_module.embedding_store_output)
+            backbone.requires_grad_(False)
+            self.data_module.set_frozen_backbone(backbone)
+            
+    def trim_vocab(self, task_config: "TrainingTaskConfig") -> None:
+        '''
+        Trim the word embeddings of a backbone with trim_vocab to the tokens of the training split,
+        before the optimizer is created. The trimmed size is written back to the model config,
+        so that exported models are rebuilt with the trimmed layout before loading their state dict.
+        '''
+        backbone = getattr(self.lightning_module.model, "backbone", None)
+        if not isinstance(backbone, HuggingFaceBackbone) or not backbone.trim_vocab or backbone.is_vocab_trimmed:
+            return
+        
+        assert isinstance(self.data_module, TextClassificationDataModule)
+        original_vocab_size = backbone.backbone.get_input_embeddings().num_embeddings
+        backbone.trim_vocab_to_token_ids(self.data_module.get_used_token_ids(self.data_module.train_df_path))
+        task_config.lightning_module.model.backbone.trimmed_vocab_size = backbone.trimmed_vocab_size
+        self.logger.info(f"Trimmed the vocab from {original_vocab_size} to {backbone.trimmed_vocab_size} tokens")
+            
+    def select_output_branch(self, task_config: "TrainingTaskConfig") -> bool:
+        '''
+        Keep the branch of a multi-branch model with the best validation F1 score, for lightning modules exporting
+        the "best" branch, the averaged ensemble of every branch otherwise. The best branch replaces the model
+        and its config, without the parameters of the other branches. Returns whether the model was replaced.
+        '''
+        model = self.lightning_module.model
+        if not isinstance(model, MultiBranchBinaryTextClassificationModel):
+            return False
+        if getattr(self.lightning_module, "export_branch", "ensemble") == "ensemble":
+            model.output_branch = None
+            task_config.lightning_module.model.output_branch = None
+            return False
+        
+        validation_metrics = self.trainer.validate(model=self.lightning_module, datamodule=self.data_module, verbose=False)[0]
+        branch_f1_scores = [validation_metrics[f"validation_f1_score_branch_{idx}"] for idx in range(model.num_branches)]
+        output_branch = max(range(model.num_branches), key=lambda idx: branch_f1_scores[idx])
+        self.logger.info(f"Branch validation F1 scores: {branch_f1_scores}, exporting branch {output_branch}")
+        if self.trainer.is_global_zero:
+            mlflow.log_metrics({f"branch_selection_f1_score_branch_{idx}": f1_score for idx, f1_score in enumerate(branch_f1_scores)})
+            mlflow.log_metric("selected_output_branch", output_branch)
+        
+        self.lightning_module.model = model.get_branch_model(output_branch)
+        task_config.lightning_module.model = get_branch_model_config(task_config.lightning_module.model, output_branch)
+        return True
+        
+    def register_exported_model(self, model_config: Any, model_state_dict: dict[str, Tensor], tar_model_path: str) -> None:
+        '''
+        Register a model built from the exported config and state dict under the tar path, so that later tasks of the run
+        loading it skip the tar. The trained model itself is never registered: it is compiled, moved and merged in place.
+        '''
+        model_config = copy.deepcopy(model_config)
+        if OmegaConf.select(model_config, "backbone.pretrained") is not None:
+            model_config.backbone.pretrained = False  # Every weight comes from the state dict
+        model = instantiate(model_config)
+        model.load_state_dict(model_state_dict)
+        
+        backbone = getattr(model, "backbone", None)
+        if isinstance(backbone, HuggingFaceBackbone):
+            backbone.merge_lora()  # Like the exported model
+        get_registry().put(get_tar_model_registry_key(tar_model_path), model.eval())
+        
     @abstractmethod
     def run(self, config: "Config", task_config: "TrainingTaskConfig") -> None:
         ...
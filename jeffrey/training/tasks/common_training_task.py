@@ -37,6 +37,8 @@ def run(self, config: "Config", task_config: "TrainingTaskConfig") -> None:
         run_id = config.infrastructure.mlflow.run_id
         run_name = config.infrastructure.mlflow.run_name
         
+        self.trim_vocab(task_config)
+        
         with activate_mlflow(
             experiment_name=experiment_name,
             run_id=run_id,
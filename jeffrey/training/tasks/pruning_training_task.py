@@ -0,0 +1,178 @@
+import itertools
+import os
+from typing import TYPE_CHECKING, Union
+
+import mlflow
+import torch
+from lightning import Trainer
+
+from jeffrey.data_modules.data_modules import DataModule, PartialDataModule, TextClassificationDataModule
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.common.exporter import TarModelExporter, TarModelLoader
+from jeffrey.models.models import EarlyExitBinaryTextClassificationModel
+from jeffrey.training.lightning_modules.bases import ModelStateDictExportingTrainingLightningModule
+from jeffrey.training.pruning import (
+    PruningLevel,
+    count_backbone_units,
+    measure_latency_ms,
+    prune_backbone,
+    score_importances
+)
+from jeffrey.training.tasks.bases import TrainingTask
+from jeffrey.utils.io_utils import open_file
+from jeffrey.utils.mlflow_utils import activate_mlflow, log_artifacts_for_reproducibility
+
+if TYPE_CHECKING:
+    from jeffrey.config_schemas.config_schema import Config
+    from jeffrey.config_schemas.training.training_task_schemas import TrainingTaskConfig
+
+
+PRUNED_MODEL_STATE_DICT_FILE_NAME = "pruned_model_state_dict.pth"
+
+
+class PruningTrainingTask(TrainingTask):
+    '''
+    Structured pruning of a trained model (tar_model_path): at every level, layers, attention heads and FFN neurons
+    of the backbone are scored on the validation split, the least important ones are removed from the weights,
+    and the model is fine-tuned for fine_tuning_epochs. Size, latency and F1 of every level are logged to MLflow
+    (step 0 is the unpruned model), and the model of the last level is exported.
+    '''
+    def __init__(
+        self,
+        task_name: str,
+        data_module: Union[DataModule, PartialDataModule],
+        lightning_module: ModelStateDictExportingTrainingLightningModule,
+        trainer: Trainer,
+        best_training_checkpoint: str,
+        last_training_checkpoint: str,
+        tar_model_path: str,
+        tar_model_export_path: str,
+        pruning_levels: list[PruningLevel],
+        num_scoring_batches: int = 32,
+        num_latency_batches: int = 16,
+        fine_tuning_epochs: int = 1
+    ) -> None:
+        super().__init__(
+            task_name=task_name,
+            data_module=data_module,
+            lightning_module=lightning_module,
+            trainer=trainer,
+            best_training_checkpoint=best_training_checkpoint,
+            last_training_checkpoint=last_training_checkpoint
+        )
+        
+        self.tar_model_path = tar_model_path
+        self.tar_model_export_path = tar_model_export_path
+        self.pruning_levels = pruning_levels
+        self.num_scoring_batches = num_scoring_batches
+        self.num_latency_batches = num_latency_batches
+        self.fine_tuning_epochs = fine_tuning_epochs
+        
+        model = self.lightning_module.model
+        self.backbone = getattr(model, "backbone", None)
+        if not isinstance(self.backbone, HuggingFaceBackbone) or isinstance(model, EarlyExitBinaryTextClassificationModel):
+            raise ValueError("Pruning needs a HuggingFaceBackbone, and a model without early exits")
+        if isinstance(self.data_module, TextClassificationDataModule) and self.data_module.use_embedding_store:
+            raise ValueError("A pruned backbone can not be trained from an embedding store")
+        self.backbone.check_prunable()
+    
+    def load_trained_model(self, task_config: "TrainingTaskConfig") -> None:
+        trained_model = TarModelLoader(exported_model_path=self.tar_model_path).load()
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        
+        trimmed_vocab_size = trained_model.backbone.trimmed_vocab_size
+        if trimmed_vocab_size is not None and not self.backbone.is_vocab_trimmed:
+            self.backbone.resize_word_embeddings(trimmed_vocab_size)
+            task_config.lightning_module.model.backbone.trimmed_vocab_size = trimmed_vocab_size
+        self.lightning_module.model.load_state_dict(trained_model.state_dict())
+    
+    def log_pruning_level(self, level_idx: int) -> None:
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        validation_metrics = self.trainer.validate(model=self.lightning_module, datamodule=self.data_module, verbose=False)[0]
+        latency_batches = [texts for texts, _ in itertools.islice(self.data_module.val_dataloader(), self.num_latency_batches)]
+        device = self.trainer.strategy.root_device
+        self.lightning_module.to(device)
+        
+        metrics = {
+            "pruning_model_size": self.lightning_module._calculate_model_size(),
+            "pruning_latency_ms": measure_latency_ms(self.lightning_module.model, latency_batches, device),
+            "pruning_validation_f1_score": validation_metrics["validation_f1_score"],
+            "pruning_validation_accuracy": validation_metrics["validation_accuracy"],
+            **{f"pruning_num_{unit}": float(count) for unit, count in count_backbone_units(self.backbone).items()}
+        }
+        self.logger.info(f"Pruning level {level_idx}: {metrics}")
+        if self.trainer.is_global_zero:
+            mlflow.log_metrics(metrics, step=level_idx)
+    
+    def prune(self, level: PruningLevel, original_num_layers: int) -> None:
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        # Outside fit / validate Lightning injects no DistributedSampler: every rank takes every world_size-th batch,
+        # so that ranks score different batches, and score_importances sums the importances over ranks
+        rank, world_size = self.trainer.global_rank, self.trainer.world_size
+        scoring_batches = itertools.islice(
+            self.data_module.val_dataloader(), rank, rank + world_size * self.num_scoring_batches, world_size
+        )
+        device = self.trainer.strategy.root_device
+        self.lightning_module.to(device)
+        importances = score_importances(self.lightning_module.model, self.backbone, scoring_batches, self.lightning_module.loss, device)
+        prune_backbone(self.backbone, importances, level, original_num_layers)
+    
+    def export_pruned_model(self, task_config: "TrainingTaskConfig") -> None:
+        assert isinstance(self.backbone, HuggingFaceBackbone)
+        pruned_num_layers, pruned_heads, intermediate_sizes = self.backbone.get_pruned_layout()
+        backbone_config = task_config.lightning_module.model.backbone
+        backbone_config.pruned_num_layers = pruned_num_layers
+        backbone_config.pruned_heads = pruned_heads
+        backbone_config.intermediate_sizes = intermediate_sizes
+        
+        # Exported from memory: checkpoints of earlier levels have other shapes
+        model_state_dict = {key: value.cpu() for key, value in self.lightning_module.model.state_dict().items()}
+        model_state_dict_path = os.path.join(os.path.dirname(self.best_training_checkpoint), PRUNED_MODEL_STATE_DICT_FILE_NAME)
+        if self.trainer.is_global_zero:
+            with open_file(model_state_dict_path, "wb") as f:
+                torch.save(model_state_dict, f)
+        
+        model_exporter = TarModelExporter(
+            model_state_dict_path=model_state_dict_path,
+            model_config=task_config.lightning_module.model,
+            tar_model_export_path=self.tar_model_export_path
+        )
+        model_exporter.export()
+        self.register_exported_model(task_config.lightning_module.model, model_state_dict, self.tar_model_export_path)
+    
+    def run(self, config: "Config", task_config: "TrainingTaskConfig") -> None:
+        experiment_name = config.infrastructure.mlflow.experiment_name
+        run_id = config.infrastructure.mlflow.run_id
+        run_name = config.infrastructure.mlflow.run_name
+        
+        assert isinstance(self.data_module, TextClassificationDataModule)
+        train_statistics = self.data_module.get_train_statistics()
+        self.lightning_module.set_pos_weight(pos_weight=torch.Tensor([train_statistics.pos_weight]))
+        
+        self.load_trained_model(task_config)
+        
+        with activate_mlflow(
+            experiment_name=experiment_name,
+            run_id=run_id,
+            run_name=run_name
+        ) as _:
+            if self.trainer.is_global_zero:
+                log_artifacts_for_reproducibility()
+            
+            assert isinstance(self.backbone, HuggingFaceBackbone)
+            original_num_layers = self.backbone.num_layers
+            self.data_module.setup("fit")
+            self.log_pruning_level(0)
+            
+            for level_idx, level in enumerate(self.pruning_levels, start=1):
+                self.logger.info(f"Pruning level {level_idx}: {level}")
+                self.prune(level, original_num_layers)
+                
+                # The trainer keeps its epoch count between fits, the optimizer is rebuilt for the pruned parameters
+                self.trainer.fit_loop.max_epochs = self.trainer.current_epoch + self.fine_tuning_epochs
+                self.trainer.fit(model=self.lightning_module, datamodule=self.data_module)
+                self.log_pruning_level(level_idx)
+            
+            self.logger.info("Pruning finished!!")
+            self.logger.info("Exporting pruned model...")
+            self.export_pruned_model(task_config)
@@ -1,14 +1,14 @@
 from typing import TYPE_CHECKING, Union
 
-import pandas as pd
 from lightning import Trainer
+import torch
 from torch import Tensor
 
-from jeffrey.data_modules.data_modules import DataModule, PartialDataModule
+from jeffrey.data_modules.data_modules import DataModule, PartialDataModule, TextClassificationDataModule
 from jeffrey.models.common.exporter import TarModelExporter
 from jeffrey.training.lightning_modules.bases import ModelStateDictExportingTrainingLightningModule
 from jeffrey.training.tasks.bases import TrainingTask
-from jeffrey.utils.io_utils import is_file
+from jeffrey.utils.io_utils import is_file, open_file
 from jeffrey.utils.mlflow_utils import activate_mlflow, log_artifacts_for_reproducibility
 
 if TYPE_CHECKING:
@@ -43,11 +43,11 @@ def run(self, config: "Config", task_config: "TrainingTaskConfig") -> None:
         run_id = config.infrastructure.mlflow.run_id
         run_name = config.infrastructure.mlflow.run_name
         
-        train_df = pd.read_parquet(task_config.data_module.train_df_path)
-        value_counts = train_df["label"].value_counts()
-        pos_weight = value_counts[0] / value_counts[1]
+        assert isinstance(self.data_module, TextClassificationDataModule)
+        train_statistics = self.data_module.get_train_statistics()
+        self.lightning_module.set_pos_weight(pos_weight=Tensor([train_statistics.pos_weight]))
         
-        self.lightning_module.set_pos_weight(pos_weight=Tensor([pos_weight]))
+        self.trim_vocab(task_config)
         
         with activate_mlflow(
             experiment_name=experiment_name,
@@ -78,10 +78,23 @@ def run(self, config: "Config", task_config: "TrainingTaskConfig") -> None:
             self.logger.info("Exporting model state dict...")
             
             model_state_dict_path = self.lightning_module.export_model_state_dict(self.best_training_checkpoint)
+            with open_file(model_state_dict_path, "rb") as f:
+                model_state_dict = torch.load(f, map_location=torch.device("cpu"))
+            self.lightning_module.model.load_state_dict(model_state_dict)
+            if self.select_output_branch(task_config):
+                # The other branches were dropped from the model
+                model_state_dict = {key: value.cpu() for key, value in self.lightning_module.model.state_dict().items()}
+                if self.trainer.is_global_zero:
+                    with open_file(model_state_dict_path, "wb") as f:
+                        torch.save(model_state_dict, f)
+            
             model_config = task_config.lightning_module.model
             model_exporter = TarModelExporter(
                 model_state_dict_path=model_state_dict_path,
                 model_config=model_config,
                 tar_model_export_path=self.tar_model_export_path
             )
-            model_exporter.export()
\ No newline at end of file
+            model_exporter.export()
+            
+            # Later tasks of the run loading the exported model get it back without reading the tar
+            self.register_exported_model(model_config, model_state_dict, self.tar_model_export_path)
\ No newline at end of file
@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Generator
+
+from jeffrey.utils.io_utils import GCS_PREFIX, choose_file_system, get_fingerprint_from_info, open_file
+from jeffrey.utils.utils import get_logger
+
+ARTIFACT_CACHE_DIR = "/tmp/jeffrey-artifact-cache"
+ARTIFACT_CACHE_MAX_SIZE_BYTES = 20 * 1024**3
+# Entries used more recently than this are never evicted, another process may still be loading them
+EVICTION_GRACE_SECONDS = 60 * 60
+ARTIFACT_METADATA_FILE_SUFFIX = ".json"
+ARTIFACT_LOCK_FILE_SUFFIX = ".lock"
+CACHE_LOCK_FILE_NAME = ".cache.lock"
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+logger = get_logger(__name__)
+
+
+@contextmanager
+def file_lock(lock_path: str) -> Generator[None, None, None]:
+    '''Exclusive lock shared by all processes of the node'''
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def list_remote_files(path: str, is_dir: bool) -> dict[str, dict[str, Any]]:
+    '''File system info of every file of a remote directory (or of a single remote file), by relative path'''
+    file_system = choose_file_system(path)
+    if not is_dir:
+        return {os.path.basename(path.rstrip("/")): file_system.info(path)}
+
+    root = file_system._strip_protocol(path).rstrip("/")
+    infos: dict[str, dict[str, Any]] = file_system.find(path, detail=True)
+    return {os.path.relpath(file_path, root): info for file_path, info in infos.items()}
+
+
+def get_artifact_key(remote_files: dict[str, dict[str, Any]]) -> str:
+    '''Hash of the names, sizes and versions (generation / etag / md5) of the files, not of where they live'''
+    fingerprints = {}
+    for relative_path, info in remote_files.items():
+        fingerprint = get_fingerprint_from_info(relative_path, info)
+        fingerprint.pop("path")
+        fingerprints[relative_path] = fingerprint
+    return hashlib.sha256(json.dumps(fingerprints, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def download_artifact(path: str, relative_paths: list[str], is_dir: bool, entry_dir: str) -> None:
+    '''Download into a temporary directory renamed into place, so an entry directory is always complete'''
+    tmp_entry_dir = f"{entry_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_entry_dir, ignore_errors=True)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+
+    name = os.path.basename(path.rstrip("/"))
+    for relative_path in relative_paths:
+        if is_dir:
+            source_path = f"{path.rstrip('/')}/{relative_path}"
+            target_path = os.path.join(tmp_entry_dir, name, relative_path)
+        else:
+            source_path = path
+            target_path = os.path.join(tmp_entry_dir, name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with open_file(source_path, "rb") as source, open(target_path, "wb") as target:
+            while chunk := source.read(DOWNLOAD_CHUNK_SIZE):
+                target.write(chunk)
+    os.replace(tmp_entry_dir, entry_dir)
+
+
+def evict_artifacts(cache_dir: str, max_size_bytes: int, keep_key: str) -> None:
+    '''Remove least recently used entries until the cache fits in max_size_bytes'''
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith(ARTIFACT_METADATA_FILE_SUFFIX):
+            metadata_path = os.path.join(cache_dir, file_name)
+            with open(metadata_path, "r") as f:
+                size = json.load(f)["size"]
+            entries.append((os.path.getmtime(metadata_path), file_name[: -len(ARTIFACT_METADATA_FILE_SUFFIX)], size))
+
+    total_size = sum(size for _, _, size in entries)
+    for last_used, key, size in sorted(entries):
+        if total_size <= max_size_bytes:
+            break
+        if key == keep_key or time.time() - last_used < EVICTION_GRACE_SECONDS:
+            continue
+        with file_lock(os.path.join(cache_dir, key + ARTIFACT_LOCK_FILE_SUFFIX)):
+            os.remove(os.path.join(cache_dir, key + ARTIFACT_METADATA_FILE_SUFFIX))
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total_size -= size
+        logger.info(f"Evicted artifact {key} ({size / 1024**2:.1f} MiB)")
+
+
+def get_cached_artifact(
+    path: str,
+    cache_dir: str = ARTIFACT_CACHE_DIR,
+    max_size_bytes: int = ARTIFACT_CACHE_MAX_SIZE_BYTES,
+) -> str:
+    '''
+    Local copy of a remote file or directory, downloaded once per node and version.
+    Entries are keyed by the remote versions of the files, so an overwritten artifact is downloaded again
+    and artifacts with the same name from different runs never collide. Processes of a node coordinate
+    with file locks: one downloads, the others wait for it and load the same copy.
+    '''
+    is_dir = choose_file_system(path).isdir(path)
+    remote_files = list_remote_files(path, is_dir)
+    key = get_artifact_key(remote_files)
+    entry_dir = os.path.join(cache_dir, key)
+    metadata_path = entry_dir + ARTIFACT_METADATA_FILE_SUFFIX
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with file_lock(os.path.join(cache_dir, key + ARTIFACT_LOCK_FILE_SUFFIX)):
+        if os.path.exists(metadata_path):
+            logger.info(f"Loading {path} from the artifact cache ({entry_dir})")
+        else:
+            logger.info(f"Downloading {path} into the artifact cache ({entry_dir})...")
+            download_artifact(path, list(remote_files), is_dir, entry_dir)
+            with open(metadata_path, "w") as f:
+                json.dump({"path": path, "size": sum(int(info["size"]) for info in remote_files.values())}, f)
+        # The metadata file modification time is the last use of the entry
+        os.utime(metadata_path)
+
+    with file_lock(os.path.join(cache_dir, CACHE_LOCK_FILE_NAME)):
+        evict_artifacts(cache_dir, max_size_bytes, keep_key=key)
+
+    return os.path.join(entry_dir, os.path.basename(path.rstrip("/")))
+
+
+def translate_gcs_dir_to_local(path: str) -> str:
+    '''Local path of a gs:// file or directory through the artifact cache, local paths are returned as they are'''
+    if path.startswith(GCS_PREFIX):
+        return get_cached_artifact(path)
+    return path
@@ -6,7 +6,6 @@
 GCS_PREFIX = "gs://"
 GCS_FILE_SYSTEM_NAME = "gcs"
 LOCAL_FILE_SYSTEM_NAME = "file"
-TMP_FILE_PATH = "/tmp/"
 
 
 def choose_file_system(path: str) -> AbstractFileSystem:
@@ -65,11 +64,15 @@ def copy_dir(source_dir: str, target_dir: str) -> None:
             raise ValueError(f"Source file {source_file} is not a file.")
 
 
-def translate_gcs_dir_to_local(path: str) -> str:
-    if path.startswith(GCS_PREFIX):
-        path = path.rstrip("/")
-        local_path = os.path.join(TMP_FILE_PATH, os.path.split(path)[-1])
-        os.makedirs(local_path, exist_ok=True)
-        copy_dir(path, local_path)
-        return local_path
-    return path
\ No newline at end of file
+def get_remote_fingerprint(path: str) -> dict[str, Any]:
+    '''Identity of the remote object: size plus whatever version fields the file system reports'''
+    info = choose_file_system(path).info(path)
+    return get_fingerprint_from_info(path, info)
+
+
+def get_fingerprint_from_info(path: str, info: dict[str, Any]) -> dict[str, Any]:
+    fingerprint = {"path": path, "size": int(info["size"])}
+    for key in ["generation", "etag", "md5Hash", "mtime"]:
+        if info.get(key) is not None:
+            fingerprint[key] = str(info[key])
+    return fingerprint
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import hashlib
+import json
+from typing import Any, Callable, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import torch
+from omegaconf import DictConfig, ListConfig, OmegaConf
+from torch import nn
+
+from jeffrey.utils.utils import get_logger
+
+DEFAULT_MAX_MEMORY_BYTES = 4 * 1024**3
+MAX_SIZE_ESTIMATION_DEPTH = 3
+
+T = TypeVar("T")
+
+logger = get_logger(__name__)
+
+
+def get_config_hash(config: Any) -> str:
+    '''Hash of a (resolved) config, dict or any other JSON serializable value'''
+    if isinstance(config, (DictConfig, ListConfig)):
+        config = OmegaConf.to_container(config, resolve=True)
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_object_size(obj: Any, depth: int = 0, seen: Optional[set[int]] = None) -> int:
+    '''
+    Bytes of heap memory held by the arrays, tensors and tables of an object and of its attributes.
+    Memory-mapped arrays are backed by the page cache and are not counted.
+    '''
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, nn.Module):
+        tensors = {tensor.data_ptr(): tensor for tensor in [*obj.parameters(), *obj.buffers()]}
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors.values())
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, np.memmap):
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pa.Table, pa.Array, pa.ChunkedArray)):
+        return obj.nbytes
+    if depth < MAX_SIZE_ESTIMATION_DEPTH and hasattr(obj, "__dict__"):
+        return sum(get_object_size(value, depth + 1, seen) for value in vars(obj).values())
+    return 0
+
+
+class Registry:
+    '''
+    Process-level LRU of objects built by a task, keyed by a hash of the resolved config that built them,
+    so that later tasks of the same run_tasks call reuse them instead of building them again.
+    Objects are evicted least recently used first once their estimated size exceeds max_memory_bytes,
+    objects larger than max_memory_bytes on their own are never registered, and 0 disables the registry.
+    Registered objects are shared, not copied: only register objects that are not modified after being built.
+    '''
+    def __init__(self, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self.memory_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def get(self, key: str) -> Optional[Any]:
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key: str, obj: Any) -> None:
+        self.remove(key)
+        size = get_object_size(obj)
+        if size > self.max_memory_bytes:
+            return
+        self.entries[key] = (obj, size)
+        self.memory_bytes += size
+        self.evict()
+
+    def get_or_build(self, key: str, build: Callable[[], T]) -> T:
+        obj = self.get(key)
+        if obj is not None:
+            logger.info(f"Reusing registered {type(obj).__name__} {key[:12]}")
+            return obj  # type: ignore
+        obj = build()
+        self.put(key, obj)
+        return obj
+
+    def remove(self, key: str) -> None:
+        if key in self.entries:
+            _, size = self.entries.pop(key)
+            self.memory_bytes -= size
+
+    def set_max_memory_bytes(self, max_memory_bytes: int) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.evict()
+
+    def evict(self) -> None:
+        while self.memory_bytes > self.max_memory_bytes or (self.max_memory_bytes == 0 and self.entries):
+            key, (obj, size) = self.entries.popitem(last=False)
+            self.memory_bytes -= size
+            logger.info(f"Evicted registered {type(obj).__name__} {key[:12]} ({size / 1024**2:.1f} MiB)")
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.memory_bytes = 0
+
+
+registry = Registry()
+
+
+def get_registry() -> Registry:
+    return registry
@@ -1,11 +1,31 @@
+import hashlib
 import itertools
 import os
-from typing import Any
+from typing import Any, Iterable, Mapping, Optional, Sequence, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
+import torch
 from matplotlib.pyplot import figure
-from torch import Tensor
+from torch import Tensor, nn
+from torchmetrics.functional.classification import binary_accuracy, binary_f1_score
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+from jeffrey.models.transformations import (
+    PACKED_EXAMPLE_POSITIONS_KEY,
+    CompactEncodings,
+    HuggingFaceTokenizationTransformation,
+)
+
+
+def hash_tensors(named_tensors: Iterable[tuple[str, Tensor]]) -> str:
+    '''Hash of the names, dtypes, shapes and values of tensors'''
+    hasher = hashlib.sha256()
+    for name, tensor in named_tensors:
+        tensor = tensor.detach().cpu().contiguous()
+        hasher.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        hasher.update(tensor.flatten().view(torch.uint8).numpy().tobytes())
+    return hasher.hexdigest()
 
 
 def plot_confusion_matrix(confusion_matrix: Tensor, class_names: list[str]) -> Any:
@@ -39,4 +59,113 @@ def plot_confusion_matrix(confusion_matrix: Tensor, class_names: list[str]) -> A
     return plt.gcf()
 
 def get_local_rank() -> int:
-    return int(os.getenv("LOCAL_RANK", -1))
\ No newline at end of file
+    return int(os.getenv("LOCAL_RANK", -1))
+
+def count_real_and_padded_tokens(
+    encodings: Union[Mapping[str, Tensor], CompactEncodings, BaseModelOutputWithPooling]
+) -> tuple[Tensor, Tensor]:
+    '''Number of real (attended) tokens and number of token slots the model actually computes in a batch'''
+    if isinstance(encodings, BaseModelOutputWithPooling):
+        # Stored backbone outputs: one vector per example, or the real tokens of every example padded per batch
+        attention_mask = getattr(encodings, "attention_mask", None)
+        if attention_mask is None:
+            num_examples = torch.tensor(len(encodings.pooler_output), device=encodings.pooler_output.device)
+            return num_examples, num_examples
+        return attention_mask.sum(), torch.tensor(attention_mask.numel(), device=attention_mask.device)
+    if isinstance(encodings, CompactEncodings):
+        real_tokens = encodings.lengths.long().sum()
+        return real_tokens, torch.tensor(encodings.input_ids.numel(), device=real_tokens.device)
+    
+    input_ids = encodings["input_ids"]
+    if PACKED_EXAMPLE_POSITIONS_KEY in encodings:
+        # Packed batches have a (num_rows, row_len, row_len) attention mask, lengths are stored per example
+        real_tokens = encodings[PACKED_EXAMPLE_POSITIONS_KEY][:, 2].sum()
+    else:
+        real_tokens = encodings["attention_mask"].sum()
+    padded_tokens = torch.tensor(input_ids.numel(), device=input_ids.device)
+    return real_tokens, padded_tokens
+
+
+def compile_model_forward(model: nn.Module, mode: Optional[str] = None) -> None:
+    '''
+    Compile the forward of a model in place, for static shapes. Parameters and state dict keys stay
+    those of the eager model, so checkpoints and exported state dicts are unchanged.
+    A model whose forward is already compiled is left as it is.
+    '''
+    if "forward" in vars(model):
+        return
+    model.forward = torch.compile(model.forward, mode=mode, dynamic=False)  # type: ignore
+    
+    
+def get_warm_up_batch_sizes(datamodule: Any, dataset_name: str) -> list[int]:
+    '''Batch sizes a compiled model sees on a dataset of a data module, batch_size only for data modules that do not tell'''
+    dataset = getattr(datamodule, dataset_name, None)
+    if dataset is None or not hasattr(datamodule, "get_batch_sizes"):
+        return [datamodule.batch_size]
+    batch_sizes: list[int] = datamodule.get_batch_sizes(dataset)
+    return batch_sizes
+    
+    
+def warm_up_compiled_model(
+    model: nn.Module,
+    transformation: HuggingFaceTokenizationTransformation,
+    batch_sizes: Sequence[int],
+    device: torch.device,
+    training: bool,
+    compact_batches: bool = False,
+) -> None:
+    '''Compile the graphs of every static sequence length and batch size upfront, forward and backward when training'''
+    assert transformation.static_sequence_lengths is not None, "Compiled models need static sequence lengths"
+    # Every (sequence length, batch size, train / eval) combination is a graph of its own
+    torch._dynamo.config.cache_size_limit = max(
+        torch._dynamo.config.cache_size_limit, 4 * len(transformation.static_sequence_lengths) * len(batch_sizes)
+    )
+    
+    was_training = model.training
+    model.train(training)
+    for batch_size in batch_sizes:
+        for length in transformation.static_sequence_lengths:
+            input_ids = [[transformation.tokenizer.pad_token_id] * length] * batch_size
+            encodings = transformation.compact(input_ids) if compact_batches else transformation.pad(input_ids)
+            encodings = encodings.to(device)
+            with torch.set_grad_enabled(training):
+                output = model(encodings)
+            if training:
+                output.float().sum().backward()
+    model.zero_grad(set_to_none=True)
+    model.train(was_training)
+
+
+def all_gather_samples(lightning_module: Any, samples: Tensor) -> Tensor:
+    '''Samples (first dimension) of every rank concatenated in rank order, ranks may hold different numbers of samples'''
+    if lightning_module.trainer.world_size == 1:
+        return samples
+    num_samples = lightning_module.all_gather(torch.tensor(len(samples), device=samples.device)).tolist()
+    padding = samples.new_zeros((max(num_samples) - len(samples), *samples.shape[1:]))
+    gathered_samples = lightning_module.all_gather(torch.cat([samples, padding]))  # (world_size, max_num_samples, ...)
+    return torch.cat([rank_samples[:num] for rank_samples, num in zip(gathered_samples, num_samples)])
+
+
+def get_early_exit_tradeoff(
+    model: nn.Module, 
+    all_exit_outputs: list[Tensor], 
+    labels: Tensor, 
+    exit_thresholds: list[float]
+) -> list[dict[str, float]]:
+    '''
+    Accuracy, F1 score and mean number of backbone layers executed for every exit threshold, from the outputs of
+    every exit of an early exit model (see EarlyExitBinaryTextClassificationModel.select_exit_outputs)
+    '''
+    tradeoff = []
+    for exit_threshold in exit_thresholds:
+        outputs, layers_executed = model.select_exit_outputs(all_exit_outputs, exit_threshold)  # type: ignore
+        tradeoff.append(
+            {
+                "exit_threshold": exit_threshold,
+                "accuracy": float(binary_accuracy(outputs, labels)),
+                "f1_score": float(binary_f1_score(outputs, labels)),
+                "mean_layers_executed": float(layers_executed.float().mean()),
+                "num_layers": float(model.num_layers),  # type: ignore
+            }
+        )
+    return tradeoff
@@ -0,0 +1,27 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from jeffrey.benchmarks.benchmark_dataset_memory import measure_workers
+from jeffrey.benchmarks.benchmark_text_classification_dataset import create_synthetic_split
+from jeffrey.data_modules.dataset import MemoryMappedTextClassificationDataset, TextClassificationDataset
+from jeffrey.data_modules.text_store import get_text_store
+
+NUM_ROWS = 100_000
+BATCH_SIZE = 512
+NUM_WORKERS = 2
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="Worker memory is read from /proc (Linux only)")
+def test_memory_mapped_workers_do_not_copy_the_split(tmp_path: Path) -> None:
+    df_path = str(tmp_path / "train.parquet")
+    create_synthetic_split(df_path, NUM_ROWS)
+
+    pandas_usage = measure_workers(TextClassificationDataset(df_path, "cleaned_text", "label"), BATCH_SIZE, NUM_WORKERS)
+    text_store = get_text_store(df_path, "cleaned_text", "label", str(tmp_path / "text_store"))
+    memory_mapped_usage = measure_workers(MemoryMappedTextClassificationDataset(text_store), BATCH_SIZE, NUM_WORKERS)
+
+    # Reading rows of a pandas object array writes their reference counts, so workers duplicate its pages
+    assert memory_mapped_usage["Private_Dirty"] < pandas_usage["Private_Dirty"] / 2
+    assert memory_mapped_usage["Pss"] < pandas_usage["Pss"]
@@ -0,0 +1,69 @@
+import random
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed
+import torch.multiprocessing
+
+from jeffrey.data_modules.data_modules import TextClassificationDataModule
+
+WORLD_SIZE = 2
+
+
+def create_data_module(**kwargs: Any) -> TextClassificationDataModule:
+    # The transformation is only used by the collate function, no batch is collated here
+    return TextClassificationDataModule(
+        "train.parquet", "valid.parquet", "test.parquet", "text", "label", transformation=None, batch_size=8, **kwargs  # type: ignore
+    )
+
+
+def draw_random_numbers() -> list[float]:
+    return [random.random(), float(np.random.rand()), float(torch.rand(1))]
+
+
+def resume_on_rank(rank: int, init_file: str, results: Any) -> None:
+    torch.distributed.init_process_group("gloo", init_method=f"file://{init_file}", rank=rank, world_size=WORLD_SIZE)
+    torch.manual_seed(rank)
+    random.seed(rank)
+    np.random.seed(rank)
+
+    data_module = create_data_module(resumable=True)
+    state_dict = data_module.state_dict()
+    expected = draw_random_numbers()
+
+    # The checkpoint of rank zero is the one every rank resumes from
+    broadcast_state_dicts = [state_dict]
+    torch.distributed.broadcast_object_list(broadcast_state_dicts, src=0)
+    create_data_module(resumable=True).load_state_dict(broadcast_state_dicts[0])
+    results[rank] = (expected, draw_random_numbers())
+    torch.distributed.destroy_process_group()
+
+
+def test_resuming_restores_the_random_streams_of_every_rank(tmp_path: Path) -> None:
+    if not torch.distributed.is_available():
+        pytest.skip("torch.distributed is not available")
+
+    results = torch.multiprocessing.Manager().dict()
+    torch.multiprocessing.spawn(resume_on_rank, args=(str(tmp_path / "init"), results), nprocs=WORLD_SIZE)
+
+    for rank in range(WORLD_SIZE):
+        expected, resumed = results[rank]
+        assert resumed == expected
+    assert results[0][1] != results[1][1]
+
+
+def test_resuming_with_another_world_size_seeds_by_rank() -> None:
+    data_module = create_data_module(resumable=True, seed=3)
+    state_dict = {**data_module.state_dict(), "rng_states": []}
+
+    data_module.load_state_dict(state_dict)
+    resumed = draw_random_numbers()
+    random.seed(3)
+    np.random.seed(3)
+    torch.manual_seed(3)
+
+    assert resumed == draw_random_numbers()
+
@@ -0,0 +1,83 @@
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import pytest
+from torch.utils.data import DataLoader
+
+from jeffrey.data_modules.dataset import StreamingTextClassificationDataset
+
+NUM_ROWS = 1003
+BATCH_SIZE = 16
+NUM_REPLICAS = 4
+
+
+@pytest.fixture
+def df_path(tmp_path: Path) -> str:
+    '''Split written as a single row group, like most splits pyarrow writes'''
+    path = str(tmp_path / "split.parquet")
+    df = pd.DataFrame({"text": [f"text {idx}" for idx in range(NUM_ROWS)], "label": [idx % 2 for idx in range(NUM_ROWS)]})
+    df.to_parquet(path)
+    return path
+
+
+def create_rank_dataset(df_path: str, rank: int, **kwargs: Any) -> StreamingTextClassificationDataset:
+    dataset = StreamingTextClassificationDataset(df_path, "text", "label", batch_size=BATCH_SIZE, **kwargs)
+    dataset.get_num_replicas_and_rank = lambda: (NUM_REPLICAS, rank)  # type: ignore
+    return dataset
+
+
+def get_rank_texts(df_path: str, **kwargs: Any) -> list[list[list[str]]]:
+    '''Texts of every batch of every rank'''
+    rank_texts = []
+    for rank in range(NUM_REPLICAS):
+        dataset = create_rank_dataset(df_path, rank, **kwargs)
+        rank_texts.append([batch.texts for batch in dataset])
+        assert len(rank_texts[-1]) == len(dataset)
+    return rank_texts
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_single_row_group_is_shared_by_every_rank(df_path: str, shuffle: bool) -> None:
+    rank_texts = get_rank_texts(df_path, shuffle=shuffle, shuffle_buffer_size=64)
+
+    assert len({len(batches) for batches in rank_texts}) == 1
+    assert len(rank_texts[0]) == NUM_ROWS // NUM_REPLICAS // BATCH_SIZE
+    texts = [text for batches in rank_texts for batch in batches for text in batch]
+    assert len(texts) == len(set(texts))
+
+
+def test_evaluation_yields_every_row_once(df_path: str) -> None:
+    rank_texts = get_rank_texts(df_path, drop_last=False)
+
+    texts = [text for batches in rank_texts for batch in batches for text in batch]
+    assert sorted(texts) == sorted(f"text {idx}" for idx in range(NUM_ROWS))
+
+
+def test_too_few_rows_for_every_rank_raises(df_path: str) -> None:
+    dataset = create_rank_dataset(df_path, 0, num_workers=2)
+    dataset.batch_size = NUM_ROWS
+
+    with pytest.raises(ValueError, match="too few rows"):
+        len(dataset)
+
+
+def test_set_epoch_reaches_persistent_workers(df_path: str) -> None:
+    dataset = StreamingTextClassificationDataset(
+        df_path, "text", "label", batch_size=BATCH_SIZE, num_workers=2, shuffle=True, shuffle_buffer_size=64
+    )
+    dataloader = DataLoader(dataset, batch_size=None, num_workers=2, persistent_workers=True)
+
+    epoch_texts = []
+    for epoch in range(2):
+        dataset.set_epoch(epoch)
+        epoch_texts.append(sorted(tuple(batch.texts) for batch in dataloader))
+
+    fresh_dataset = StreamingTextClassificationDataset(
+        df_path, "text", "label", batch_size=BATCH_SIZE, num_workers=2, shuffle=True, shuffle_buffer_size=64
+    )
+    fresh_dataset.set_epoch(1)
+    fresh_dataloader = DataLoader(fresh_dataset, batch_size=None, num_workers=2)
+
+    assert epoch_texts[0] != epoch_texts[1]
+    assert epoch_texts[1] == sorted(tuple(batch.texts) for batch in fresh_dataloader)
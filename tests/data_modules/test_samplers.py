@@ -0,0 +1,140 @@
+from typing import Any
+
+import numpy as np
+import pytest
+from torch.utils.data import DistributedSampler
+
+from jeffrey.data_modules.samplers import LengthGroupedBatchSampler, ShardedBatchSampler, TokenBudgetBatchSampler
+
+NUM_SAMPLES = 1000
+BATCH_SIZE = 8
+MAX_TOKENS = 512
+NUM_REPLICAS = 4
+LENGTHS = np.random.default_rng(0).integers(1, 128, size=NUM_SAMPLES).tolist()
+
+
+def create_rank_samplers(sampler_class: type, epoch: int = 0, **kwargs: Any) -> list[Any]:
+    '''One batch sampler per rank, as Lightning builds them around an injected DistributedSampler'''
+    batch_samplers = []
+    for rank in range(NUM_REPLICAS):
+        sampler = DistributedSampler(range(NUM_SAMPLES), num_replicas=NUM_REPLICAS, rank=rank, shuffle=False)
+        sampler.set_epoch(epoch)
+        batch_samplers.append(sampler_class(sampler=sampler, **kwargs))
+    return batch_samplers
+
+
+def get_padding(batches: list[list[int]]) -> int:
+    return sum(len(batch) * max(LENGTHS[idx] for idx in batch) - sum(LENGTHS[idx] for idx in batch) for batch in batches)
+
+
+@pytest.mark.parametrize("bucket_boundaries", [None, [16, 32, 64]])
+def test_length_grouped_ranks_get_disjoint_batches_of_equal_count(bucket_boundaries: Any) -> None:
+    batch_samplers = create_rank_samplers(
+        LengthGroupedBatchSampler,
+        batch_size=BATCH_SIZE,
+        drop_last=True,
+        lengths=LENGTHS,
+        shuffle=True,
+        bucket_boundaries=bucket_boundaries,
+    )
+    rank_batches = [list(batch_sampler) for batch_sampler in batch_samplers]
+
+    assert len({len(batches) for batches in rank_batches}) == 1
+    assert [len(batches) for batches in rank_batches] == [len(batch_sampler) for batch_sampler in batch_samplers]
+    rank_indices = [[idx for batch in batches for idx in batch] for batches in rank_batches]
+    all_indices = [idx for indices in rank_indices for idx in indices]
+    assert len(all_indices) == len(set(all_indices))
+    assert all(len(batch) == BATCH_SIZE for batches in rank_batches for batch in batches)
+
+
+def test_length_grouped_without_drop_last_covers_every_sample() -> None:
+    batch_samplers = create_rank_samplers(
+        LengthGroupedBatchSampler, batch_size=BATCH_SIZE, drop_last=False, lengths=LENGTHS, shuffle=True
+    )
+    rank_batches = [list(batch_sampler) for batch_sampler in batch_samplers]
+
+    assert len({len(batches) for batches in rank_batches}) == 1
+    assert {idx for batches in rank_batches for batch in batches for idx in batch} == set(range(NUM_SAMPLES))
+
+
+def test_length_grouped_epochs_are_reproducible() -> None:
+    kwargs = {"batch_size": BATCH_SIZE, "drop_last": True, "lengths": LENGTHS, "shuffle": True, "seed": 42}
+    first_run = [list(batch_sampler) for batch_sampler in create_rank_samplers(LengthGroupedBatchSampler, epoch=3, **kwargs)]
+    second_run = [list(batch_sampler) for batch_sampler in create_rank_samplers(LengthGroupedBatchSampler, epoch=3, **kwargs)]
+    next_epoch = [list(batch_sampler) for batch_sampler in create_rank_samplers(LengthGroupedBatchSampler, epoch=4, **kwargs)]
+
+    assert first_run == second_run
+    assert first_run != next_epoch
+
+
+def test_length_grouped_batches_reduce_padding() -> None:
+    batch_samplers = create_rank_samplers(
+        LengthGroupedBatchSampler, batch_size=BATCH_SIZE, drop_last=True, lengths=LENGTHS, shuffle=True
+    )
+    grouped_batches = [batch for batch_sampler in batch_samplers for batch in batch_sampler]
+    indices = np.random.default_rng(0).permutation(NUM_SAMPLES).tolist()
+    random_batches = [indices[i : i + BATCH_SIZE] for i in range(0, len(grouped_batches) * BATCH_SIZE, BATCH_SIZE)]
+
+    assert get_padding(grouped_batches) < get_padding(random_batches) / 4
+
+
+def test_token_budget_batches_stay_within_budget() -> None:
+    batch_samplers = create_rank_samplers(
+        TokenBudgetBatchSampler, batch_size=64, drop_last=True, lengths=LENGTHS, max_tokens=MAX_TOKENS, shuffle=True
+    )
+    batches = [batch for batch_sampler in batch_samplers for batch in batch_sampler]
+
+    assert all(len(batch) * max(LENGTHS[idx] for idx in batch) <= MAX_TOKENS for batch in batches)
+    assert all(len(batch) <= 64 for batch in batches)
+    assert len({len(batch) for batch in batches}) > 1
+
+
+def test_token_budget_ranks_get_disjoint_batches_of_equal_count() -> None:
+    batch_samplers = create_rank_samplers(
+        TokenBudgetBatchSampler, batch_size=64, drop_last=True, lengths=LENGTHS, max_tokens=MAX_TOKENS, shuffle=True
+    )
+    rank_batches = [list(batch_sampler) for batch_sampler in batch_samplers]
+
+    assert len({len(batches) for batches in rank_batches}) == 1
+    all_indices = [idx for batches in rank_batches for batch in batches for idx in batch]
+    assert len(all_indices) == len(set(all_indices))
+
+
+def test_token_budget_epochs_are_reproducible() -> None:
+    kwargs = {"batch_size": 64, "drop_last": True, "lengths": LENGTHS, "max_tokens": MAX_TOKENS, "shuffle": True}
+    first_run = [list(batch_sampler) for batch_sampler in create_rank_samplers(TokenBudgetBatchSampler, epoch=1, **kwargs)]
+    second_run = [list(batch_sampler) for batch_sampler in create_rank_samplers(TokenBudgetBatchSampler, epoch=1, **kwargs)]
+
+    assert first_run == second_run
+
+
+@pytest.mark.parametrize(
+    "sampler_class, kwargs",
+    [
+        (ShardedBatchSampler, {}),
+        (LengthGroupedBatchSampler, {"lengths": LENGTHS}),
+        (TokenBudgetBatchSampler, {"lengths": LENGTHS, "max_tokens": MAX_TOKENS}),
+    ],
+)
+@pytest.mark.parametrize("resume_batch_idx", [0, 1, 7])
+def test_resuming_mid_epoch_yields_the_remaining_batches(sampler_class: type, kwargs: Any, resume_batch_idx: int) -> None:
+    kwargs = {"batch_size": BATCH_SIZE, "drop_last": False, "shuffle": True, "seed": 7, **kwargs}
+    uninterrupted = [list(batch_sampler) for batch_sampler in create_rank_samplers(sampler_class, epoch=2, **kwargs)]
+    resumed_samplers = create_rank_samplers(
+        sampler_class, epoch=2, resume_epoch=2, resume_batch_idx=resume_batch_idx, **kwargs
+    )
+
+    for batches, batch_sampler in zip(uninterrupted, resumed_samplers):
+        assert list(batch_sampler) == batches[resume_batch_idx:]
+        assert len(batch_sampler) == len(batches)
+
+
+def test_resume_only_skips_batches_of_the_resumed_epoch() -> None:
+    kwargs = {"batch_size": BATCH_SIZE, "drop_last": False, "shuffle": True}
+    uninterrupted = [list(batch_sampler) for batch_sampler in create_rank_samplers(ShardedBatchSampler, epoch=3, **kwargs)]
+    resumed = [
+        list(batch_sampler)
+        for batch_sampler in create_rank_samplers(ShardedBatchSampler, epoch=3, resume_epoch=2, resume_batch_idx=5, **kwargs)
+    ]
+
+    assert resumed == uninterrupted
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pytest
+from transformers import BertConfig, BertTokenizerFast
+
+WORDS = ["the", "a", "movie", "film", "was", "is", "good", "bad", "great", "terrible", "acting", "plot", "not", "very"]
+
+
+@pytest.fixture(scope="session")
+def bert_config() -> BertConfig:
+    '''Small randomly initialized BERT, big enough to prune layers, heads and neurons twice'''
+    return BertConfig(
+        vocab_size=5 + len(WORDS),
+        hidden_size=32,
+        num_hidden_layers=4,
+        num_attention_heads=4,
+        intermediate_size=64,
+        max_position_embeddings=64,
+    )
+
+
+@pytest.fixture(scope="session")
+def bert_dir(tmp_path_factory: pytest.TempPathFactory, bert_config: BertConfig) -> str:
+    '''Directory with the config and a word level tokenizer of bert_config, as HuggingFaceBackbone loads them'''
+    path = tmp_path_factory.mktemp("bert")
+    vocab_file = path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n")
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(str(path))
+    bert_config.save_pretrained(str(path))
+    return str(path)
@@ -0,0 +1,54 @@
+import copy
+
+import pytest
+import torch
+from transformers import BertConfig, BertModel
+
+from jeffrey.models.lora import LoRALinear, inject_lora, merge_lora, merge_lora_state_dict
+
+RANK = 4
+ALPHA = 8.0
+
+
+@pytest.fixture
+def lora_model(bert_config: BertConfig) -> BertModel:
+    '''Model with LoRA layers whose updates are not zero, as after training'''
+    torch.manual_seed(0)
+    model = BertModel(bert_config)
+    inject_lora(model, RANK, ALPHA)
+    for module in model.modules():
+        if isinstance(module, LoRALinear):
+            torch.nn.init.normal_(module.lora_B, std=0.1)
+    return model.eval()
+
+
+def get_inputs(bert_config: BertConfig) -> dict[str, torch.Tensor]:
+    input_ids = torch.randint(5, bert_config.vocab_size, (3, 10), generator=torch.Generator().manual_seed(0))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 6:] = 0
+    attention_mask[2, 3:] = 0
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+@torch.no_grad()
+def test_merged_state_dict_loads_into_the_plain_model(lora_model: BertModel, bert_config: BertConfig) -> None:
+    plain_model = BertModel(bert_config).eval()
+    plain_model.load_state_dict(merge_lora_state_dict(lora_model.state_dict(), ALPHA / RANK))
+
+    inputs = get_inputs(bert_config)
+    expected = lora_model(**inputs)
+    output = plain_model(**inputs)
+    torch.testing.assert_close(output.last_hidden_state, expected.last_hidden_state, atol=1e-5, rtol=1e-4)
+    torch.testing.assert_close(output.pooler_output, expected.pooler_output, atol=1e-5, rtol=1e-4)
+
+
+@torch.no_grad()
+def test_merged_layers_compute_the_lora_model(lora_model: BertModel, bert_config: BertConfig) -> None:
+    merged_model = copy.deepcopy(lora_model)
+    merge_lora(merged_model)
+    assert not any(isinstance(module, LoRALinear) for module in merged_model.modules())
+
+    inputs = get_inputs(bert_config)
+    torch.testing.assert_close(
+        merged_model(**inputs).last_hidden_state, lora_model(**inputs).last_hidden_state, atol=1e-5, rtol=1e-4
+    )
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+from jeffrey.models.backbones import HuggingFaceBackbone
+from jeffrey.models.transformations import PACKED_EXAMPLE_POSITIONS_KEY, HuggingFaceTokenizationTransformation
+
+MAX_SEQUENCE_LEN = 24
+TEXTS = [
+    "the movie was good",
+    "a very very bad film , not great",
+    "good",
+    "the plot is terrible and the acting is bad",
+    "great film",
+    "not a good movie , the acting was very bad and the plot was not great",
+]
+
+
+@pytest.fixture
+def backbone(bert_dir: str) -> HuggingFaceBackbone:
+    torch.manual_seed(0)
+    transformation = HuggingFaceTokenizationTransformation(bert_dir, MAX_SEQUENCE_LEN)
+    return HuggingFaceBackbone(bert_dir, transformation, pretrained=False).eval()
+
+
+@torch.no_grad()
+def test_packed_outputs_match_unpacked_examples_in_order(backbone: HuggingFaceBackbone) -> None:
+    transformation = backbone.get_transformation()
+    assert isinstance(transformation, HuggingFaceTokenizationTransformation)
+    input_ids = transformation.encode(TEXTS)
+    encodings = transformation.pack(input_ids)
+
+    example_positions = encodings[PACKED_EXAMPLE_POSITIONS_KEY]
+    assert len(encodings["input_ids"]) < len(TEXTS)  # Several examples share a row
+    assert example_positions[:, 2].tolist() == [len(ids) for ids in input_ids]
+
+    output = backbone(encodings)
+    assert output.last_hidden_state.shape[0] == len(TEXTS)
+    for idx, ids in enumerate(input_ids):
+        # Example by itself, unpadded
+        expected = backbone(transformation.pad([ids]))
+        length = len(ids)
+        torch.testing.assert_close(output.last_hidden_state[idx, :length], expected.last_hidden_state[0], atol=1e-5, rtol=1e-4)
+        torch.testing.assert_close(output.pooler_output[idx], expected.pooler_output[0], atol=1e-5, rtol=1e-4)
+        assert output.attention_mask[idx].sum() == length
+        assert output.last_hidden_state[idx, length:].abs().sum() == 0
@@ -0,0 +1,47 @@
+import copy
+
+import torch
+from transformers import BertConfig, BertModel
+
+from jeffrey.models.pruning import (
+    apply_pruned_layout,
+    get_pruned_layout,
+    get_remaining_heads,
+    prune_attention_heads,
+    prune_ffn_neurons,
+    remove_layers
+)
+
+
+def prune(model: BertModel, layer_idx: int, num_heads: int, num_neurons: int) -> None:
+    '''Remove a layer, then the first remaining heads and the last neurons of every other layer'''
+    remove_layers(model, [layer_idx])
+    for layer in model.encoder.layer:
+        prune_attention_heads(layer, get_remaining_heads(layer, model.config.num_attention_heads)[:num_heads])
+        prune_ffn_neurons(layer, torch.arange(layer.intermediate.dense.out_features - num_neurons))
+
+
+@torch.no_grad()
+def test_pruned_layout_rebuilds_a_model_pruned_twice(bert_config: BertConfig) -> None:
+    torch.manual_seed(0)
+    model = BertModel(copy.deepcopy(bert_config)).eval()  # Pruning changes the config of the model
+    prune(model, layer_idx=1, num_heads=1, num_neurons=16)
+    prune(model, layer_idx=0, num_heads=1, num_neurons=8)
+
+    num_layers, pruned_heads, intermediate_sizes = get_pruned_layout(model)
+    assert num_layers == bert_config.num_hidden_layers - 2
+    assert pruned_heads == [[0, 1]] * num_layers
+    assert intermediate_sizes == [bert_config.intermediate_size - 24] * num_layers
+
+    rebuilt_model = BertModel(copy.deepcopy(bert_config)).eval()
+    apply_pruned_layout(rebuilt_model, num_layers, pruned_heads, intermediate_sizes)
+    assert rebuilt_model.state_dict().keys() == model.state_dict().keys()
+    rebuilt_model.load_state_dict(model.state_dict())
+
+    input_ids = torch.randint(5, bert_config.vocab_size, (2, 9))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 5:] = 0
+    expected = model(input_ids=input_ids, attention_mask=attention_mask)
+    output = rebuilt_model(input_ids=input_ids, attention_mask=attention_mask)
+    torch.testing.assert_close(output.last_hidden_state, expected.last_hidden_state)
+    torch.testing.assert_close(output.pooler_output, expected.pooler_output)
@@ -0,0 +1,30 @@
+import torch
+from transformers import BertConfig, BertModel
+
+from jeffrey.models.unpadded import bert_unpadded_forward
+
+LENGTHS = [12, 1, 7, 4]
+SEQ_LEN = 14  # Longer than every example: padded columns only
+
+
+@torch.no_grad()
+def test_unpadded_forward_matches_the_padded_model(bert_config: BertConfig) -> None:
+    torch.manual_seed(0)
+    model = BertModel(bert_config).eval()
+    input_ids = torch.randint(5, bert_config.vocab_size, (len(LENGTHS), SEQ_LEN))
+    attention_mask = (torch.arange(SEQ_LEN).unsqueeze(0) < torch.tensor(LENGTHS).unsqueeze(1)).long()
+    input_ids[attention_mask == 0] = 0
+    token_type_ids = torch.zeros_like(input_ids)
+    token_type_ids[:, 2:] = 1
+
+    expected = model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+    last_hidden_state, pooler_output, output_attention_mask = bert_unpadded_forward(
+        model, input_ids, attention_mask, token_type_ids
+    )
+
+    max_length = max(LENGTHS)
+    assert torch.equal(output_attention_mask, attention_mask[:, :max_length])
+    mask = output_attention_mask.bool()
+    torch.testing.assert_close(last_hidden_state[mask], expected.last_hidden_state[:, :max_length][mask], atol=1e-5, rtol=1e-4)
+    assert last_hidden_state[~mask].abs().sum() == 0
+    torch.testing.assert_close(pooler_output, expected.pooler_output, atol=1e-5, rtol=1e-4)